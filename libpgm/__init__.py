@@ -1 +1 @@
-__all__ = ['CPDtypes', 'dictionary', 'discretebayesiannetwork', 'graphskeleton', 'hybayesiannetwork', 'lgbayesiannetwork', 'nodedata', 'orderedskeleton', 'pgmlearner', 'sampleaggregator', 'tablecpdfactor', 'tablecpdfactorization']
+__all__ = ['CPDtypes', 'dictionary', 'discretebayesiannetwork', 'graphskeleton', 'hybayesiannetwork', 'lgbayesiannetwork', 'nodedata', 'orderedskeleton', 'pgmlearner', 'sampleaggregator', 'tablecpdfactor', 'tablecpdfactorization', 'arraycpdfactor', 'eliminationorder', 'junctiontree', 'queryplan', 'logcpdfactor', 'sparsecpdfactor', 'minibucket', 'loopybp', 'polytree', 'arithmeticcircuit', 'recursiveconditioning', 'cutsetconditioning']
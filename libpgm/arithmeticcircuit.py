@@ -0,0 +1,367 @@
+# Copyright (c) 2012, CyberPoint International, LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the CyberPoint International, LLC nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL CYBERPOINT INTERNATIONAL, LLC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+This module compiles discrete Bayesian networks into arithmetic circuits. An arithmetic circuit is a directed acyclic graph of sums and products whose leaves are the CPD parameters and one evidence indicator per value of each vertex. Evaluated with the indicators of the values consistent with some evidence set to one and the others to zero, it gives the probability of the evidence; differentiated with respect to the indicators, it gives the joint probability of each value of each vertex with the evidence, i.e. all the posteriors at once. Compiling takes as long as one run of variable elimination, whose steps the circuit records; afterwards each query is a pass over flat arrays. For more information cf. Darwiche, "A differential approach to inference in Bayesian networks", J. ACM 50(3), 2003, and Koller et al. Ch. 9.
+
+'''
+try:
+    import numpy as np
+except ImportError:
+    raise ImportError("numpy is not installed on your system.")
+
+import itertools
+import json
+
+from .tablecpdfactor import TableCPDFactor
+from . import eliminationorder
+
+PRODUCT = 0
+'''The kind of a batch of product nodes.'''
+
+SUM = 1
+'''The kind of a batch of sum nodes.'''
+
+class ArithmeticCircuit:
+    '''Arithmetic circuit of a discrete CPD Bayesian network.
+
+    The nodes of the circuit are numbered so that every node comes
+    after its children. The first nodes are the leaves: the parameters
+    in *parameters*, then the indicators of the values of each vertex.
+    The inner nodes are created in batches of nodes of the same kind
+    and with the same number of children, so that a batch is evaluated
+    by a single vectorized numpy operation, and the whole circuit is
+    held in a few flat integer arrays that *save* and *load* write and
+    read without any parsing.
+
+    All the queries take several cases at once: each case is one more
+    column in the same pass over the circuit.
+
+    Usage example: this code would compile a network once, save it,
+    and answer queries from the loaded circuit::
+
+        from libpgm.nodedata import NodeData
+        from libpgm.discretebayesiannetwork import DiscreteBayesianNetwork
+        from libpgm.arithmeticcircuit import ArithmeticCircuit
+
+        nd = NodeData.load("../tests/unittestdict.txt")
+        bn = DiscreteBayesianNetwork(nd)
+        ArithmeticCircuit(bn).save("unittestdict.npz")
+
+        ac = ArithmeticCircuit.load("unittestdict.npz")
+        print ac.specificquery(dict(Grade=['A']), dict(Letter='weak'))
+        print ac.marginals(dict(Letter='weak'))
+
+    '''
+    def __init__(self, bn, heuristic='minfill'):
+        '''
+        Compile the :doc:`DiscreteBayesianNetwork <discretebayesiannetwork>` *bn*, eliminating its vertices in the order chosen by *heuristic* (see :doc:`eliminationorder`).
+
+        Each CPD becomes a table of product nodes, each multiplying a parameter with the indicator of the value of the vertex. Each step of variable elimination then becomes a batch of product nodes, one per entry of the product of the factors of the step, followed by a batch of sum nodes summing out the vertex. The root multiplies what is left.
+
+        '''
+        self.V = list(bn.V)
+        '''A list of the names of the vertices.'''
+        self.vals = dict((vertex, list(bn.Vdata[vertex]["vals"]))
+                         for vertex in self.V)
+        '''A dict of {vertex: list of values} pairs.'''
+        self.parents = dict((vertex, list(bn.Vdata[vertex]["parents"]))
+                            for vertex in self.V)
+        '''A dict of {vertex: list of parents} pairs.'''
+
+        tables = [TableCPDFactor(vertex, bn) for vertex in self.V]
+        self.paramoffset = {}
+        '''A dict of {vertex: index} pairs giving the first parameter of the CPD of each vertex, which are laid out as *vals* of a :doc:`TableCPDFactor <tablecpdfactor>`.'''
+        self.indicatoroffset = {}
+        '''A dict of {vertex: node} pairs giving the indicator of the first value of each vertex; the indicators of the other values follow.'''
+        offset = 0
+        for vertex, table in zip(self.V, tables):
+            self.paramoffset[vertex] = offset
+            offset += len(table.vals)
+        for vertex in self.V:
+            self.indicatoroffset[vertex] = offset
+            offset += len(self.vals[vertex])
+        self.parameters = np.array(
+            [val for table in tables for val in table.vals], dtype=float)
+        '''An ndarray of the values of the parameter leaves.'''
+        self.leaves = offset
+        '''The number of leaves.'''
+        self.size = offset
+        '''The number of nodes.'''
+
+        self.kinds = []
+        '''A list holding the kind of each batch, *PRODUCT* or *SUM*.'''
+        self.starts = []
+        '''A list holding the first node of each batch.'''
+        self.arities = []
+        '''A list holding the number of children of each node of each batch.'''
+        self.children = []
+        '''A list holding, for each batch, an ndarray of shape (nodes, arity) of the children of its nodes.'''
+
+        def multiply(factors):
+            if len(factors) == 1:
+                return factors[0]
+            scope = []
+            for fscope, _ in factors:
+                scope.extend(vertex for vertex in fscope if vertex not in scope)
+            ids = np.broadcast_arrays(*[broadcast(ids, fscope, scope)
+                                        for fscope, ids in factors])
+            nodes = self.newbatch(PRODUCT, np.stack(ids, axis=-1))
+            return scope, nodes
+
+        def sumout(factor, vertex):
+            scope, ids = factor
+            axis = scope.index(vertex)
+            ids = np.moveaxis(ids, axis, -1)
+            return scope[:axis] + scope[axis+1:], self.newbatch(SUM, ids)
+
+        factors = []
+        for vertex, table in zip(self.V, tables):
+            start = self.paramoffset[vertex]
+            params = np.arange(start, start + len(table.vals)).reshape(
+                table.card, order='F')
+            indicators = self.indicatoroffset[vertex] + np.arange(table.card[0])
+            factors.append(multiply([(table.scope, params),
+                                     ([vertex], indicators)]))
+
+        card = dict((vertex, len(self.vals[vertex])) for vertex in self.V)
+        order, _ = eliminationorder.eliminationorder(
+            [scope for scope, _ in factors], card, self.V, heuristic)
+        self.order = order
+        '''The elimination order the circuit was compiled with.'''
+        for vertex in order:
+            bucket = [factor for factor in factors if vertex in factor[0]]
+            factors = [factor for factor in factors if vertex not in factor[0]]
+            factors.append(sumout(multiply(bucket), vertex))
+        self.root = int(multiply(factors)[1])
+        '''The root node, whose value is the probability of the evidence.'''
+
+    def newbatch(self, kind, children):
+        '''Add a batch of nodes of *kind* whose children are given by the ndarray *children*, whose last axis runs over the children of one node. Return an ndarray of the new nodes, shaped as the other axes of *children*.'''
+        shape = children.shape[:-1]
+        children = children.reshape(-1, children.shape[-1])
+        self.kinds.append(kind)
+        self.starts.append(self.size)
+        self.arities.append(children.shape[1])
+        self.children.append(children)
+        nodes = np.arange(self.size, self.size + len(children)).reshape(shape)
+        self.size += len(children)
+        return nodes
+
+    def batches(self):
+        '''Iterate over the batches as tuples (kind, nodes, children), where *nodes* is the slice of the nodes of the batch.'''
+        for kind, start, children in zip(self.kinds, self.starts, self.children):
+            yield kind, slice(start, start + len(children)), children
+
+    def indicators(self, cases):
+        '''
+        Return the indicator values of a list of *cases*, an ndarray with one row per indicator and one column per case.
+
+        Each case is a dict of {vertex: value} pairs, or of {vertex: list of values} pairs for events like those of *specificquery*. The indicators of the values a case allows are one, the others zero; all the values of a vertex not in the case are allowed.
+
+        '''
+        indicators = np.ones((self.leaves - len(self.parameters), len(cases)))
+        start = len(self.parameters)
+        for column, case in enumerate(cases):
+            for vertex, allowed in case.items():
+                if not isinstance(allowed, (list, tuple, set)):
+                    allowed = [allowed]
+                vals = self.vals[vertex]
+                for value in allowed:
+                    assert value in vals, "Unknown value %r of %r." % (value, vertex)
+                offset = self.indicatoroffset[vertex] - start
+                for index, value in enumerate(vals):
+                    if value not in allowed:
+                        indicators[offset + index, column] = 0.
+        return indicators
+
+    def evaluate(self, cases):
+        '''
+        Evaluate the circuit for a list of *cases* (see *indicators*) in one upward pass.
+
+        Returns:
+            An ndarray of the values of all the nodes, with one row per node and one column per case. The row of *root* holds the probability of each case.
+
+        '''
+        values = np.empty((self.size, len(cases)))
+        values[:len(self.parameters)] = self.parameters[:, np.newaxis]
+        values[len(self.parameters):self.leaves] = self.indicators(cases)
+        for kind, nodes, children in self.batches():
+            if kind == PRODUCT:
+                values[nodes] = values[children].prod(axis=1)
+            else:
+                values[nodes] = values[children].sum(axis=1)
+        return values
+
+    def differentiate(self, values):
+        '''
+        Return the partial derivatives of the root with respect to all the nodes, in one downward pass over the circuit evaluated to *values* by *evaluate*.
+
+        The derivative of a child of a product node takes the product of its siblings, which is formed from prefix and suffix products, so that no division by a zero value is needed.
+
+        '''
+        derivatives = np.zeros_like(values)
+        derivatives[self.root] = 1.
+        for kind, nodes, children in reversed(list(self.batches())):
+            parents = derivatives[nodes][:, np.newaxis, :]
+            if kind == PRODUCT:
+                operands = values[children]
+                ones = np.ones_like(operands[:, :1])
+                prefix = np.cumprod(np.concatenate([ones, operands[:, :-1]], axis=1), axis=1)
+                suffix = np.cumprod(np.concatenate([ones, operands[:, :0:-1]], axis=1), axis=1)[:, ::-1]
+                contributions = parents * prefix * suffix
+            else:
+                contributions = np.broadcast_to(parents, children.shape + parents.shape[2:])
+            np.add.at(derivatives, children, contributions)
+        return derivatives
+
+    def probability(self, evidence=None):
+        '''Return the probability of *evidence*, a dict as in *indicators*.'''
+        return float(self.evaluate([evidence or {}])[self.root, 0])
+
+    def specificquery(self, query, evidence=None):
+        '''
+        Return the probability of the event specified by *query* given *evidence*, with the arguments of *specificquery* in :doc:`TableCPDFactorization <tablecpdfactorization>`. Both probabilities of the ratio are computed in the same upward pass.
+
+        '''
+        if evidence is None:
+            evidence = {}
+        assert not set(query) & set(evidence), "Query and evidence must not overlap."
+        joint = dict(evidence)
+        joint.update(query)
+        values = self.evaluate([joint, evidence])[self.root]
+        return float(values[0] / values[1])
+
+    def marginals(self, evidence=None):
+        '''
+        Return the posterior distribution of every vertex given *evidence*, from one upward and one downward pass.
+
+        The derivative of the root with respect to the indicator of a value of an unobserved vertex is the joint probability of that value and the evidence.
+
+        Returns:
+            A dict of {vertex: {value: probability}} pairs, in the format of the *avg* attribute of :doc:`SampleAggregator <sampleaggregator>`.
+
+        '''
+        if evidence is None:
+            evidence = {}
+        values = self.evaluate([evidence])
+        derivatives = self.differentiate(values)[:, 0]
+        probability = values[self.root, 0]
+        result = {}
+        for vertex in self.V:
+            vals = self.vals[vertex]
+            if vertex in evidence:
+                ps = [float(value == evidence[vertex]) for value in vals]
+            else:
+                start = self.indicatoroffset[vertex]
+                ps = (derivatives[start:start + len(vals)] / probability).tolist()
+            result[vertex] = dict(zip(vals, ps))
+        return result
+
+    def sensitivity(self, query, evidence=None):
+        '''
+        Return the partial derivatives of the probability of the event specified by *query* given *evidence* with respect to every CPD parameter, from one upward and one downward pass.
+
+        Arguments:
+            1. *query* -- A dict of {vertex: list of values} pairs, as for *specificquery*.
+            2. *evidence* -- A dict of {vertex: value} pairs.
+
+        Returns:
+            A dict of {vertex: derivatives} pairs, where *derivatives* is laid out like the "cprob" entry of the vertex in *Vdata* of :doc:`DiscreteBayesianNetwork <discretebayesiannetwork>`: a list with one derivative per value for a vertex without parents, else a dict of {tuple of parent values: list} pairs.
+
+        The probability is the ratio of the values *a* and *b* of the root for the cases of the query with the evidence and of the evidence alone, which are evaluated and differentiated as two columns of the same passes. Its derivative by a parameter is then (a' b - a b') / b^2. Each parameter is treated as a free variable, i.e. the other entries of its distribution are held fixed.
+
+        '''
+        if evidence is None:
+            evidence = {}
+        assert not set(query) & set(evidence), "Query and evidence must not overlap."
+        joint = dict(evidence)
+        joint.update(query)
+        values = self.evaluate([joint, evidence])
+        derivatives = self.differentiate(values)[:len(self.parameters)]
+        a, b = values[self.root]
+        gradient = (derivatives[:, 0] * b - a * derivatives[:, 1]) / (b * b)
+        return self.keyed(gradient)
+
+    def keyed(self, array):
+        '''Return *array*, holding one number per parameter, split by vertex and laid out like the "cprob" entries of *Vdata*, see *sensitivity*.'''
+        array = np.asarray(array)
+        result = {}
+        for vertex in self.V:
+            card = len(self.vals[vertex])
+            start = self.paramoffset[vertex]
+            parents = self.parents[vertex]
+            if not parents:
+                result[vertex] = array[start:start + card].tolist()
+                continue
+            keys = itertools.product(*[self.vals[parent] for parent in parents])
+            result[vertex] = dict(
+                (key, array[start + card * i:start + card * (i + 1)].tolist())
+                for i, key in enumerate(keys))
+        return result
+
+    def save(self, path):
+        '''Write the circuit to the file *path* in numpy's ``.npz`` format.'''
+        header = dict(V=self.V, vals=self.vals, parents=self.parents,
+                      paramoffset=self.paramoffset,
+                      indicatoroffset=self.indicatoroffset,
+                      order=self.order, leaves=self.leaves,
+                      size=self.size, root=self.root)
+        children = [children.ravel() for children in self.children]
+        np.savez(path,
+                 header=np.array(json.dumps(header)),
+                 parameters=self.parameters,
+                 kinds=np.array(self.kinds, dtype=np.int8),
+                 starts=np.array(self.starts, dtype=np.int64),
+                 arities=np.array(self.arities, dtype=np.int64),
+                 children=np.concatenate(children) if children
+                          else np.zeros(0, dtype=np.int64))
+
+    @classmethod
+    def load(cls, path):
+        '''Return the circuit written to the file *path* by *save*.'''
+        self = cls.__new__(cls)
+        with np.load(path) as data:
+            header = json.loads(str(data["header"]))
+            self.__dict__.update(header)
+            self.parameters = data["parameters"]
+            self.kinds = data["kinds"].tolist()
+            self.starts = data["starts"].tolist()
+            self.arities = data["arities"].tolist()
+            flat = data["children"]
+        self.children = []
+        offset = 0
+        for start, end, arity in zip(self.starts, self.starts[1:] + [self.size],
+                                     self.arities):
+            count = (end - start) * arity
+            self.children.append(flat[offset:offset + count].reshape(-1, arity))
+            offset += count
+        return self
+
+def broadcast(ids, scope, target):
+    '''Return the ndarray *ids*, with one axis per vertex of *scope*, arranged for broadcasting against *target*, as *broadcast* in :doc:`ArrayCPDFactor <arraycpdfactor>` does.'''
+    order = sorted(range(len(scope)), key=lambda i: target.index(scope[i]))
+    shape = [ids.shape[scope.index(vertex)] if vertex in scope else 1
+             for vertex in target]
+    return ids.transpose(order).reshape(shape)
@@ -0,0 +1,310 @@
+# Copyright (c) 2012, CyberPoint International, LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the CyberPoint International, LLC nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL CYBERPOINT INTERNATIONAL, LLC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''This module provides a factorized representation of a node whose
+values are held in a numpy array instead of a flat Python list. It is
+interchangeable with :doc:`TableCPDFactor <tablecpdfactor>`, but
+multiplying and summing out are carried out by numpy, which makes it
+much faster on large CPD tables.
+
+'''
+try:
+    import numpy as np
+except ImportError:
+    raise ImportError("numpy is not installed on your system.")
+
+from .tablecpdfactor import TableCPDFactor
+
+class ArrayCPDFactor(TableCPDFactor):
+    """Factorized representation of a CPD table backed by an ndarray.
+
+    The values are held in *values*, an array with one axis per
+    variable in *scope*, shaped by *card*. It is stored in Fortran
+    order, so that *vals* is a flat view with exactly the layout
+    (and the *stride*) of a :doc:`TableCPDFactor <tablecpdfactor>`.
+
+    """
+    entrysize = 8
+    '''The number of bytes taken by one entry of *values*.'''
+
+    def __init__(self, vertex, bn):
+        '''Construct a factorized CPD table from a vertex in a discrete
+        Bayesian network.
+
+        The arguments are the same as for :doc:`TableCPDFactor
+        <tablecpdfactor>`: a *vertex* name and the
+        :doc:`DiscreteBayesianNetwork <discretebayesiannetwork>` it
+        lives in.
+
+        '''
+        table = TableCPDFactor(vertex, bn)
+        self.inputvertex = vertex
+        '''The name of the vertex.'''
+        self.inputbn = bn
+        '''The :doc:`DiscreteBayesianNetwork <discretebayesiannetwork>` instance that the vertex lives in.'''
+        self.scope = table.scope
+        '''An array of vertices that affect the values found in *values*. Normally, this is the node itself and its parents.'''
+        self.card = table.card
+        '''A list of the cardinalities of each vertex in *scope*, which is also the shape of *values*.'''
+        self.values = np.array(
+            table.vals, dtype=float).reshape(self.card, order='F')
+        '''An ndarray of the values from the CPD, with one axis per vertex in *scope*.'''
+
+    @classmethod
+    def fromfactor(cls, factor):
+        '''Return an instance of this class holding the same values as
+        *factor*, which may be a :doc:`TableCPDFactor <tablecpdfactor>`.'''
+        copy = cls.__new__(cls)
+        copy.inputvertex = factor.inputvertex
+        copy.inputbn = factor.inputbn
+        copy.scope = factor.scope[:]
+        copy.card = factor.card[:]
+        copy.values = np.array(
+            factor.vals, dtype=float).reshape(copy.card, order='F')
+        return copy
+
+    @classmethod
+    def fromarray(cls, scope, values, bn):
+        '''Return an instance of this class over the vertices in *scope*
+        of the network *bn*, holding the ndarray *values*.'''
+        factor = cls.__new__(cls)
+        factor.inputvertex = None
+        factor.inputbn = bn
+        factor.scope = list(scope)
+        factor.card = [len(bn.Vdata[vertex]["vals"]) for vertex in scope]
+        values = np.asarray(values, dtype=float)
+        if values.shape != tuple(factor.card):
+            values = values.reshape(factor.card, order='F')
+        factor.values = values
+        return factor
+
+    @property
+    def vals(self):
+        '''A flat view of *values*, laid out as in :doc:`TableCPDFactor <tablecpdfactor>`.'''
+        return self.values.reshape(-1, order='F')
+
+    @vals.setter
+    def vals(self, vals):
+        self.values = np.asarray(vals, dtype=float).reshape(
+            self.card, order='F')
+
+    @property
+    def stride(self):
+        '''A dict of {vertex: value} pairs for each vertex in *scope*, giving the stride of that vertex in *vals*.'''
+        stride = {}
+        t_stride = 1
+        for t_scope, t_card in zip(self.scope, self.card):
+            stride[t_scope] = t_stride
+            t_stride *= t_card
+        return stride
+
+    def broadcast(self, scope):
+        '''Return *values* arranged for broadcasting against *scope*.
+
+        The axes are permuted to follow the order of *scope*, and an
+        axis of length one is inserted for each vertex of *scope*
+        missing from this factor. The result is a view of *values*.
+
+        '''
+        order = sorted(range(len(self.scope)),
+                       key=lambda i: scope.index(self.scope[i]))
+        shape = [self.card[self.scope.index(t_scope)]
+                 if t_scope in self.scope else 1
+                 for t_scope in scope]
+        return self.values.transpose(order).reshape(shape)
+
+    def combinefactor(self, other, operation):
+        '''Combine this factor with another factor.
+
+        The scope of the result is the scope of this factor followed
+        by the variables of *other* that it does not already contain.
+        The result is computed by broadcasting both value arrays
+        against that scope, so *operation* must work elementwise on
+        arrays, like ``operator.mul`` used by *multiplyfactor*.
+
+        Arguments:
+            1. *other* -- An instance of :doc:`TableCPDFactor <tablecpdfactor>` or of this class representing the factor to combine with.
+            2. *operation* -- An elementwise function of two arrays.
+
+        Attributes modified:
+            *values*, *scope*, *card* -- Modified to reflect the data of the new product factor.
+
+        '''
+        if not isinstance(other, ArrayCPDFactor):
+            other = ArrayCPDFactor.fromfactor(other)
+
+        extra = [t_scope for t_scope in other.scope
+                 if t_scope not in self.scope]
+        scope = self.scope + extra
+        card = self.card + [other.card[other.scope.index(t_scope)]
+                            for t_scope in extra]
+
+        values = self.values[(Ellipsis,) + (None,) * len(extra)]
+        self.values = np.asarray(operation(values, other.broadcast(scope)),
+                                 order='F')
+        self.scope = scope
+        self.card = card
+
+    def reducefactor(self, vertex, value=None, maximize=False, minimize=False):
+        '''Sum out the variable specified by *vertex* from the factor,
+        or, if *value* is given, keep only the entries where *vertex*
+        takes that value.
+
+        Arguments:
+            1. *vertex* -- The name of the variable to be removed.
+            2. *value* -- (Optional) The observed value of *vertex*.
+            3. *maximize* -- (Optional) If true, maximize *vertex* out instead of summing it out.
+            4. *minimize* -- (Optional) If true, minimize *vertex* out instead of summing it out.
+
+        Attributes modified:
+            *values*, *scope*, *card* -- Modified to reflect the data of the reduced factor.
+
+        '''
+        axis = self.scope.index(vertex)
+        if maximize:
+            values = self.values.max(axis=axis)
+        elif minimize:
+            values = self.values.min(axis=axis)
+        elif value is None:
+            values = self.values.sum(axis=axis)
+        else:
+            index = self.inputbn.Vdata[vertex]['vals'].index(value)
+            values = self.values.take(index, axis=axis)
+
+        self.scope = self.scope[:axis] + self.scope[axis+1:]
+        self.card = self.card[:axis] + self.card[axis+1:]
+        self.values = np.asarray(values, order='F')
+        return self
+
+    sumout = reducefactor
+
+    def sumproduct(self, others, vertex, path=None):
+        '''Multiply this factor by each factor in *others* and sum out
+        *vertex*, as *sumproduct* in :doc:`TableCPDFactor
+        <tablecpdfactor>`.
+
+        The operands are contracted over *vertex* by a single call of
+        *contract*, which sums the products entry by entry without
+        building the product over the full scope. If *path* is
+        given, the contraction follows it pairwise.
+
+        '''
+        operands = [(self.values, self.scope)]
+        for other in others:
+            if not isinstance(other, ArrayCPDFactor):
+                other = ArrayCPDFactor.fromfactor(other)
+            operands.append((other.values, other.scope))
+        self.absorb(operands, vertex, path)
+        return self
+
+    def absorb(self, operands, vertex, path=None):
+        '''Set *values* to the contraction of *operands*, a list of
+        (values, scope) pairs, over *vertex*, following *path* if given.'''
+        scope = []
+        card = []
+        for values, opscope in operands:
+            for t_scope, t_card in zip(opscope, values.shape):
+                if t_scope != vertex and t_scope not in scope:
+                    scope.append(t_scope)
+                    card.append(t_card)
+        self.values = np.asarray(contract(operands, scope, path), order='F')
+        self.scope = scope
+        self.card = card
+
+    def reduced(self, evidence):
+        '''Return this factor reduced by *evidence*, leaving it unchanged.
+
+        Arguments:
+            1. *evidence* -- A dict of {vertex: value} pairs. Vertices outside *scope* are ignored.
+
+        The values of the result are a read-only view into *values*:
+        nothing is copied, and any attempt to write to the view in
+        place raises an error instead of changing this factor.
+
+        '''
+        index = []
+        scope = []
+        for t_scope in self.scope:
+            if t_scope in evidence:
+                index.append(self.inputbn.Vdata[t_scope]['vals'].index(
+                    evidence[t_scope]))
+            else:
+                index.append(slice(None))
+                scope.append(t_scope)
+        values = self.values[tuple(index)]
+        if isinstance(values, np.ndarray):
+            values.flags.writeable = False
+        factor = self.fromarray(scope, values, self.inputbn)
+        factor.inputvertex = self.inputvertex
+        return factor
+
+    def normalize(self):
+        '''Scale the values of the factor to sum to one, unless they are all zero.'''
+        norm = self.values.sum()
+        if norm:
+            self.values = self.values / norm
+        return self
+
+    def copy(self):
+        '''Return a copy of the factor.'''
+        copy = type(self).__new__(type(self))
+        copy.inputvertex = self.inputvertex
+        copy.inputbn = self.inputbn
+        copy.scope = self.scope[:]
+        copy.card = self.card[:]
+        copy.values = self.values.copy(order='F')
+        return copy
+
+def contract(operands, scope, path=None):
+    '''Multiply arrays of factor values together and sum out every
+    vertex not in *scope*, in a single call of ``numpy.einsum``.
+
+    Arguments:
+        1. *operands* -- A list of (values, scope) pairs, where *values* is an ndarray with one axis per vertex in the list *scope*.
+        2. *scope* -- The vertices to keep, in the order of the axes of the result.
+        3. *path* -- (Optional) The pairwise contraction order, as returned by *contractionpath* in :doc:`eliminationorder`. By default all operands are contracted in one pass.
+
+    Returns:
+        An ndarray with one axis per vertex in *scope*.
+
+    Any hashable label can be used in the scopes, e.g. to carry an
+    extra axis of independent cases through the computation.
+
+    '''
+    labels = {}
+    args = []
+    for values, opscope in operands:
+        args.append(values)
+        args.append([labels.setdefault(vertex, len(labels))
+                     for vertex in opscope])
+    args.append([labels[vertex] for vertex in scope])
+    if not path and len(operands) > maxoperands:
+        # beyond the limit of a single pass, contract left to right
+        path = [(0, 1)] * (len(operands) - 1)
+    if path and len(operands) > 2:
+        return np.einsum(*args, optimize=['einsum_path'] + list(path))
+    return np.einsum(*args)
+
+maxoperands = 32
+'''The largest number of operands that *contract* passes to ``numpy.einsum`` for a single pass.'''
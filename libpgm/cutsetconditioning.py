@@ -0,0 +1,238 @@
+# Copyright (c) 2012, CyberPoint International, LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the CyberPoint International, LLC nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL CYBERPOINT INTERNATIONAL, LLC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+This module provides exact inference in discrete Bayesian networks by cutset conditioning. Observing the vertices of a loop cutset cuts every loop of the network, so that for each instantiation of the cutset the rest of the network is a polytree, which :doc:`PolytreeBP <polytree>` solves in linear time. The posteriors are the average of the posteriors of all instantiations, weighted by the probability of each instantiation with the evidence. The instantiations are independent of each other, and are evaluated in parallel by a pool of processes. For more information cf. Pearl, *Probabilistic Reasoning in Intelligent Systems* (1988), Ch. 4.4, or Koller et al. Ch. 9.5.
+
+'''
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from .tablecpdfactorization import TableCPDFactorization
+from .arraycpdfactor import ArrayCPDFactor
+from .discretebayesiannetwork import DiscreteBayesianNetwork
+from .nodedata import NodeData
+from .polytree import PolytreeBP
+
+class CutsetConditioning(TableCPDFactorization):
+    '''Cutset conditioning on a discrete CPD Bayesian network.
+
+    This class can be used in place of
+    :doc:`TableCPDFactorization <tablecpdfactorization>`: *condprobve*
+    and *specificquery* take the same arguments. Queries on a single
+    vertex are answered from the posteriors of one evaluation of all
+    cutset instantiations, which is only repeated when the evidence
+    changes; other queries fall back to variable elimination. Use
+    *marginals* to obtain all posteriors at once.
+
+    Usage example: this code would compute all posteriors with four
+    worker processes::
+
+        from libpgm.nodedata import NodeData
+        from libpgm.discretebayesiannetwork import DiscreteBayesianNetwork
+        from libpgm.cutsetconditioning import CutsetConditioning
+
+        nd = NodeData.load("../tests/unittestdict.txt")
+        bn = DiscreteBayesianNetwork(nd)
+        cc = CutsetConditioning(bn, workers=4)
+        print cc.cutset
+        print cc.marginals(dict(Letter='weak'))
+        cc.shutdown()
+
+    '''
+    factortype = ArrayCPDFactor
+
+    workers = None
+    '''The number of worker processes, or None for the number of processors. If zero, the instantiations are evaluated one after the other in the calling process.'''
+
+    def __init__(self, bn, cutset=None, workers=None):
+        '''
+        This class is constructed with a :doc:`DiscreteBayesianNetwork <discretebayesiannetwork>` instance as argument. The loop *cutset* is found by *loopcutset* of :doc:`GraphSkeleton <graphskeleton>` unless given; *workers* replaces the default of *workers*.
+
+        '''
+        if workers is not None:
+            self.workers = workers
+        TableCPDFactorization.__init__(self, bn)
+        if cutset is None:
+            cutset = bn.loopcutset()
+        self.cutset = list(cutset)
+        '''The list of the vertices of the loop cutset.'''
+        self.conditioner = Conditioner(bn, self.cutset)
+        '''The :class:`Conditioner` evaluating one instantiation, which is sent once to each worker process.'''
+        self.pool = None
+        '''The pool of worker processes, created on the first evaluation; see *shutdown*.'''
+        self.last = None
+        '''A tuple (evidence, marginals) holding the result of the last evaluation.'''
+
+    def invalidate(self, vertices=None):
+        '''Rebuild the engine after CPDs in *bn* have changed. The arguments are those of *invalidate* in :doc:`TableCPDFactorization <tablecpdfactorization>`; the worker processes are shut down.'''
+        self.shutdown()
+        self.__init__(self.bn, self.cutset)
+
+    def shutdown(self):
+        '''Shut down the worker processes, if any. They are started again by the next evaluation.'''
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def instantiations(self, evidence):
+        '''Return a list of the instantiations of the cutset consistent with *evidence*, each a dict of {vertex: value} pairs.'''
+        choices = [[evidence[vertex]] if vertex in evidence
+                   else self.bn.Vdata[vertex]["vals"]
+                   for vertex in self.cutset]
+        return [dict(zip(self.cutset, values))
+                for values in itertools.product(*choices)]
+
+    def evaluate(self, evidence=None):
+        '''
+        Evaluate every instantiation of the cutset consistent with *evidence*, a dict containing (vertex: value) pairs, on the pool of *workers* processes.
+
+        Returns:
+            A list of (weight, marginals) pairs, one per instantiation, as returned by :class:`Conditioner`.
+
+        '''
+        if evidence is None:
+            evidence = {}
+        cases = [(instantiation, evidence)
+                 for instantiation in self.instantiations(evidence)]
+        if self.workers == 0 or len(cases) == 1:
+            return [self.conditioner(case) for case in cases]
+        workers = self.workers or os.cpu_count() or 1
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(
+                workers, initializer=_initworker,
+                initargs=(self.conditioner,))
+        chunksize = max(1, len(cases) // (4 * workers))
+        return list(self.pool.map(_runworker, cases, chunksize=chunksize))
+
+    def marginals(self, evidence=None):
+        '''
+        Return the posterior distribution of every vertex given *evidence*, combining the posteriors of all the instantiations of the cutset, weighted by their probability with the evidence.
+
+        Returns:
+            A dict of {vertex: {value: probability}} pairs, in the format of the *avg* attribute of :doc:`SampleAggregator <sampleaggregator>`.
+
+        '''
+        if evidence is None:
+            evidence = {}
+        last = self.last
+        if last is not None and last[0] == evidence:
+            return last[1]
+        results = self.evaluate(evidence)
+        total = sum(weight for weight, _ in results)
+        assert total > 0, "The evidence has probability zero."
+        marginals = dict((vertex, dict.fromkeys(self.bn.Vdata[vertex]["vals"], 0.))
+                         for vertex in self.bn.V)
+        for weight, conditional in results:
+            if weight:
+                for vertex, ps in conditional.items():
+                    for value, p in ps.items():
+                        marginals[vertex][value] += weight / total * p
+        self.last = (dict(evidence), marginals)
+        return marginals
+
+    def condprobve(self, query, evidence=None):
+        '''
+        Return the probability distribution over the vertices of *query* given *evidence*, as :doc:`TableCPDFactorization <tablecpdfactorization>` does. A single vertex is answered from *marginals*; other queries fall back to variable elimination.
+
+        '''
+        if evidence is None:
+            evidence = {}
+        query = list(query)
+        if len(query) != 1:
+            return TableCPDFactorization.condprobve(self, query, evidence)
+        vertex = query[0]
+        marginal = self.marginals(evidence)[vertex]
+        return ArrayCPDFactor.fromarray(
+            query, [marginal[value] for value in self.bn.Vdata[vertex]["vals"]],
+            self.bn)
+
+class Conditioner:
+    '''The evaluation of one instantiation of a cutset.
+
+    Instances hold only the structure and the CPDs of the network, as
+    plain lists and dicts, so that they can be sent to worker processes.
+
+    '''
+    def __init__(self, bn, cutset):
+        self.V = list(bn.V)
+        '''A list of the names of the vertices.'''
+        self.Vdata = bn.Vdata
+        '''The *Vdata* of the network.'''
+        self.cutset = list(cutset)
+        '''The list of the vertices of the cutset.'''
+
+    def reduce(self, instantiation):
+        '''
+        Return the *Vdata* of the network with the vertices of the cutset fixed to their values in *instantiation*: the cutset vertices are removed from the parents of every vertex, and the CPD of every child of a cutset vertex is cut down to the rows of the instantiated values. The cutset vertices themselves keep their other parents, and are left without children.
+
+        '''
+        vdata = {}
+        for vertex in self.V:
+            data = self.Vdata[vertex]
+            parents = data["parents"] or []
+            kept = [parent for parent in parents if parent not in instantiation]
+            cprob = data["cprob"]
+            if len(kept) < len(parents):
+                rows = {}
+                for key in itertools.product(*[self.Vdata[parent]["vals"]
+                                               for parent in kept]):
+                    values = dict(zip(kept, key))
+                    values.update(instantiation)
+                    rows[key] = cprob[tuple(values[parent] for parent in parents)]
+                cprob = rows if kept else rows[()]
+            vdata[vertex] = dict(data, parents=kept, cprob=cprob)
+        return vdata
+
+    def __call__(self, case):
+        '''
+        Evaluate *case*, a pair (instantiation, evidence) of dicts of {vertex: value} pairs, on the polytree left by the instantiation.
+
+        Returns:
+            A pair (weight, marginals), where *weight* is the probability of the instantiation together with the evidence, and *marginals* the posteriors of all the vertices given both, in the format of *marginals* of :doc:`PolytreeBP <polytree>`, or None if *weight* is zero.
+
+        '''
+        instantiation, evidence = case
+        nodedata = NodeData()
+        nodedata.Vdata = self.reduce(instantiation)
+        bp = PolytreeBP(DiscreteBayesianNetwork(nodedata))
+        evidence = dict(evidence)
+        evidence.update(instantiation)
+        weight = bp.probability(evidence)
+        if not weight:
+            return 0., None
+        return weight, bp.marginals(evidence)
+
+_conditioner = None
+'''The :class:`Conditioner` of a worker process, set by *_initworker*.'''
+
+def _initworker(conditioner):
+    '''Store *conditioner* for the calls of *_runworker* in this worker process.'''
+    global _conditioner
+    _conditioner = conditioner
+
+def _runworker(case):
+    '''Evaluate *case* by the :class:`Conditioner` of this worker process.'''
+    return _conditioner(case)
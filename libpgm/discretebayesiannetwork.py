@@ -29,9 +29,12 @@ This module provides tools to represent and handle Bayesian networks with discre
 
 import random
 import json
+import threading
 from .graphskeleton import GraphSkeleton
 from .utils import bntextutils as bntutils
 from .tablecpdfactorization import TableCPDFactorization
+from .polytree import PolytreeBP
+from .arithmeticcircuit import ArithmeticCircuit
 
 class DiscreteBayesianNetwork(GraphSkeleton):
     '''
@@ -39,6 +42,9 @@ class DiscreteBayesianNetwork(GraphSkeleton):
     
     '''
 
+    _fnlock = threading.Lock()
+    '''The lock guarding the creation of the factorization used by *specificquery*.'''
+
 
     def __init__(self, nodedata=None):
         '''
@@ -112,14 +118,78 @@ class DiscreteBayesianNetwork(GraphSkeleton):
                 "y": ["C", "D"]
             }
 
+        The factorization answering the queries is built on the first
+        call and shared by all later calls, see *factorization*. Every
+        query keeps its state local, so this method can be called from
+        several threads at once, e.g. from a
+        ``concurrent.futures.ThreadPoolExecutor``.
+
+        '''
+        return self.factorization().specificquery(query, evidence)
+
+    def sensitivity(self, query, evidence=None):
+        '''
+        .. note: Shortcut method to the *sensitivity* method in :doc:`arithmeticcircuit`
+
+        Return the partial derivatives of the probability of the event specified by *query* given *evidence* with respect to every entry of the "cprob" tables in *Vdata*, computed in a single forward and backward pass over the arithmetic circuit of the network.
+
+        Arguments:
+            1. *query* -- A dict containing (vertex: list of values) pairs, as for *specificquery*.
+            2. *evidence* -- A dict containing (vertex: value) pairs.
+
+        Returns:
+            A dict of {vertex: derivatives} pairs, where *derivatives* has the layout of *Vdata[vertex]["cprob"]*.
+
+        The circuit is compiled on each call; to answer many queries on the same network, compile an :doc:`ArithmeticCircuit <arithmeticcircuit>` once and call its *sensitivity*.
+
+        '''
+        return ArithmeticCircuit(self).sensitivity(query, evidence)
+
+    def marginals(self, evidence=None):
+        '''
+        Return the posterior distribution of every vertex given *evidence*, a dict containing (vertex: value) pairs.
+
+        Returns:
+            A dict of {vertex: {value: probability}} pairs, in the format of the *avg* attribute of :doc:`SampleAggregator <sampleaggregator>`.
+
+        If the graph is a polytree, all the posteriors come from a single run of :doc:`PolytreeBP <polytree>`; otherwise each is computed by variable elimination.
+
+        '''
+        if evidence is None:
+            evidence = {}
+        fn = self.factorization()
+        if isinstance(fn, PolytreeBP):
+            return fn.marginals(evidence)
+        result = {}
+        for vertex in self.V:
+            vals = self.Vdata[vertex]["vals"]
+            if vertex in evidence:
+                ps = [float(val == evidence[vertex]) for val in vals]
+            else:
+                ps = fn.condprobve(dict.fromkeys([vertex]), evidence).vals
+            result[vertex] = dict(zip(vals, ps))
+        return result
+
+    def factorization(self):
+        '''
+        Return the factorization answering *specificquery* and *marginals*, building it on the first call.
+
+        This is a :doc:`PolytreeBP <polytree>` instance if the graph is a polytree (see *ispolytree*), which answers the queries in time linear in the size of the network, and a :doc:`TableCPDFactorization <tablecpdfactorization>` instance otherwise.
+
         '''
-        # calculate
         try:
-            fn = self._fn
+            return self._fn
         except AttributeError:
-            fn = TableCPDFactorization(self)
-            self._fn = fn
-        return fn.specificquery(query, evidence)
+            with self._fnlock:
+                try:
+                    fn = self._fn
+                except AttributeError:
+                    if self.ispolytree():
+                        fn = PolytreeBP(self)
+                    else:
+                        fn = TableCPDFactorization(self)
+                    self._fn = fn
+            return fn
             
     def randomsample(self, n, evidence=None):
         '''
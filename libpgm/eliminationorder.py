@@ -0,0 +1,314 @@
+# Copyright (c) 2012, CyberPoint International, LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the CyberPoint International, LLC nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL CYBERPOINT INTERNATIONAL, LLC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+This module provides tools for choosing the order in which variable elimination removes variables from a set of factors. The order does not change the result, but it decides the size of the intermediate factors, and thereby the time and memory that the elimination takes. The heuristics here are greedy: each step eliminates the variable of the interaction graph that is cheapest according to a cost function. For more information cf. Koller et al. 9.4.3. Within a step, *contractionpath* plans the order in which the factors are multiplied pairwise, in the way ``numpy.einsum_path`` does for tensor contractions.
+
+'''
+
+import heapq
+
+from .tablecpdfactor import prod
+
+def interactiongraph(scopes):
+    '''
+    Return the interaction graph of a set of factors with the given *scopes*, as a dict of {vertex: set of neighbours} pairs. Two vertices are neighbours if they appear in the scope of the same factor. For the factors of a Bayesian network this is the moralized graph.
+
+    '''
+    graph = {}
+    for scope in scopes:
+        for vertex in scope:
+            neighbours = graph.setdefault(vertex, set())
+            neighbours.update(scope)
+            neighbours.discard(vertex)
+    return graph
+
+def fillin(graph, vertex):
+    '''Return the edges that eliminating *vertex* from *graph* would add.'''
+    neighbours = sorted(graph[vertex], key=str)
+    return [(u, w)
+            for i, u in enumerate(neighbours)
+            for w in neighbours[i+1:]
+            if w not in graph[u]]
+
+def mindegree(graph, card, vertex):
+    '''Cost of eliminating *vertex*: the number of its neighbours.'''
+    return len(graph[vertex])
+
+def minfill(graph, card, vertex):
+    '''Cost of eliminating *vertex*: the number of edges it would add.'''
+    return len(fillin(graph, vertex))
+
+def weightedminfill(graph, card, vertex):
+    '''Cost of eliminating *vertex*: the sum of the weights of the edges
+    it would add, where the weight of an edge is the product of the
+    cardinalities of its ends.'''
+    return sum(card[u] * card[w] for u, w in fillin(graph, vertex))
+
+heuristics = {
+    'mindegree': mindegree,
+    'minfill': minfill,
+    'weightedminfill': weightedminfill}
+'''The cost functions available by name.'''
+
+def eliminationorder(scopes, card, vertices, heuristic='minfill'):
+    '''
+    Plan the elimination of *vertices* from a set of factors.
+
+    Arguments:
+        1. *scopes* -- A list of the scopes of the factors.
+        2. *card* -- A dict of {vertex: cardinality} pairs for every vertex in *scopes*.
+        3. *vertices* -- The vertices to be eliminated.
+        4. *heuristic* -- Either the name of a cost function in *heuristics*, a function with the same signature, or a sequence of vertices giving the order explicitly. Vertices of *vertices* missing from the sequence are eliminated last, in their original order.
+
+    Returns:
+        A tuple (order, maxfactorsize), where *order* is the list of vertices in elimination order and *maxfactorsize* is the number of entries of the largest factor created along the way, including the final product of the remaining factors.
+
+    Vertices of *vertices* that appear in no scope need no elimination and are left out of *order*. Ties between vertices of equal cost are broken by their position in *vertices*, so the result is deterministic.
+
+    '''
+    graph = interactiongraph(scopes)
+    remaining = [vertex for vertex in vertices if vertex in graph]
+    position = dict((vertex, i) for i, vertex in enumerate(remaining))
+
+    if isinstance(heuristic, str):
+        heuristic = heuristics[heuristic]
+    if callable(heuristic):
+        cost = dict((vertex, heuristic(graph, card, vertex))
+                    for vertex in remaining)
+    else:
+        explicit = list(dict.fromkeys(
+            vertex for vertex in heuristic if vertex in position))
+        listed = set(explicit)
+        explicit += [vertex for vertex in remaining if vertex not in listed]
+        explicit.reverse()
+
+    order = []
+    maxfactorsize = 1
+    pending = set(remaining)
+    while pending:
+        if callable(heuristic):
+            vertex = min(pending, key=lambda v: (cost[v], position[v]))
+        else:
+            vertex = explicit.pop()
+        pending.remove(vertex)
+        order.append(vertex)
+
+        neighbours = graph.pop(vertex)
+        maxfactorsize = max(maxfactorsize,
+                            card[vertex] * prod(card[u] for u in neighbours))
+        for u in neighbours:
+            graph[u].discard(vertex)
+            graph[u].update(neighbours)
+            graph[u].discard(u)
+
+        if callable(heuristic):
+            # only vertices within distance two of *vertex* change cost
+            touched = set(neighbours)
+            for u in neighbours:
+                touched.update(graph[u])
+            for u in touched & pending:
+                cost[u] = heuristic(graph, card, u)
+
+    # the remaining factors are multiplied together at the end
+    maxfactorsize = max(maxfactorsize, prod(card[u] for u in graph))
+    return order, maxfactorsize
+
+def triangulate(scopes, order):
+    '''
+    Return the maximal cliques of the triangulated graph obtained by eliminating all vertices of the interaction graph of *scopes* in *order*. Each clique is a list of vertices, the first of which is the vertex whose elimination created it. Vertices missing from *order* are eliminated last.
+
+    '''
+    graph = interactiongraph(scopes)
+    order = [vertex for vertex in order if vertex in graph]
+    listed = set(order)
+    order += [vertex for vertex in graph if vertex not in listed]
+    position = dict((vertex, i) for i, vertex in enumerate(order))
+
+    cliques = []
+    for vertex in order:
+        neighbours = graph.pop(vertex)
+        for u in neighbours:
+            graph[u].discard(vertex)
+            graph[u].update(neighbours)
+            graph[u].discard(u)
+        clique = set(neighbours)
+        clique.add(vertex)
+        if not any(clique <= other for other, _ in cliques):
+            cliques.append((clique, [vertex] + sorted(neighbours, key=position.get)))
+    return [ordered for _, ordered in cliques]
+
+def contractionpath(scopes, card, eliminate=(), heuristic='greedy'):
+    '''
+    Plan the order in which a set of factors is multiplied together pairwise.
+
+    Arguments:
+        1. *scopes* -- A list of the scopes of the factors.
+        2. *card* -- A dict of {vertex: cardinality} pairs for every vertex in *scopes*.
+        3. *eliminate* -- The vertices to be summed out of the product. Each is summed out by the contraction after which no other factor mentions it.
+        4. *heuristic* -- Either ``'greedy'``, which contracts the pair whose result grows least beyond its inputs, or ``'optimal'``, which searches all pairings for the one with the least total size of intermediate factors. The search takes time exponential in the number of factors, so above *maxoptimal* factors the greedy path is returned instead.
+
+    Returns:
+        A tuple (path, maxfactorsize). *path* is a list of pairs (i, j) with i < j in the format of ``numpy.einsum_path``: the positions of the two factors to contract in the current list of factors, from which both are removed and to which their product is appended. *maxfactorsize* is the number of entries of the largest factor created along the way.
+
+    '''
+    operands = [frozenset(scope) for scope in scopes]
+    eliminate = frozenset(eliminate)
+    if len(operands) < 2:
+        return [], max([size(operand, card) for operand in operands] or [1])
+    if heuristic == 'optimal' and len(operands) <= maxoptimal:
+        return _optimalpath(operands, card, eliminate)
+    if heuristic not in ('greedy', 'optimal'):
+        raise ValueError("Unknown contraction heuristic %r." % (heuristic,))
+
+    # candidate pairs in a heap, each costed when it is first seen;
+    # later contractions can only make a stale cost pessimistic
+    counts = {}
+    for operand in operands:
+        for vertex in operand:
+            counts[vertex] = counts.get(vertex, 0) + 1
+    def contracted(a, b):
+        return frozenset(
+            vertex for vertex in a | b
+            if vertex not in eliminate
+            or counts[vertex] > (vertex in a) + (vertex in b))
+    def candidate(i, j):
+        scope = contracted(live[i], live[j])
+        cost = (size(scope, card) - size(live[i], card)
+                - size(live[j], card))
+        heapq.heappush(heap, (cost, i, j))
+
+    live = dict(enumerate(operands))
+    current = list(range(len(operands)))
+    heap = []
+    for i in range(len(operands)):
+        for j in range(i + 1, len(operands)):
+            candidate(i, j)
+
+    path = []
+    maxfactorsize = max(size(operand, card) for operand in operands)
+    while len(current) > 1:
+        _, i, j = heapq.heappop(heap)
+        if i not in live or j not in live:
+            continue
+        scope = contracted(live[i], live[j])
+        for vertex in live[i] | live[j]:
+            counts[vertex] -= (vertex in live[i]) + (vertex in live[j])
+        for vertex in scope:
+            counts[vertex] += 1
+        path.append(tuple(sorted((current.index(i), current.index(j)))))
+        maxfactorsize = max(maxfactorsize, size(scope, card))
+        del live[i], live[j]
+        current.remove(i)
+        current.remove(j)
+        k = len(operands) + len(path) - 1
+        live[k] = scope
+        current.append(k)
+        for other in current[:-1]:
+            candidate(other, k)
+    return path, maxfactorsize
+
+def contractioncost(scopes, card, path, eliminate=()):
+    '''
+    Return the number of multiplications needed to contract factors with the given *scopes* along *path*, as returned by *contractionpath*, summing out *eliminate*. Without a path, i.e. contracting all factors in one pass, this is the size of their joint scope times the number of factors less one.
+
+    '''
+    operands = [frozenset(scope) for scope in scopes]
+    eliminate = frozenset(eliminate)
+    if path is None:
+        return size(frozenset().union(*operands), card) * (len(operands) - 1)
+    cost = 0
+    for i, j in path:
+        cost += size(operands[i] | operands[j], card)
+        scope = _contracted(operands, i, j, eliminate)
+        operands = [operand for k, operand in enumerate(operands)
+                    if k != i and k != j] + [scope]
+    return cost
+
+maxoptimal = 10
+'''The largest number of factors for which *contractionpath* searches for the optimal path.'''
+
+def size(scope, card):
+    '''Return the number of entries of a factor over *scope*.'''
+    return prod(card[vertex] for vertex in scope)
+
+def _contracted(operands, i, j, eliminate):
+    '''Return the scope of the product of *operands* i and j, without the vertices of *eliminate* that no other operand mentions.'''
+    rest = set()
+    for k, operand in enumerate(operands):
+        if k != i and k != j:
+            rest.update(operand)
+    return frozenset(vertex for vertex in operands[i] | operands[j]
+                     if vertex not in eliminate or vertex in rest)
+
+def _optimalpath(operands, card, eliminate):
+    '''The exhaustive search of *contractionpath*, over all subsets of *operands*.'''
+    n = len(operands)
+    full = (1 << n) - 1
+    union = {}
+    for subset in range(1, full + 1):
+        low = subset & -subset
+        union[subset] = (union[subset ^ low] if subset ^ low else frozenset()) \
+            | operands[low.bit_length() - 1]
+
+    def scope(subset):
+        rest = union[full ^ subset] if subset != full else frozenset()
+        return frozenset(vertex for vertex in union[subset]
+                         if vertex not in eliminate or vertex in rest)
+
+    # best[subset] = (total size of intermediates, split)
+    best = dict(((1 << i), (0, None)) for i in range(n))
+    for subset in sorted(range(1, full + 1), key=lambda s: bin(s).count('1')):
+        if subset in best:
+            continue
+        result = size(scope(subset), card)
+        choice = None
+        part = (subset - 1) & subset
+        while part:
+            other = subset ^ part
+            if part < other:
+                cost = best[part][0] + best[other][0] + result
+                if choice is None or cost < choice[0]:
+                    choice = (cost, (part, other))
+            part = (part - 1) & subset
+        best[subset] = choice
+
+    # turn the tree of splits into positions in the list of operands
+    current = [1 << i for i in range(n)]
+    path = []
+    sizes = [size(operand, card) for operand in operands]
+    def build(subset):
+        split = best[subset][1]
+        if split is None:
+            return
+        build(split[0])
+        build(split[1])
+        i, j = sorted((current.index(split[0]), current.index(split[1])))
+        path.append((i, j))
+        sizes.append(size(scope(subset), card))
+        del current[j]
+        del current[i]
+        current.append(subset)
+    build(full)
+    return path, max(sizes)
@@ -30,7 +30,7 @@ import json
 
 class GraphSkeleton:
     '''
-    This class represents a graph skeleton, meaning a vertex set and a directed edge set. It contains the attributes *V* and *E*, and the methods *load*, *getparents*, *getchildren*, and *toporder*.
+    This class represents a graph skeleton, meaning a vertex set and a directed edge set. It contains the attributes *V* and *E*, and the methods *load*, *getparents*, *getchildren*, *toporder*, *getrelevant*, *ispolytree* and *loopcutset*.
     
     '''
     def __init__(self, V=[], E=[]):
@@ -141,3 +141,108 @@ class GraphSkeleton:
                         roots.append(m)
         assert (not Ecopy), ("Graph contains a cycle", Ecopy)
         self.V = toporder 
+
+    def getrelevant(self, query, evidence=()):
+        '''
+        Find the part of the graph that a query for the vertices in *query* given evidence on the vertices in *evidence* depends on.
+
+        This is the Bayes-ball algorithm (Shachter 1998), which in a single pass over the graph finds the vertices whose CPDs are needed to answer the query and the evidence vertices that are not d-separated from it. Barren vertices -- vertices none of whose descendants is queried or observed -- and evidence that is d-separated from the query given the other evidence are left out.
+
+        Arguments:
+            1. *query* -- A collection of the names of the queried vertices.
+            2. *evidence* -- A collection of the names of the observed vertices.
+
+        Returns:
+            A tuple (vertices, requisite), where *vertices* is the set of vertices whose CPDs are needed and *requisite* is the set of evidence vertices that affect the result.
+
+        '''
+        evidence = set(evidence)
+        parents = dict((vertex, []) for vertex in self.V)
+        children = dict((vertex, []) for vertex in self.V)
+        for pair in self.E:
+            parents[pair[1]].append(pair[0])
+            children[pair[0]].append(pair[1])
+
+        top = set()
+        bottom = set()
+        visited = set()
+        # (vertex, True) is a visit from a child, (vertex, False) from a parent
+        schedule = [(vertex, True) for vertex in query]
+        while schedule:
+            vertex, fromchild = schedule.pop()
+            visited.add(vertex)
+            if vertex in evidence:
+                if not fromchild and vertex not in top:
+                    top.add(vertex)
+                    schedule.extend((p, True) for p in parents[vertex])
+            else:
+                if fromchild and vertex not in top:
+                    top.add(vertex)
+                    schedule.extend((p, True) for p in parents[vertex])
+                if vertex not in bottom:
+                    bottom.add(vertex)
+                    schedule.extend((c, False) for c in children[vertex])
+
+        return top, visited & evidence
+
+    def ispolytree(self):
+        '''
+        Return True if the graph skeleton is a polytree (also called singly connected), i.e. if there is at most one path between any two vertices when the directions of the edges are ignored. A graph whose components are all polytrees counts as a polytree.
+
+        The edges are merged into components one by one, and the graph is a polytree unless an edge joins two vertices of the same component. This takes time almost linear in the number of edges.
+
+        '''
+        component = dict((vertex, vertex) for vertex in self.V)
+        def find(vertex):
+            while component[vertex] != vertex:
+                component[vertex] = component[component[vertex]]
+                vertex = component[vertex]
+            return vertex
+        for pair in self.E:
+            a, b = find(pair[0]), find(pair[1])
+            if a == b:
+                return False
+            component[a] = b
+        return True
+
+    def loopcutset(self):
+        '''
+        Return a small loop cutset of the graph skeleton: a list of vertices such that removing the edges leaving them makes the graph a polytree (see *ispolytree*). Once the cutset vertices are observed, their outgoing edges no longer carry any dependence, which is what cutset conditioning relies on.
+
+        This is the greedy heuristic of Suermondt and Cooper (1990). Vertices with at most one remaining edge lie on no loop and are removed, until every remaining vertex lies between loops. Then, of the vertices with at most one remaining parent, the one with the most remaining edges joins the cutset, and its outgoing edges are removed. As a graph without cycles always has a vertex without parents, this repeats until no vertex remains.
+
+        Returns:
+            A list of vertices in the order they joined the cutset, empty if the graph is a polytree already.
+
+        '''
+        parents = dict((vertex, set()) for vertex in self.V)
+        children = dict((vertex, set()) for vertex in self.V)
+        for pair in self.E:
+            parents[pair[1]].add(pair[0])
+            children[pair[0]].add(pair[1])
+        degree = lambda vertex: len(parents[vertex]) + len(children[vertex])
+        def remove(vertex):
+            for parent in parents.pop(vertex):
+                children[parent].discard(vertex)
+            for child in children.pop(vertex):
+                parents[child].discard(vertex)
+
+        cutset = []
+        while True:
+            leaves = [vertex for vertex in parents if degree(vertex) <= 1]
+            while leaves:
+                vertex = leaves.pop()
+                if vertex not in parents:
+                    continue
+                neighbours = parents[vertex] | children[vertex]
+                remove(vertex)
+                leaves.extend(u for u in neighbours if degree(u) <= 1)
+            if not parents:
+                return cutset
+            candidates = [vertex for vertex in self.V
+                          if vertex in parents and len(parents[vertex]) <= 1]
+            vertex = max(candidates, key=degree)
+            cutset.append(vertex)
+            for child in children[vertex]:
+                parents[child].discard(vertex)
+            children[vertex] = set()
@@ -0,0 +1,356 @@
+# Copyright (c) 2012, CyberPoint International, LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the CyberPoint International, LLC nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL CYBERPOINT INTERNATIONAL, LLC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+This module provides exact inference in discrete Bayesian networks by message passing on a junction tree (also called a clique tree). The network is moralized and triangulated, and the maximal cliques of the triangulated graph are connected into a tree. One calibration of the tree -- two passes of messages, towards a root and back -- yields the posterior distribution of every node at once, where variable elimination needs one run per node. For more information cf. Koller et al. Ch. 10.
+
+'''
+try:
+    import numpy as np
+except ImportError:
+    raise ImportError("numpy is not installed on your system.")
+
+import threading
+
+from .tablecpdfactorization import TableCPDFactorization
+from .arraycpdfactor import ArrayCPDFactor
+from . import eliminationorder
+
+class JunctionTree(TableCPDFactorization):
+    '''Junction tree of a discrete CPD Bayesian network.
+
+    This class can be used in place of
+    :doc:`TableCPDFactorization <tablecpdfactorization>`: *condprobve*
+    and *specificquery* take the same arguments, but are answered from
+    the calibrated tree. The tree is only recalibrated when the
+    evidence changes, so that querying every node under the same
+    evidence costs a single calibration. Use *marginals* to obtain all
+    posteriors at once.
+
+    Like those of :doc:`TableCPDFactorization <tablecpdfactorization>`,
+    *condprobve*, *specificquery* and *marginals* can be called from
+    many threads at once. The threads share *session*, which is
+    guarded by *sessionlock*, so that queries under different
+    evidence are answered one at a time. Threads that need to query
+    under different evidence concurrently should each use a session
+    of their own, see *newsession*.
+
+    '''
+    factortype = ArrayCPDFactor
+
+    def __init__(self, bn, heuristic=None):
+        '''
+        This class is constructed with a :doc:`DiscreteBayesianNetwork <discretebayesiannetwork>` instance as argument. The triangulation follows the elimination order chosen by *heuristic* (see :doc:`eliminationorder`), which defaults to min-fill. If the potential of the largest clique would take more than *memorybudget* bytes, :class:`memorybudgetError` is raised before any potential is built.
+
+        '''
+        TableCPDFactorization.__init__(self, bn, heuristic=heuristic)
+
+        scopes = [factor.scope for factor in self.originalfactorlist]
+        card = dict((vertex, len(bn.Vdata[vertex]["vals"])) for vertex in bn.V)
+        order, _ = eliminationorder.eliminationorder(
+            scopes, card, bn.V, self.heuristic)
+
+        self.cliques = eliminationorder.triangulate(scopes, order)
+        '''A list of the cliques of the tree, each a list of vertices.'''
+        self.checkbudget(max(eliminationorder.size(clique, card)
+                             for clique in self.cliques))
+        self.neighbours = [[] for _ in self.cliques]
+        '''A list holding, for each clique, the indices of its neighbours in the tree.'''
+        self.home = {}
+        '''A dict of {vertex: index} pairs giving the smallest clique containing each vertex.'''
+
+        for i, clique in enumerate(self.cliques):
+            for vertex in clique:
+                if (vertex not in self.home or
+                        len(clique) < len(self.cliques[self.home[vertex]])):
+                    self.home[vertex] = i
+
+        # maximum spanning tree on separator sizes (Kruskal)
+        sets = [set(clique) for clique in self.cliques]
+        candidates = sorted(
+            ((len(sets[i] & sets[j]), i, j)
+             for i in range(len(sets))
+             for j in range(i + 1, len(sets))
+             if sets[i] & sets[j]),
+            key=lambda edge: -edge[0])
+        component = list(range(len(sets)))
+        def find(i):
+            while component[i] != i:
+                component[i] = component[component[i]]
+                i = component[i]
+            return i
+        for _, i, j in candidates:
+            ri, rj = find(i), find(j)
+            if ri != rj:
+                component[ri] = rj
+                self.neighbours[i].append(j)
+                self.neighbours[j].append(i)
+
+        # assign each CPD to a clique containing its family
+        self.potentials = [
+            ArrayCPDFactor.fromarray(
+                clique, np.ones([card[vertex] for vertex in clique]), bn)
+            for clique in self.cliques]
+        '''A list of the initial clique potentials, as :doc:`ArrayCPDFactor <arraycpdfactor>` instances.'''
+        for factor in self.originalfactorlist:
+            family = set(factor.scope)
+            i = min((i for i, s in enumerate(sets) if family <= s),
+                    key=lambda i: len(sets[i]))
+            self.potentials[i].multiplyfactor(factor)
+
+        self.session = InferenceSession(self)
+        '''The :class:`InferenceSession` used by *condprobve*, *specificquery* and *marginals*.'''
+        self.sessionlock = threading.Lock()
+        '''The lock guarding *session* and *beliefs*.'''
+        self.beliefs = None
+        '''A list of the clique beliefs computed by the last call of *calibrate*.'''
+
+    def invalidate(self, vertices=None):
+        '''Rebuild the tree after CPDs in *bn* have changed. The arguments are those of *invalidate* in :doc:`TableCPDFactorization <tablecpdfactorization>`; the tree is rebuilt as a whole, and all sessions started before are no longer valid.'''
+        self.__init__(self.bn, self.heuristic)
+
+    def newsession(self, evidence=None):
+        '''Return a new :class:`InferenceSession` on this tree, starting with *evidence*.'''
+        return InferenceSession(self, evidence)
+
+    @property
+    def evidence(self):
+        '''The evidence currently entered into *session*.'''
+        return self.session.evidence
+
+    def separator(self, i, j):
+        '''Return the vertices shared by cliques *i* and *j*.'''
+        other = set(self.cliques[j])
+        return [vertex for vertex in self.cliques[i] if vertex in other]
+
+    def message(self, i, j, potentials, messages):
+        '''
+        Compute the message from clique *i* to its neighbour *j*: the product of the potential of *i* with the messages *i* received from its other neighbours, summed down to the separator of *i* and *j*. The message is scaled to sum to one, which leaves the normalized beliefs unchanged but avoids underflow.
+
+        '''
+        factor = potentials[i].copy()
+        for k in self.neighbours[i]:
+            if k != j:
+                factor.multiplyfactor(messages[(k, i)])
+        separator = self.separator(i, j)
+        for vertex in factor.scope[:]:
+            if vertex not in separator:
+                factor.sumout(vertex)
+        norm = factor.values.sum()
+        if norm > 0:
+            factor.values = factor.values / norm
+        return factor
+
+    def calibrate(self, evidence=None):
+        '''
+        Calibrate the tree given *evidence*, a dict containing (vertex: value) pairs, and store the resulting clique beliefs in *beliefs*.
+
+        The evidence is entered by multiplying an indicator of each observed value into the potential of the home clique of its vertex. Messages are then passed from the leaves to the roots and back, so that each clique belief becomes proportional to the joint posterior of its vertices. Only the messages affected by the difference from the previous evidence are recomputed.
+
+        '''
+        with self.sessionlock:
+            self.session.update(evidence)
+            self.beliefs = [self.session.belief(i)
+                            for i in range(len(self.cliques))]
+            return self.beliefs
+
+    def condprobve(self, query, evidence=None):
+        '''
+        Return the probability distribution over the vertices of *query* given *evidence*, as :doc:`TableCPDFactorization <tablecpdfactorization>` does.
+
+        If all the vertices of *query* are found in one clique, the distribution is read off the belief of that clique, updating *session* first if *evidence* differs from the evidence entered before. Otherwise the query falls back to variable elimination.
+
+        '''
+        if evidence is None:
+            evidence = {}
+        query = list(query)
+
+        cliques = [i for i, clique in enumerate(self.cliques)
+                   if set(query) <= set(clique)]
+        if not cliques:
+            if not self.plancachesize:
+                self.refresh()
+            return TableCPDFactorization.condprobve(self, query, evidence)
+
+        i = min(cliques, key=lambda i: len(self.cliques[i]))
+        with self.sessionlock:
+            self.session.update(evidence)
+            factor = self.session.belief(i)
+        for vertex in self.cliques[i]:
+            if vertex not in query:
+                factor.sumout(vertex)
+        return factor.normalize()
+
+    def marginals(self, evidence=None):
+        '''
+        Return the posterior distribution of every vertex given *evidence*, from a single calibration of the tree.
+
+        Returns:
+            A dict of {vertex: {value: probability}} pairs, in the format of the *avg* attribute of :doc:`SampleAggregator <sampleaggregator>`.
+
+        '''
+        with self.sessionlock:
+            self.session.update(evidence)
+            return self.session.marginals()
+
+class InferenceSession:
+    '''Evidence and messages of one case on a :class:`JunctionTree`.
+
+    A session holds the evidence entered so far and the messages
+    computed under it. Messages are computed lazily, when a belief
+    needs them, and kept until the evidence they depend on changes.
+    When the evidence of a single vertex is added, changed or
+    retracted, only the messages leading away from the clique of that
+    vertex become invalid, so that a following query only recomputes
+    the messages between that clique and the cliques it reads.
+
+    Usage example: this code would update the posterior of ``Grade`` as evidence arrives::
+
+        from libpgm.nodedata import NodeData
+        from libpgm.discretebayesiannetwork import DiscreteBayesianNetwork
+        from libpgm.junctiontree import JunctionTree
+
+        nd = NodeData.load("../tests/unittestdict.txt")
+        bn = DiscreteBayesianNetwork(nd)
+        session = JunctionTree(bn).newsession()
+
+        session.setevidence("Letter", "weak")
+        print session.marginal("Grade")
+        session.setevidence("SAT", "highscore")
+        print session.marginal("Grade")
+        session.retractevidence("Letter")
+        print session.marginal("Grade")
+
+    '''
+    def __init__(self, tree, evidence=None):
+        self.tree = tree
+        '''The :class:`JunctionTree` the session runs on.'''
+        self.evidence = {}
+        '''A dict of the (vertex: value) pairs entered as evidence.'''
+        self.potentials = tree.potentials[:]
+        '''The clique potentials with the evidence entered.'''
+        self.messages = {}
+        '''A dict of {(i, j): message} pairs holding the valid messages from clique i to clique j.'''
+        self.computed = 0
+        '''The number of messages computed so far.'''
+        if evidence:
+            self.update(evidence)
+
+    def setevidence(self, vertex, value):
+        '''Enter or change the evidence that *vertex* takes *value*.'''
+        assert value in self.tree.bn.Vdata[vertex]["vals"], (
+            "Unknown value %r of %r." % (value, vertex))
+        if self.evidence.get(vertex) != value:
+            self.evidence[vertex] = value
+            self.reenter(self.tree.home[vertex])
+
+    def retractevidence(self, vertex):
+        '''Remove the evidence on *vertex*, if any.'''
+        if vertex in self.evidence:
+            del self.evidence[vertex]
+            self.reenter(self.tree.home[vertex])
+
+    def update(self, evidence=None):
+        '''Replace the evidence by *evidence*, a dict containing (vertex: value) pairs, changing only the items that differ.'''
+        if evidence is None:
+            evidence = {}
+        for vertex in list(self.evidence):
+            if vertex not in evidence:
+                self.retractevidence(vertex)
+        for vertex, value in evidence.items():
+            self.setevidence(vertex, value)
+
+    def reenter(self, i):
+        '''Rebuild the potential of clique *i* from the evidence and invalidate the messages depending on it.'''
+        tree = self.tree
+        potential = tree.potentials[i]
+        for vertex, value in self.evidence.items():
+            if tree.home[vertex] == i:
+                vals = tree.bn.Vdata[vertex]["vals"]
+                indicator = np.zeros(len(vals))
+                indicator[vals.index(value)] = 1
+                if potential is tree.potentials[i]:
+                    potential = potential.copy()
+                potential.multiplyfactor(
+                    ArrayCPDFactor.fromarray([vertex], indicator, tree.bn))
+        self.potentials[i] = potential
+
+        # messages leading away from i; a message that is already
+        # invalid has no valid messages downstream of it
+        stack = [(i, j) for j in tree.neighbours[i]]
+        while stack:
+            edge = stack.pop()
+            if edge in self.messages:
+                del self.messages[edge]
+                u, w = edge
+                stack.extend((w, k) for k in tree.neighbours[w] if k != u)
+
+    def message(self, i, j):
+        '''Return the message from clique *i* to clique *j*, computing it and the invalid messages it depends on if necessary.'''
+        neighbours = self.tree.neighbours
+        stack = [(i, j)]
+        while stack:
+            u, w = stack[-1]
+            if (u, w) in self.messages:
+                stack.pop()
+                continue
+            missing = [(k, u) for k in neighbours[u]
+                       if k != w and (k, u) not in self.messages]
+            if missing:
+                stack.extend(missing)
+            else:
+                self.messages[(u, w)] = self.tree.message(
+                    u, w, self.potentials, self.messages)
+                self.computed += 1
+                stack.pop()
+        return self.messages[(i, j)]
+
+    def belief(self, i):
+        '''Return the belief of clique *i*: its potential times all incoming messages.'''
+        belief = self.potentials[i].copy()
+        for k in self.tree.neighbours[i]:
+            belief.multiplyfactor(self.message(k, i))
+        return belief
+
+    def marginal(self, vertex, belief=None):
+        '''Return the posterior distribution of *vertex* as a dict of {value: probability} pairs, summing down *belief* if given, or else the belief of the home clique of *vertex*.'''
+        if belief is None:
+            belief = self.belief(self.tree.home[vertex])
+        factor = belief.copy()
+        for other in factor.scope[:]:
+            if other != vertex:
+                factor.sumout(other)
+        ps = factor.normalize().values
+        return dict(zip(self.tree.bn.Vdata[vertex]["vals"], ps.tolist()))
+
+    def marginals(self):
+        '''Return the posterior distribution of every vertex, in the format of *marginal*.'''
+        result = {}
+        beliefs = {}
+        for vertex in self.tree.bn.V:
+            i = self.tree.home[vertex]
+            if i not in beliefs:
+                beliefs[i] = self.belief(i)
+            result[vertex] = self.marginal(vertex, beliefs[i])
+        return result
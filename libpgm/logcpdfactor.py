@@ -0,0 +1,184 @@
+# Copyright (c) 2012, CyberPoint International, LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the CyberPoint International, LLC nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL CYBERPOINT INTERNATIONAL, LLC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''This module provides a factorized representation of a node that
+holds the logarithms of its values. Products of many small
+probabilities underflow to zero in linear space, but their logarithms
+stay representable: multiplying factors becomes adding their values,
+and summing out a variable becomes a log-sum-exp. It is
+interchangeable with :doc:`ArrayCPDFactor <arraycpdfactor>`, so a
+:doc:`TableCPDFactorization <tablecpdfactorization>` works in log
+space when constructed with ``factortype=LogCPDFactor``.
+
+'''
+try:
+    import numpy as np
+except ImportError:
+    raise ImportError("numpy is not installed on your system.")
+
+from .arraycpdfactor import ArrayCPDFactor
+
+def log(values):
+    '''Return the natural logarithm of *values* as an ndarray, mapping zero to ``-inf`` without a warning.'''
+    with np.errstate(divide='ignore'):
+        return np.log(np.asarray(values, dtype=float))
+
+def logsumexp(values, axis=None):
+    '''Return the logarithm of the sum of the exponentials of *values* along *axis*, without overflow or underflow.'''
+    top = np.max(values, axis=axis, keepdims=True)
+    top = np.where(np.isfinite(top), top, 0)
+    with np.errstate(divide='ignore'):
+        result = np.log(np.sum(np.exp(values - top), axis=axis, keepdims=True))
+    return np.squeeze(result + top, axis=axis)
+
+class LogCPDFactor(ArrayCPDFactor):
+    """Factorized representation of a CPD table in log space.
+
+    The array *values* holds the logarithms of the entries of the
+    table, laid out as in :doc:`ArrayCPDFactor <arraycpdfactor>`.
+    The other attributes are the same, and *vals* still holds the
+    entries themselves, so that code reading a distribution from a
+    factor works unchanged. Use *logvals* to read the logarithms.
+
+    """
+    def __init__(self, vertex, bn):
+        '''Construct a factorized CPD table from a vertex in a discrete
+        Bayesian network, with the same arguments as :doc:`TableCPDFactor
+        <tablecpdfactor>`.'''
+        ArrayCPDFactor.__init__(self, vertex, bn)
+        self.values = log(self.values)
+
+    @classmethod
+    def fromfactor(cls, factor):
+        '''Return an instance of this class holding the logarithms of the values of *factor*, which may be any factor class.'''
+        if isinstance(factor, LogCPDFactor):
+            return factor.copy()
+        copy = super().fromfactor(factor)
+        copy.values = log(copy.values)
+        return copy
+
+    @property
+    def vals(self):
+        '''A flat array of the entries of the table, the exponentials of *values*, laid out as in :doc:`TableCPDFactor <tablecpdfactor>`. Assigning to it stores the logarithms of the new entries.'''
+        return np.exp(self.values).reshape(-1, order='F')
+
+    @vals.setter
+    def vals(self, vals):
+        self.values = log(vals).reshape(self.card, order='F')
+
+    @property
+    def logvals(self):
+        '''A flat view of *values*, the logarithms of *vals*.'''
+        return self.values.reshape(-1, order='F')
+
+    def multiplyfactor(self, other):
+        '''Multiply this factor by another factor, by adding their logarithms.
+
+        *other* may be an instance of any factor class; factors that
+        are not in log space are converted first.
+
+        '''
+        self.combinefactor(other, np.add)
+
+    def combinefactor(self, other, operation):
+        '''Combine the logarithms in this factor with those of another factor, see *combinefactor* in :doc:`ArrayCPDFactor <arraycpdfactor>`.'''
+        if not isinstance(other, LogCPDFactor):
+            other = LogCPDFactor.fromfactor(other)
+        ArrayCPDFactor.combinefactor(self, other, operation)
+
+    def reducefactor(self, vertex, value=None, maximize=False, minimize=False):
+        '''Sum out, maximize out, minimize out or reduce *vertex* as
+        *reducefactor* in :doc:`ArrayCPDFactor <arraycpdfactor>` does,
+        working on the logarithms. Summing out is done by
+        log-sum-exp.'''
+        if maximize or minimize or value is not None:
+            return ArrayCPDFactor.reducefactor(
+                self, vertex, value, maximize, minimize)
+        axis = self.scope.index(vertex)
+        values = logsumexp(self.values, axis=axis)
+        self.scope = self.scope[:axis] + self.scope[axis+1:]
+        self.card = self.card[:axis] + self.card[axis+1:]
+        self.values = np.asarray(values, order='F')
+        return self
+
+    sumout = reducefactor
+
+    def sumproduct(self, others, vertex, path=None):
+        '''Multiply this factor by each factor in *others* and sum out
+        *vertex*, as *sumproduct* in :doc:`ArrayCPDFactor
+        <arraycpdfactor>`.
+
+        Each operand is scaled by its largest entry before the
+        contraction, and the scales are added back to the logarithm
+        of the result. The entries of the result that are zero are
+        then recomputed in log space, one sum over *vertex* each: this
+        keeps the entries that are exactly zero, e.g. under
+        deterministic CPDs, and recovers those that merely underflowed.
+        The memory this needs grows with the number of zero entries,
+        and reaches that of the full product only if all are zero.
+
+        '''
+        others = [other if isinstance(other, LogCPDFactor)
+                  else LogCPDFactor.fromfactor(other) for other in others]
+        factors = [self] + others
+        operands = []
+        shift = 0.
+        for factor in factors:
+            top = factor.values.max() if factor.values.size else 0.
+            if not np.isfinite(top):
+                top = 0.
+            operands.append((np.exp(factor.values - top), factor.scope))
+            shift += top
+
+        fused = LogCPDFactor.__new__(LogCPDFactor)
+        fused.absorb(operands, vertex, path)
+        # at least 1-d, as the result may have an empty scope
+        values = np.atleast_1d(log(fused.values) + shift)
+        zeros = np.nonzero(values == -np.inf)
+        if zeros[0].size:
+            # the log-space terms of each zero entry, one column per
+            # value of vertex
+            card = 1
+            for factor in factors:
+                if vertex in factor.scope:
+                    card = factor.card[factor.scope.index(vertex)]
+            terms = np.zeros((zeros[0].size, card))
+            for factor in factors:
+                index = tuple(
+                    np.arange(card)[None, :] if t_scope == vertex
+                    else zeros[fused.scope.index(t_scope)][:, None]
+                    for t_scope in factor.scope)
+                terms = terms + factor.values[index]
+            values[zeros] = logsumexp(terms, axis=1)
+        self.values = np.asarray(values.reshape(fused.values.shape), order='F')
+        self.scope = fused.scope
+        self.card = fused.card
+        return self
+
+    def normalize(self):
+        '''Scale the entries of the factor to sum to one, unless they are all zero.'''
+        norm = logsumexp(self.values)
+        if np.isfinite(norm):
+            self.values = self.values - norm
+        return self
@@ -0,0 +1,303 @@
+# Copyright (c) 2012, CyberPoint International, LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the CyberPoint International, LLC nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL CYBERPOINT INTERNATIONAL, LLC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+This module provides approximate inference in discrete Bayesian networks by loopy belief propagation. The CPDs of the network form a factor graph, with one factor node per CPD and one variable node per vertex, and messages are passed along its edges until they no longer change. On networks without undirected cycles the resulting beliefs are the exact marginals; on other networks they are approximations, obtained at a cost per iteration that is linear in the size of the CPD tables, whatever the treewidth of the network. For more information cf. Koller et al. Ch. 11.3, and Elidan et al., "Residual belief propagation: informed scheduling for asynchronous message passing", UAI 2006.
+
+'''
+try:
+    import numpy as np
+except ImportError:
+    raise ImportError("numpy is not installed on your system.")
+
+import heapq
+
+from .tablecpdfactorization import TableCPDFactorization
+from .arraycpdfactor import ArrayCPDFactor, contract
+
+class LoopyBP(TableCPDFactorization):
+    '''Loopy belief propagation on a discrete CPD Bayesian network.
+
+    Use *marginals* to obtain the approximate posterior of every node
+    from a single run. *condprobve* and *specificquery* take the same
+    arguments as in :doc:`TableCPDFactorization
+    <tablecpdfactorization>`, as long as the queried vertices belong
+    to the family of one vertex; they are answered from the beliefs of
+    the last run, which is only repeated when the evidence changes.
+
+    Usage example: this code would print the posterior of every node
+    given evidence::
+
+        from libpgm.nodedata import NodeData
+        from libpgm.discretebayesiannetwork import DiscreteBayesianNetwork
+        from libpgm.loopybp import LoopyBP
+
+        nd = NodeData.load("../tests/unittestdict.txt")
+        bn = DiscreteBayesianNetwork(nd)
+        bp = LoopyBP(bn, schedule="residual", damping=.5)
+        print bp.marginals(dict(Letter='weak'))
+        print bp.converged, bp.updates
+
+    '''
+    factortype = ArrayCPDFactor
+
+    schedule = 'flooding'
+    '''The order of the message updates. With 'flooding', all factors send their messages at once in each iteration. With 'residual', the factor whose messages would change most sends first, which usually converges in fewer updates.'''
+
+    damping = 0.
+    '''The weight, between 0 and 1, of the old message in each update. A positive damping slows down the updates, but helps against oscillation on networks with tight loops.'''
+
+    tolerance = 1e-6
+    '''The run has converged when no message would change by more than this in any entry.'''
+
+    maxiterations = 100
+    '''The largest number of iterations of a run. In the residual schedule, an iteration counts as many updates as there are factors.'''
+
+    def __init__(self, bn, schedule=None, damping=None, tolerance=None,
+                 maxiterations=None):
+        '''
+        This class is constructed with a :doc:`DiscreteBayesianNetwork <discretebayesiannetwork>` instance as argument. The other arguments, if given, replace the defaults of *schedule*, *damping*, *tolerance* and *maxiterations*.
+
+        '''
+        if schedule is not None:
+            assert schedule in ('flooding', 'residual'), (
+                "Unknown schedule %r." % schedule)
+            self.schedule = schedule
+        if damping is not None:
+            self.damping = damping
+        if tolerance is not None:
+            self.tolerance = tolerance
+        if maxiterations is not None:
+            self.maxiterations = maxiterations
+        TableCPDFactorization.__init__(self, bn)
+
+        self.factors = [factor if isinstance(factor, ArrayCPDFactor)
+                        else ArrayCPDFactor.fromfactor(factor)
+                        for factor in self.originalfactorlist]
+        '''A list of the factors of the factor graph, as :doc:`ArrayCPDFactor <arraycpdfactor>` instances.'''
+        self.card = dict((vertex, len(bn.Vdata[vertex]["vals"]))
+                         for vertex in bn.V)
+        '''A dict of {vertex: cardinality} pairs.'''
+        self.adjacent = dict((vertex, []) for vertex in bn.V)
+        '''A dict of {vertex: list of (factor, position)} pairs, giving the index of each factor holding the vertex and the position of the vertex in its scope.'''
+        for a, factor in enumerate(self.factors):
+            for j, vertex in enumerate(factor.scope):
+                self.adjacent[vertex].append((a, j))
+
+        self.evidence = None
+        '''The evidence of the last run, or None before the first run.'''
+        self.converged = None
+        '''True if the last run converged within *maxiterations*.'''
+        self.updates = 0
+        '''The number of factors that sent their messages in the last run.'''
+        self.tofactor = None
+        '''The messages of the last run from the vertices to the factors, a list holding for each factor a list of arrays, one per vertex of its scope.'''
+        self.tovertex = None
+        '''The messages of the last run from the factors to the vertices, laid out as *tofactor*.'''
+
+    def invalidate(self, vertices=None):
+        '''Rebuild the factor graph after CPDs in *bn* have changed. The arguments are those of *invalidate* in :doc:`TableCPDFactorization <tablecpdfactorization>`.'''
+        self.__init__(self.bn)
+
+    def local(self, vertex, evidence):
+        '''Return the logarithm of the indicator of the value of *vertex* in *evidence*, or zeros if *vertex* is not observed.'''
+        local = np.zeros(self.card[vertex])
+        if vertex in evidence:
+            vals = self.bn.Vdata[vertex]["vals"]
+            assert evidence[vertex] in vals, (
+                "Unknown value %r of %r." % (evidence[vertex], vertex))
+            local[:] = -np.inf
+            local[vals.index(evidence[vertex])] = 0.
+        return local
+
+    def incoming(self, vertex):
+        '''Return the logarithms of the messages from the factors to *vertex*, stacked into an array with one row per entry of *adjacent*.'''
+        messages = [self.tovertex[a][j] for a, j in self.adjacent[vertex]]
+        if not messages:
+            return np.zeros((0, self.card[vertex]))
+        with np.errstate(divide='ignore'):
+            return np.log(np.vstack(messages))
+
+    def sendvertex(self, vertex, evidence):
+        '''
+        Compute the messages from *vertex* to all its factors and store them in *tofactor*.
+
+        The message to a factor is the product of the local evidence with the messages from all the other factors. The products leaving out one factor each are formed from prefix and suffix sums of the logarithms, so that they take time linear in the number of factors, need no division and do not underflow.
+
+        '''
+        logs = self.incoming(vertex)
+        zeros = np.zeros((1, logs.shape[1]))
+        prefix = np.cumsum(np.vstack([zeros, logs]), axis=0)
+        suffix = np.cumsum(np.vstack([zeros, logs[::-1]]), axis=0)[::-1]
+        logs = self.local(vertex, evidence) + prefix[:-1] + suffix[1:]
+        for (a, j), message in zip(self.adjacent[vertex], exponentiate(logs)):
+            self.tofactor[a][j] = message
+
+    def sendfactor(self, a):
+        '''Return the messages factor *a* would send to the vertices of its scope, given the current messages in *tofactor*: for each vertex, the factor times the messages from the other vertices, summed down to that vertex and normalized.'''
+        factor = self.factors[a]
+        messages = []
+        for j, vertex in enumerate(factor.scope):
+            operands = [(factor.values, factor.scope)]
+            operands.extend((message, [other]) for k, (message, other)
+                            in enumerate(zip(self.tofactor[a], factor.scope))
+                            if k != j)
+            message = contract(operands, [vertex])
+            norm = message.sum()
+            messages.append(message / norm if norm > 0 else message)
+        return messages
+
+    def residual(self, a, messages):
+        '''Return the largest change of an entry of the messages of factor *a* if it sent *messages*.'''
+        return max(np.abs(new - old).max()
+                   for new, old in zip(messages, self.tovertex[a]))
+
+    def commit(self, a, messages):
+        '''Store *messages* as the messages of factor *a* in *tovertex*, damped by *damping*.'''
+        if self.damping:
+            messages = [(1. - self.damping) * new + self.damping * old
+                        for new, old in zip(messages, self.tovertex[a])]
+        self.tovertex[a] = messages
+        self.updates += 1
+
+    def run(self, evidence=None):
+        '''
+        Pass messages given *evidence*, a dict containing (vertex: value) pairs, until they converge or *maxiterations* is reached, starting from uniform messages. Sets *converged* and *updates*, and keeps the messages in *tofactor* and *tovertex*.
+
+        '''
+        if evidence is None:
+            evidence = {}
+        self.evidence = dict(evidence)
+        self.tovertex = [[np.ones(n) / n for n in factor.card]
+                         for factor in self.factors]
+        self.tofactor = [[np.ones(n) / n for n in factor.card]
+                         for factor in self.factors]
+        self.updates = 0
+        self.converged = False
+        for vertex in self.bn.V:
+            self.sendvertex(vertex, evidence)
+
+        if self.schedule == 'flooding':
+            for _ in range(self.maxiterations):
+                residual = 0.
+                for a in range(len(self.factors)):
+                    messages = self.sendfactor(a)
+                    residual = max(residual, self.residual(a, messages))
+                    self.commit(a, messages)
+                for vertex in self.bn.V:
+                    self.sendvertex(vertex, evidence)
+                if residual < self.tolerance:
+                    self.converged = True
+                    break
+            return
+
+        # residual schedule: a heap of (-residual, version, factor), in
+        # which an entry is stale if its factor was pushed again since
+        pending = {}
+        version = {}
+        heap = []
+        def push(a):
+            pending[a] = self.sendfactor(a)
+            version[a] = version.get(a, 0) + 1
+            heapq.heappush(
+                heap, (-self.residual(a, pending[a]), version[a], a))
+        for a in range(len(self.factors)):
+            push(a)
+        maxupdates = self.maxiterations * len(self.factors)
+        while heap:
+            residual, v, a = heapq.heappop(heap)
+            if v != version[a]:
+                continue
+            if -residual < self.tolerance:
+                self.converged = True
+                break
+            if self.updates >= maxupdates:
+                break
+            self.commit(a, pending[a])
+            affected = set([a])
+            for vertex in self.factors[a].scope:
+                self.sendvertex(vertex, evidence)
+                affected.update(b for b, _ in self.adjacent[vertex])
+            for b in affected:
+                push(b)
+        else:
+            self.converged = True
+
+    def update(self, evidence=None):
+        '''Run *run* with *evidence*, unless the last run had the same evidence.'''
+        if evidence is None:
+            evidence = {}
+        if self.evidence != evidence:
+            self.run(evidence)
+
+    def belief(self, vertex):
+        '''Return the belief of *vertex* after the last run, an array proportional to the product of its local evidence with all the messages it receives.'''
+        logs = self.local(vertex, self.evidence) + self.incoming(vertex).sum(axis=0)
+        return exponentiate(logs[np.newaxis])[0]
+
+    def condprobve(self, query, evidence=None):
+        '''
+        Return the approximate probability distribution over the vertices of *query* given *evidence*, as a factor like :doc:`TableCPDFactorization <tablecpdfactorization>` does.
+
+        A single vertex is answered from its belief. Several vertices must lie in the scope of one factor, whose belief, the factor times the messages from its vertices, is summed down to them.
+
+        '''
+        self.update(evidence)
+        query = list(query)
+        if len(query) == 1:
+            return ArrayCPDFactor.fromarray(
+                query, self.belief(query[0]), self.bn)
+        factors = [a for a, factor in enumerate(self.factors)
+                   if set(query) <= set(factor.scope)]
+        assert factors, "Query vertices must lie in the family of one vertex."
+        a = min(factors, key=lambda a: len(self.factors[a].scope))
+        factor = self.factors[a]
+        operands = [(factor.values, factor.scope)]
+        operands.extend((message, [vertex]) for message, vertex
+                        in zip(self.tofactor[a], factor.scope))
+        belief = ArrayCPDFactor.fromarray(
+            query, contract(operands, query), self.bn)
+        return belief.normalize()
+
+    def marginals(self, evidence=None):
+        '''
+        Return the approximate posterior distribution of every vertex given *evidence*, from a single run.
+
+        Returns:
+            A dict of {vertex: {value: probability}} pairs, in the format of the *avg* attribute of :doc:`SampleAggregator <sampleaggregator>`.
+
+        '''
+        self.update(evidence)
+        return dict((vertex, dict(zip(self.bn.Vdata[vertex]["vals"],
+                                      self.belief(vertex).tolist())))
+                    for vertex in self.bn.V)
+
+def exponentiate(logs):
+    '''Return the rows of the array *logs* of logarithms exponentiated and scaled to sum to one, leaving rows of zeros where all the logarithms are minus infinity.'''
+    top = logs.max(axis=1, initial=-np.inf)[:, np.newaxis]
+    top[~np.isfinite(top)] = 0.
+    rows = np.exp(logs - top)
+    norm = rows.sum(axis=1)[:, np.newaxis]
+    norm[norm == 0] = 1.
+    return rows / norm
@@ -0,0 +1,205 @@
+# Copyright (c) 2012, CyberPoint International, LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the CyberPoint International, LLC nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL CYBERPOINT INTERNATIONAL, LLC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+This module provides mini-bucket elimination, an approximation of variable elimination whose memory is bounded by a parameter, the *i-bound*. Variable elimination multiplies all the factors mentioning a vertex (its bucket) into one factor, which on densely connected networks can grow beyond any memory. Mini-bucket elimination splits each bucket into mini-buckets of at most *i-bound* vertices each and eliminates the vertex from each of them separately. Summing out of one mini-bucket and maximizing out of the others gives an upper bound on the result of exact elimination, minimizing out instead of maximizing a lower bound. A larger i-bound gives tighter bounds at a higher cost; once no bucket needs to be split, both bounds are exact. For more information cf. Dechter and Rish, "Mini-buckets: A general scheme for bounded inference", J. ACM 50(2), 2003.
+
+'''
+from .tablecpdfactorization import TableCPDFactorization
+from . import eliminationorder
+
+class MiniBucket(TableCPDFactorization):
+    '''Mini-bucket elimination on a discrete CPD Bayesian network.
+
+    This class can be used in place of
+    :doc:`TableCPDFactorization <tablecpdfactorization>`, but its
+    *specificquery* returns a lower and an upper bound on the
+    probability of the queried event instead of the probability
+    itself. No factor created along the way has more than *ibound*
+    vertices, unless a CPD of the network has more already. The other
+    queries are inherited and exact.
+
+    Usage example: this code would bound P(Grade=A | Letter=weak) with
+    ever larger i-bounds, until the bounds are exact::
+
+        from libpgm.nodedata import NodeData
+        from libpgm.discretebayesiannetwork import DiscreteBayesianNetwork
+        from libpgm.minibucket import MiniBucket
+
+        nd = NodeData.load("../tests/unittestdict.txt")
+        bn = DiscreteBayesianNetwork(nd)
+        mb = MiniBucket(bn)
+        for ibound, lower, upper in mb.anytimequery(
+                dict(Grade=['A']), dict(Letter='weak')):
+            print ibound, lower, upper
+
+    '''
+    ibound = 3
+    '''The largest number of vertices in the scope of a mini-bucket.'''
+
+    def __init__(self, bn, ibound=None, factortype=None, heuristic=None):
+        '''
+        This class is constructed with a :doc:`DiscreteBayesianNetwork <discretebayesiannetwork>` instance as argument, and optionally the *ibound*. *factortype* and *heuristic* are those of :doc:`TableCPDFactorization <tablecpdfactorization>`.
+
+        '''
+        if ibound is not None:
+            self.ibound = ibound
+        TableCPDFactorization.__init__(self, bn, factortype, heuristic)
+        self.exact = None
+        '''True if no bucket had to be split by the last call of *specificquery*, so that its bounds are equal to the exact probability.'''
+
+    def partition(self, bucket, ibound):
+        '''Split the factors in *bucket* into mini-buckets whose joint scopes have at most *ibound* vertices, placing the largest factors first, each into the first mini-bucket it fits in. Returns a list of lists of factors.'''
+        minibuckets = []
+        for factor in sorted(bucket, key=lambda factor: -len(factor.scope)):
+            for scope, factors in minibuckets:
+                if len(scope.union(factor.scope)) <= ibound:
+                    scope.update(factor.scope)
+                    factors.append(factor)
+                    break
+            else:
+                minibuckets.append((set(factor.scope), [factor]))
+        return [factors for _, factors in minibuckets]
+
+    def bound(self, factors, vertices, upper, ibound):
+        '''
+        Bound the sum over all values of *vertices* of the product of *factors*.
+
+        Arguments:
+            1. *factors* -- A list of factors, which are not modified.
+            2. *vertices* -- The vertices to eliminate, which must be all the vertices in the scopes of *factors*.
+            3. *upper* -- If true, return an upper bound, otherwise a lower bound.
+            4. *ibound* -- The largest number of vertices of a mini-bucket.
+
+        Returns:
+            A tuple (bound, exact), where *exact* is true if no bucket had to be split, and *bound* then equals the sum.
+
+        '''
+        card = dict((vertex, len(self.bn.Vdata[vertex]["vals"]))
+                    for factor in factors for vertex in factor.scope)
+        order, _ = eliminationorder.eliminationorder(
+            [factor.scope for factor in factors], card, vertices,
+            self.heuristic)
+
+        constant = 1.
+        exact = True
+        for vertex in order:
+            bucket = [factor for factor in factors if vertex in factor.scope]
+            factors = [factor for factor in factors
+                       if vertex not in factor.scope]
+            minibuckets = self.partition(bucket, ibound)
+            exact = exact and len(minibuckets) == 1
+            for i, minibucket in enumerate(minibuckets):
+                factor = minibucket[0].copy()
+                if i == 0:
+                    factor.sumproduct(minibucket[1:], vertex)
+                else:
+                    for other in minibucket[1:]:
+                        factor.multiplyfactor(other)
+                    if upper:
+                        factor.maxout(vertex)
+                    else:
+                        factor.minout(vertex)
+                if factor.scope:
+                    factors.append(factor)
+                else:
+                    constant *= float(factor.vals[0])
+        return constant, exact
+
+    def specificquery(self, query, evidence=None, ibound=None):
+        '''
+        Bound the probability of the event specified by *query* given *evidence*.
+
+        Arguments:
+            1. *query* -- A dict of {vertex: list of values} pairs, as for *specificquery* in :doc:`TableCPDFactorization <tablecpdfactorization>`.
+            2. *evidence* -- A dict of {vertex: value} pairs.
+            3. *ibound* -- (Optional) The i-bound to use instead of *ibound*.
+
+        Returns:
+            A tuple (lower, upper) of bounds on the probability.
+
+        The probability is the ratio of P(query, evidence) and
+        P(evidence), each of which is bounded from both sides by
+        mini-bucket elimination: the lower bound is the lower bound
+        of the former over the upper bound of the latter, and vice
+        versa. If *prune* is true, only the relevant part of the
+        network takes part (see :doc:`queryplan`). Sets *exact*.
+
+        '''
+        if evidence is None:
+            evidence = {}
+        if ibound is None:
+            ibound = self.ibound
+        assert not set(query) & set(evidence), "Query and evidence must not overlap."
+        if self.prune:
+            vertices, requisite = self.bn.getrelevant(query, evidence)
+            evidence = dict((vertex, evidence[vertex]) for vertex in requisite)
+        else:
+            vertices = set(self.bn.V)
+
+        # constant factors cancel in the ratio
+        factors = [factor.reduced(evidence)
+                   for factor in self.originalfactorlist
+                   if factor.inputvertex in vertices]
+        factors = [factor for factor in factors if factor.scope]
+        eliminate = [vertex for vertex in self.bn.V
+                     if vertex in vertices and vertex not in evidence]
+
+        # zero the entries of the values outside the event, in the CPD
+        # of each queried vertex, where the vertex comes first
+        event = []
+        for factor in factors:
+            if factor.inputvertex in query:
+                values = self.bn.Vdata[factor.inputvertex]["vals"]
+                allowed = query[factor.inputvertex]
+                factor = factor.copy()
+                factor.vals = [
+                    val if values[index % factor.card[0]] in allowed else 0.
+                    for index, val in enumerate(factor.vals)]
+            event.append(factor)
+
+        jointlower, exact1 = self.bound(event, eliminate, False, ibound)
+        jointupper, _ = self.bound(event, eliminate, True, ibound)
+        marginallower, exact2 = self.bound(factors, eliminate, False, ibound)
+        marginalupper, _ = self.bound(factors, eliminate, True, ibound)
+        self.exact = exact1 and exact2
+
+        lower = jointlower / marginalupper if marginalupper else 0.
+        upper = min(1., jointupper / marginallower) if marginallower else 1.
+        return min(lower, upper), upper
+
+    def anytimequery(self, query, evidence=None, ibounds=None):
+        '''
+        Bound the probability of the event specified by *query* given *evidence* repeatedly, with growing i-bounds.
+
+        This generator yields a tuple (ibound, lower, upper) for each i-bound in *ibounds*, which defaults to 1, 2, 3, ... The bounds tighten as the i-bound grows, and the generator stops as soon as they are exact. It can thus be stopped whenever the bounds are tight enough or the time is up.
+
+        '''
+        if ibounds is None:
+            ibounds = range(1, len(self.bn.V) + 1)
+        for ibound in ibounds:
+            lower, upper = self.specificquery(query, evidence, ibound)
+            yield ibound, lower, upper
+            if self.exact:
+                return
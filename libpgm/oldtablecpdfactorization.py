@@ -30,7 +30,6 @@ This module provides tools for creating and using factorized representations of
 from .tablecpdfactor import TableCPDFactor
 
 import random
-import copy
 
 class TableCPDFactorization():
     '''Factorized discrete CPD Bayesian Network.
@@ -39,9 +38,12 @@ class TableCPDFactorization():
     CPD tables. 
     '''
 
+    factortype = TableCPDFactor
+    '''The class used to represent the factors, :doc:`TableCPDFactor <tablecpdfactor>` by default.'''
+
     def __init__(self, bn):
         '''
-        This class is constructed with a :doc:`DiscreteBayesianNetwork <discretebayesiannetwork>` instance as argument. First, it takes the input itself and stores it in the *bn* attribute. Then, it transforms the information of each of these nodes from standard discrete CPD form into a :doc:`TableCPDFactor <tablecpdfactor>` isntance and stores the instances in an array in the attribute *originalfactorlist*. Finally, it makes a copy of this list to work with and stores it in *factorlist*.
+        This class is constructed with a :doc:`DiscreteBayesianNetwork <discretebayesiannetwork>` instance as argument. First, it takes the input itself and stores it in the *bn* attribute. Then, it transforms the information of each of these nodes from standard discrete CPD form into a :doc:`TableCPDFactor <tablecpdfactor>` isntance and stores the instances in an array in the attribute *originalfactorlist*. Finally, it makes a shallow copy of this list to work with and stores it in *factorlist*.
         
         '''
         
@@ -50,19 +52,25 @@ class TableCPDFactorization():
         self.originalfactorlist = []
         '''A list of :doc:`TableCPDFactor <tablecpdfactor>` instances, one per node.'''
         for vertex in bn.V:
-            factor = TableCPDFactor(vertex, bn)
+            factor = self.makefactor(vertex)
             self.originalfactorlist.append(factor)
-        self.factorlist = copy.deepcopy(self.originalfactorlist)  
-        '''A working copy of *originalfactorlist*.'''
+        self.factorlist = self.originalfactorlist[:]
+        '''A working copy of *originalfactorlist*. It starts out holding the original factors themselves, which are copied before they are first modified.'''
 
         assert self.factorlist, "Factor list not properly loaded, check for an incomplete class instance as input."
     
+    def makefactor(self, vertex):
+        '''Return the factor of *vertex* in *bn*, an instance of *factortype*.'''
+        return self.factortype(vertex, self.bn)
+
     def refresh(self):
         '''
         Refresh the *factorlist* attribute to equate with *originalfactorlist*. This is in effect a reset of the system, erasing any changes to *factorlist* that the program has executed.
 
+        The factors are never modified in place by this class, so the reset only copies the list, not the factors.
+
         '''
-        self.factorlist = copy.deepcopy(self.originalfactorlist)    
+        self.factorlist = self.originalfactorlist[:]
             
     def sumproducteliminatevar(self, vertex):    
         '''Marginalize over all values of *vertex*
@@ -71,6 +79,8 @@ class TableCPDFactorization():
         *vertex* in their scope, then sum out *vertex* from the
         resulting product factor. Replace all factors that were
         multiplied together with the resulting summed-out product.
+        Both steps are done at once by *sumproduct* of the factors,
+        so the product itself is never held in memory.
         
         Arguments:
             1. *vertex* - The name of the variable to eliminate.
@@ -90,12 +100,10 @@ class TableCPDFactorization():
             except ValueError:
                 factors2.append(factor)
                 
-        # multiply factors1 array together
-        for i in range(1, len(factors1)):
-            factors1[0].multiplyfactor(factors1[i])
-        
-        # sum out the vertex from the factor
-        factors1[0].sumout(vertex)
+        # multiply factors1 array together and sum out the vertex,
+        # without building the full product
+        factors1[0] = factors1[0].copy()
+        factors1[0].sumproduct(factors1[1:], vertex)
         
         # add to rest of factors and return
         if (factors1[0] != None):
@@ -119,6 +127,7 @@ class TableCPDFactorization():
             self.sumproducteliminatevar(vertex)
         
         # multiply together if many factors remain 
+        self.factorlist[0] = self.factorlist[0].copy()
         for i in range(1, len(self.factorlist)):
             self.factorlist[0].multiplyfactor(self.factorlist[i])
         
@@ -194,7 +203,7 @@ class TableCPDFactorization():
         for key in evidence.keys():
             for x in range(len(self.factorlist)):
                 if (self.factorlist[x].scope.count(key) > 0):
-                    self.factorlist[x].reducefactor(key, evidence[key])
+                    self.factorlist[x] = self.factorlist[x].copy().reducefactor(key, evidence[key])
             for x in reversed(range(len(self.factorlist))):
                 if (self.factorlist[x].scope == []):
                     del(self.factorlist[x])
@@ -205,12 +214,7 @@ class TableCPDFactorization():
         factor = self.factorlist[0]
         
         # normalize result
-        summ = 0
-        lngth = len(factor.vals)
-        for x in range(lngth):
-            summ += factor.vals[x]
-        for x in range(lngth):
-            factor.vals[x] /= summ
+        factor.normalize()
             
         # return table
         return factor
@@ -368,10 +372,11 @@ class TableCPDFactorization():
             # output
             print json.dumps(result, indent=2)
 
+        The evidence is entered into a local copy of *originalfactorlist*, leaving *factorlist* unchanged, so that several samplers can run on one instance at once.
+
         '''
-        self.refresh()
+        factorlist = self.originalfactorlist[:]
 
-        
         # declare result array
         seq = []
         
@@ -389,12 +394,12 @@ class TableCPDFactorization():
 
         # reduce factorlist given E = e
         for key in evidence.keys():
-            for x in range(len(self.factorlist)):
-                if (self.factorlist[x].scope.count(key) > 0):
-                    self.factorlist[x].reducefactor(key, evidence[key])
-            for x in reversed(range(len(self.factorlist))):    
-                if (self.factorlist[x].scope == []):
-                    del(self.factorlist[x])
+            for x in range(len(factorlist)):
+                if (factorlist[x].scope.count(key) > 0):
+                    factorlist[x] = factorlist[x].copy().reducefactor(key, evidence[key])
+            for x in reversed(range(len(factorlist))):    
+                if (factorlist[x].scope == []):
+                    del(factorlist[x])
                     
         # define function to create the next instantiation
         # this feels very odd, why would you define a function inside another function
@@ -402,29 +407,22 @@ class TableCPDFactorization():
         # in the funcion!
         def next(current): 
             for node in order:
-                # multiply all relevant factors together
+                # reduce the relevant factors to leave only the one
+                # node, then multiply them together; reducing first
+                # keeps the product as small as the node itself
                 relevantfactors = []
-                for factor in self.factorlist:
+                for factor in factorlist:
                     if (factor.scope.count(node) > 0):
-                        factorcopy = factor.copy()
-                        relevantfactors.append(factorcopy)
+                        relevantfactors.append(factor.reduced(dict(
+                            (othernode, current[othernode])
+                            for othernode in factor.scope
+                            if othernode != node)))
+                relevantfactors[0] = relevantfactors[0].copy()
                 for j in range(1, len(relevantfactors)):
                     relevantfactors[0].multiplyfactor(relevantfactors[j])
 
-                # reduce to leave only the one node
-                for othernode in order:
-                    if (othernode != node and relevantfactors[0].scope.count(othernode) > 0):
-                        relevantfactors[0].reducefactor(othernode, current[othernode])
-
-                if not all([val==0 for val in relevantfactors[0].vals]):
-                #if not all relevantfactors[0].vals equal zero
-                #if they do all equal 0, no reason to renormalize
-                    # renormalize
-                    summ = 0
-                    for val in relevantfactors[0].vals:
-                        summ += val
-                    for x in range(len(relevantfactors[0].vals)):
-                        relevantfactors[0].vals[x] /= summ
+                # renormalize, unless all the values are zero
+                relevantfactors[0].normalize()
 
                 # convert random number
                 val = random.random()
@@ -0,0 +1,223 @@
+# Copyright (c) 2012, CyberPoint International, LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the CyberPoint International, LLC nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL CYBERPOINT INTERNATIONAL, LLC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+This module provides exact inference in discrete Bayesian networks whose graph is a polytree, by Pearl's message passing. In a polytree each edge splits the network in two, so that the message sent along an edge summarizes all the evidence on one side of it. Two passes of messages over the edges, towards a root and back, give the posterior of every node, in time linear in the total size of the CPD tables. For more information cf. Pearl, *Probabilistic Reasoning in Intelligent Systems* (1988), Ch. 4.3, or Koller et al. Ch. 10.2.
+
+'''
+try:
+    import numpy as np
+except ImportError:
+    raise ImportError("numpy is not installed on your system.")
+
+from .tablecpdfactorization import TableCPDFactorization
+from .arraycpdfactor import ArrayCPDFactor, contract
+
+class PolytreeBP(TableCPDFactorization):
+    '''Pearl's belief propagation on a discrete CPD Bayesian network whose graph is a polytree.
+
+    This class can be used in place of
+    :doc:`TableCPDFactorization <tablecpdfactorization>`: *condprobve*
+    and *specificquery* take the same arguments. Queries on one vertex,
+    or on vertices of the family of one vertex, are answered from the
+    messages of one run, which is only repeated when the evidence
+    changes; other queries fall back to variable elimination. Use
+    *marginals* to obtain all posteriors at once.
+    :doc:`DiscreteBayesianNetwork <discretebayesiannetwork>` uses this
+    class automatically when its graph is a polytree.
+
+    A run keeps its state local and stores its result in a single
+    assignment, so one instance can serve queries from many threads at
+    once.
+
+    '''
+    factortype = ArrayCPDFactor
+
+    def __init__(self, bn):
+        '''
+        This class is constructed with a :doc:`DiscreteBayesianNetwork <discretebayesiannetwork>` instance as argument, whose graph must be a polytree (see *ispolytree* in :doc:`GraphSkeleton <graphskeleton>`).
+
+        '''
+        assert bn.ispolytree(), "The graph of the network is not a polytree."
+        TableCPDFactorization.__init__(self, bn)
+        self.factors = dict(
+            (factor.inputvertex, factor if isinstance(factor, ArrayCPDFactor)
+             else ArrayCPDFactor.fromfactor(factor))
+            for factor in self.originalfactorlist)
+        '''A dict of {vertex: factor} pairs holding the CPD of each vertex as an :doc:`ArrayCPDFactor <arraycpdfactor>`.'''
+        self.children = dict((vertex, []) for vertex in bn.V)
+        '''A dict of {vertex: list of children} pairs.'''
+        for vertex in bn.V:
+            for parent in bn.Vdata[vertex]["parents"]:
+                self.children[parent].append(vertex)
+
+        # the two passes: a depth-first order of each component, and
+        # the neighbour through which each vertex was reached
+        self.schedule = []
+        '''A list of (vertex, neighbour) pairs in depth-first order of each component, where *neighbour* is the vertex it was reached from, or None for the first vertex of a component. Messages are sent along these edges in reverse order, then out of each vertex in this order.'''
+        seen = set()
+        for root in bn.V:
+            if root in seen:
+                continue
+            seen.add(root)
+            stack = [(root, None)]
+            while stack:
+                vertex, previous = stack.pop()
+                self.schedule.append((vertex, previous))
+                for neighbour in self.neighbours(vertex):
+                    if neighbour not in seen:
+                        seen.add(neighbour)
+                        stack.append((neighbour, vertex))
+
+        self.last = None
+        '''A tuple (evidence, messages) holding the result of the last run.'''
+
+    def invalidate(self, vertices=None):
+        '''Rebuild the engine after CPDs in *bn* have changed. The arguments are those of *invalidate* in :doc:`TableCPDFactorization <tablecpdfactorization>`.'''
+        self.__init__(self.bn)
+
+    def neighbours(self, vertex):
+        '''Return the parents and children of *vertex*.'''
+        return self.bn.Vdata[vertex]["parents"] + self.children[vertex]
+
+    def local(self, vertex, evidence):
+        '''Return the indicator of the value of *vertex* in *evidence*, or ones if *vertex* is not observed.'''
+        vals = self.bn.Vdata[vertex]["vals"]
+        if vertex not in evidence:
+            return np.ones(len(vals))
+        assert evidence[vertex] in vals, (
+            "Unknown value %r of %r." % (evidence[vertex], vertex))
+        local = np.zeros(len(vals))
+        local[vals.index(evidence[vertex])] = 1.
+        return local
+
+    def combine(self, vertex, evidence, messages, scope, exclude=None):
+        '''
+        Multiply the CPD of *vertex* with its local evidence and all the messages it received, except the one from *exclude*, and sum the product down to *scope*.
+
+        The messages from the children of *vertex* (Pearl's lambda messages) and from its parents (pi messages) are all arrays over the parent of their edge, so that they multiply into the CPD by their scope alone.
+
+        '''
+        factor = self.factors[vertex]
+        belief = self.local(vertex, evidence)
+        for child in self.children[vertex]:
+            if child != exclude:
+                belief = belief * messages[(child, vertex)]
+        operands = [(factor.values, factor.scope), (belief, [vertex])]
+        operands.extend((messages[(parent, vertex)], [parent])
+                        for parent in self.bn.Vdata[vertex]["parents"]
+                        if parent != exclude)
+        return contract(operands, scope)
+
+    def run(self, evidence=None):
+        '''
+        Pass the messages of both passes given *evidence*, a dict containing (vertex: value) pairs.
+
+        Returns:
+            A dict of {(sender, receiver): message} pairs. The message from a vertex to a child is the distribution of the vertex given the evidence on its side of the edge; the message from a vertex to a parent is the likelihood of the evidence on its side of the edge given the parent. Each is scaled to sum to one, which avoids underflow.
+
+        '''
+        if evidence is None:
+            evidence = {}
+        messages = {}
+        def send(vertex, neighbour):
+            scope = [vertex] if neighbour in self.children[vertex] else [neighbour]
+            message = self.combine(vertex, evidence, messages, scope, neighbour)
+            norm = message.sum()
+            messages[(vertex, neighbour)] = message / norm if norm > 0 else message
+        for vertex, previous in reversed(self.schedule):
+            if previous is not None:
+                send(vertex, previous)
+        for vertex, previous in self.schedule:
+            for neighbour in self.neighbours(vertex):
+                if neighbour != previous:
+                    send(vertex, neighbour)
+        return messages
+
+    def messages(self, evidence=None):
+        '''Return the messages of *run* given *evidence*, reusing those of the last run if it had the same evidence.'''
+        if evidence is None:
+            evidence = {}
+        last = self.last
+        if last is not None and last[0] == evidence:
+            return last[1]
+        messages = self.run(evidence)
+        self.last = (dict(evidence), messages)
+        return messages
+
+    def probability(self, evidence=None):
+        '''
+        Return the probability of *evidence*, a dict containing (vertex: value) pairs, from the messages of a run.
+
+        As the families of the vertices form a junction tree whose separators are the edges of the polytree, the probability is the product of the sums of all family beliefs divided by the product of the sums of the two messages along each edge, which cancels the scaling of the messages.
+
+        '''
+        if evidence is None:
+            evidence = {}
+        messages = self.messages(evidence)
+        probability = 1.
+        for vertex in self.bn.V:
+            probability *= float(self.combine(vertex, evidence, messages, []))
+            if not probability:
+                return 0.
+            for parent in self.bn.Vdata[vertex]["parents"]:
+                probability /= float(np.dot(messages[(parent, vertex)],
+                                            messages[(vertex, parent)]))
+        return probability
+
+    def condprobve(self, query, evidence=None):
+        '''
+        Return the probability distribution over the vertices of *query* given *evidence*, as :doc:`TableCPDFactorization <tablecpdfactorization>` does.
+
+        If the vertices of *query* lie in the family of one vertex, the distribution is the product of its CPD with its local evidence and all its messages, summed down to *query*. Otherwise the query falls back to variable elimination.
+
+        '''
+        if evidence is None:
+            evidence = {}
+        query = list(query)
+        families = [vertex for vertex in self.bn.V
+                    if set(query) <= set(self.factors[vertex].scope)]
+        if not families:
+            return TableCPDFactorization.condprobve(self, query, evidence)
+        vertex = min(families, key=lambda vertex: len(self.factors[vertex].scope))
+        values = self.combine(vertex, evidence, self.messages(evidence), query)
+        return ArrayCPDFactor.fromarray(query, values, self.bn).normalize()
+
+    def marginals(self, evidence=None):
+        '''
+        Return the posterior distribution of every vertex given *evidence*, from a single run.
+
+        Returns:
+            A dict of {vertex: {value: probability}} pairs, in the format of the *avg* attribute of :doc:`SampleAggregator <sampleaggregator>`.
+
+        '''
+        if evidence is None:
+            evidence = {}
+        messages = self.messages(evidence)
+        result = {}
+        for vertex in self.bn.V:
+            ps = self.combine(vertex, evidence, messages, [vertex])
+            ps = ps / ps.sum()
+            result[vertex] = dict(zip(self.bn.Vdata[vertex]["vals"], ps.tolist()))
+        return result
@@ -0,0 +1,241 @@
+# Copyright (c) 2012, CyberPoint International, LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the CyberPoint International, LLC nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL CYBERPOINT INTERNATIONAL, LLC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+This module provides compiled query plans for variable elimination. Everything that variable elimination decides from the names of the query and evidence variables alone -- which factors are relevant to the query, which axes are reduced by the evidence, the elimination order and which factors are combined at each step -- is worked out once, when the plan is built. Running the plan for particular evidence values then only reduces and combines the factors. :doc:`TableCPDFactorization <tablecpdfactorization>` keeps the plans of recent query shapes in a cache.
+
+'''
+
+try:
+    import numpy as np
+except ImportError:
+    raise ImportError("numpy is not installed on your system.")
+
+from .arraycpdfactor import ArrayCPDFactor, contract
+from . import eliminationorder
+
+class QueryPlan:
+    '''A compiled variable elimination for one shape of query.
+
+    A plan is built for a set of query vertices and a set of evidence
+    vertices, and can be run for any values of the evidence vertices.
+
+    '''
+    def __init__(self, factorization, query, evidence):
+        '''
+        Compile the plan of the query for the vertices in *query* given evidence on the vertices in *evidence*, on the factors of *factorization*, an instance of :doc:`TableCPDFactorization <tablecpdfactorization>`. The original factors of *factorization* are only read, never modified, when the plan runs.
+
+        If *factorization.prune* is true, the plan is restricted to the relevant part of the network found by *getrelevant* in :doc:`GraphSkeleton <graphskeleton>`: the factors of barren vertices are left out, and so is evidence that is d-separated from the query.
+
+        '''
+        bn = factorization.bn
+        query = set(query)
+        evidence = set(evidence)
+        if factorization.prune:
+            vertices, evidence = bn.getrelevant(query, evidence)
+        else:
+            vertices = set(bn.V)
+
+        self.bn = bn
+        '''The Bayesian network the plan runs on.'''
+        self.query = frozenset(query)
+        '''The query vertices.'''
+        self.evidence = frozenset(evidence)
+        '''The evidence vertices that the result depends on. Other evidence is ignored.'''
+        self.vertices = frozenset(vertices)
+        '''The vertices whose CPDs take part in the query.'''
+        self.factors = []
+        '''The factors taking part in the query, before reduction.'''
+        self.reductions = []
+        '''A list holding, for each factor in *factors*, a list of (vertex, axis) pairs of the evidence vertices in its scope.'''
+        self.scopes = []
+        '''A list of the scopes of the factors in *factors* after reduction.'''
+        self.valueindex = dict(
+            (vertex, dict((value, i) for i, value
+                          in enumerate(bn.Vdata[vertex]["vals"])))
+            for vertex in evidence)
+        '''A dict of {vertex: {value: index}} pairs for each evidence vertex.'''
+
+        for factor in factorization.originalfactorlist:
+            if factor.inputvertex not in vertices:
+                continue
+            scope = [vertex for vertex in factor.scope
+                     if vertex not in evidence]
+            if not scope:
+                # a constant once reduced, removed by the normalization
+                continue
+            self.factors.append(factor)
+            self.reductions.append([
+                (vertex, axis) for axis, vertex in enumerate(factor.scope)
+                if vertex in evidence])
+            self.scopes.append(scope)
+
+        card = dict((vertex, len(bn.Vdata[vertex]["vals"]))
+                    for scope in self.scopes for vertex in scope)
+        eliminate = [vertex for vertex in bn.V
+                     if vertex in vertices
+                     if vertex not in query
+                     if vertex not in evidence]
+        self.order, self.maxfactorsize = eliminationorder.eliminationorder(
+            self.scopes, card, eliminate, factorization.heuristic)
+
+        # slots 0..n-1 are the reduced factors, each step adds one slot
+        self.steps = []
+        '''A list of (slots, vertex) pairs: the slots of the factors multiplied together before summing out *vertex*. The result of step i is stored in slot len(factors) + i.'''
+        scopes = [set(scope) for scope in self.scopes]
+        active = list(range(len(scopes)))
+        for vertex in self.order:
+            slots = [slot for slot in active if vertex in scopes[slot]]
+            active = [slot for slot in active if slot not in slots]
+            scope = set().union(*[scopes[slot] for slot in slots])
+            scope.discard(vertex)
+            self.steps.append((slots, vertex))
+            active.append(len(scopes))
+            scopes.append(scope)
+        self.final = active
+        '''The slots multiplied together to give the result.'''
+        assert self.final, "Query must contain an unobserved vertex."
+
+        self.paths = [
+            (vertex, factorization.contractionpath(
+                [scopes[slot] for slot in slots], vertex))
+            for slots, vertex in self.steps]
+        self.paths.append((None, factorization.contractionpath(
+            [scopes[slot] for slot in self.final])))
+        '''A list of (vertex, path) pairs holding the contraction path of each step, as *paths* in :doc:`TableCPDFactorization <tablecpdfactorization>`, followed by the path of the final product under vertex None.'''
+
+        self.width = 0
+        '''The number of vertices of the largest factor multiplied together, less one: the treewidth induced by *order* on the relevant part of the network.'''
+        self.flops = 0
+        '''The predicted number of multiplications and additions of a run.'''
+        for (slots, vertex), (_, path) in zip(
+                self.steps + [(self.final, None)], self.paths):
+            stepscopes = [scopes[slot] for slot in slots]
+            joint = set().union(*stepscopes)
+            self.width = max(self.width, len(joint) - 1)
+            self.flops += eliminationorder.contractioncost(
+                stepscopes, card, path, [] if vertex is None else [vertex])
+            # the additions of summing out, or of the normalization
+            self.flops += eliminationorder.size(joint, card)
+
+    def reduce(self, i, evidence):
+        '''Return factor *i* of *factors* reduced by *evidence*, without modifying it.'''
+        factor = self.factors[i]
+        reductions = self.reductions[i]
+        if not reductions:
+            return factor
+        if isinstance(factor, ArrayCPDFactor):
+            index = [slice(None)] * len(factor.scope)
+            for vertex, axis in reductions:
+                index[axis] = self.valueindex[vertex][evidence[vertex]]
+            values = factor.values[tuple(index)]
+            values.flags.writeable = False
+            return type(factor).fromarray(self.scopes[i], values, self.bn)
+        return factor.reduced(dict((vertex, evidence[vertex])
+                                   for vertex, _ in reductions))
+
+    def run(self, evidence):
+        '''
+        Run the plan for *evidence*, a dict containing (vertex: value) pairs for the evidence vertices of the plan.
+
+        Returns:
+            A factor holding the normalized probability distribution over the query vertices, as returned by *condprobve* in :doc:`TableCPDFactorization <tablecpdfactorization>`.
+
+        '''
+        slots = [self.reduce(i, evidence) for i in range(len(self.factors))]
+        owned = [factor is not original
+                 for factor, original in zip(slots, self.factors)]
+
+        def combine(inputs, vertex, path):
+            factor = slots[inputs[0]]
+            if not owned[inputs[0]]:
+                factor = factor.copy()
+            return factor.sumproduct([slots[slot] for slot in inputs[1:]],
+                                     vertex, path)
+
+        for (inputs, vertex), (_, path) in zip(self.steps, self.paths):
+            slots.append(combine(inputs, vertex, path))
+            owned.append(True)
+        factor = combine(self.final, None, self.paths[-1][1])
+
+        return factor.normalize()
+
+    def runbatch(self, indices, query):
+        '''
+        Run the plan for many cases of evidence at once.
+
+        Arguments:
+            1. *indices* -- A dict of {vertex: array} pairs for the evidence vertices of the plan, where the array holds, for each case, the index of the value of the vertex in ``Vdata[vertex]["vals"]``. All arrays must have the same length.
+            2. *query* -- The query vertices of the plan, in the order used to lay out the result.
+
+        Returns:
+            A 2-D ndarray with one row per case, holding the normalized probability distribution over the query vertices, or zeros if the evidence of the case has probability zero, laid out as *vals* in :doc:`TableCPDFactor <tablecpdfactor>`: the first vertex of *query* varies fastest.
+
+        The cases are carried through the computation as an extra axis
+        of the factors that are reduced by the evidence, labelled
+        None, so that each step works on all the cases at once.
+
+        '''
+        cases = len(next(iter(indices.values()))) if indices else 1
+        slots = []
+        for factor, reductions in zip(self.factors, self.reductions):
+            # the entries themselves, also for factors in log space
+            values = np.asarray(factor.vals, dtype=float).reshape(
+                factor.card, order='F')
+            scope = factor.scope
+            if reductions:
+                axes = [axis for _, axis in reductions]
+                rest = [axis for axis in range(len(scope)) if axis not in axes]
+                values = values.transpose(axes + rest)[
+                    tuple(indices[vertex] for vertex, _ in reductions)]
+                scope = [None] + [scope[axis] for axis in rest]
+            slots.append((values, scope))
+
+        def combine(inputs, vertex, path):
+            operands = [slots[slot] for slot in inputs]
+            scope = []
+            for _, opscope in operands:
+                scope.extend(v for v in opscope
+                             if v != vertex and v not in scope)
+            if None in scope:
+                scope.remove(None)
+                scope.insert(0, None)
+            return contract(operands, scope, path), scope
+
+        for (inputs, vertex), (_, path) in zip(self.steps, self.paths):
+            slots.append(combine(inputs, vertex, path))
+        values, scope = combine(self.final, (), self.paths[-1][1])
+
+        output = list(reversed(query))
+        if None in scope:
+            values = contract([(values, scope)], [None] + output)
+            values = values.reshape(cases, -1)
+        else:
+            # no relevant evidence, all the cases have the same result
+            values = contract([(values, scope)], output).reshape(1, -1)
+            values = np.repeat(values, cases, axis=0)
+        # cases of impossible evidence stay all zero, as in *run*
+        sums = values.sum(axis=1, keepdims=True)
+        return np.divide(values, sums, out=np.zeros_like(values),
+                         where=sums > 0)
@@ -0,0 +1,236 @@
+# Copyright (c) 2012, CyberPoint International, LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the CyberPoint International, LLC nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL CYBERPOINT INTERNATIONAL, LLC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+This module provides exact inference in discrete Bayesian networks by recursive conditioning, whose memory can be set anywhere between linear in the size of the network and that of variable elimination. The CPDs are arranged in a decomposition tree (dtree), a binary tree whose leaves are the CPDs. Recursive conditioning sums over the values of the cutset of the root -- the vertices shared by its two subtrees -- and, for each, multiplies the results of recursing into the two subtrees, which have become independent. Without caches this needs only space linear in the size of the network; caching the result of each subtree by the values of its context avoids repeating it and brings the time down to that of variable elimination. For more information cf. Darwiche, "Recursive conditioning", Artificial Intelligence 126(1-2), 2001.
+
+'''
+try:
+    import numpy as np
+except ImportError:
+    raise ImportError("numpy is not installed on your system.")
+
+import heapq
+import itertools
+
+from .tablecpdfactorization import TableCPDFactorization
+from .arraycpdfactor import ArrayCPDFactor
+from . import eliminationorder
+
+class RecursiveConditioning(TableCPDFactorization):
+    '''Recursive conditioning on a discrete CPD Bayesian network.
+
+    This class can be used in place of
+    :doc:`TableCPDFactorization <tablecpdfactorization>`: *condprobve*
+    and *specificquery* take the same arguments. The memory they take
+    beyond the network is bounded by *cachesize*, the number of cached
+    results, which can be changed with *allocate*.
+
+    Usage example: this code would answer the same query with no
+    cache and with full caches::
+
+        from libpgm.nodedata import NodeData
+        from libpgm.discretebayesiannetwork import DiscreteBayesianNetwork
+        from libpgm.recursiveconditioning import RecursiveConditioning
+
+        nd = NodeData.load("../tests/unittestdict.txt")
+        bn = DiscreteBayesianNetwork(nd)
+        rc = RecursiveConditioning(bn, cachesize=0)
+        print rc.specificquery(dict(Grade=['A']), dict(Letter='weak')), rc.calls
+        rc.allocate(None)
+        print rc.specificquery(dict(Grade=['A']), dict(Letter='weak')), rc.calls
+
+    '''
+    factortype = ArrayCPDFactor
+
+    def __init__(self, bn, cachesize=None, heuristic=None):
+        '''
+        This class is constructed with a :doc:`DiscreteBayesianNetwork <discretebayesiannetwork>` instance as argument. The dtree follows the elimination order chosen by *heuristic* (see :doc:`eliminationorder`); *cachesize* is passed to *allocate*.
+
+        '''
+        TableCPDFactorization.__init__(self, bn, heuristic=heuristic)
+        factors = [factor if isinstance(factor, ArrayCPDFactor)
+                   else ArrayCPDFactor.fromfactor(factor)
+                   for factor in self.originalfactorlist]
+        self.card = dict((vertex, len(bn.Vdata[vertex]["vals"])) for vertex in bn.V)
+        '''A dict of {vertex: cardinality} pairs.'''
+
+        # the dtree as parallel lists indexed by node, leaves first
+        self.factors = factors + [None] * (len(factors) - 1)
+        '''A list holding the CPD of each leaf of the dtree, and None for each inner node.'''
+        self.children = [None] * len(self.factors)
+        '''A list holding the pair of children of each inner node, and None for each leaf.'''
+        self.vars = [set(factor.scope) for factor in factors]
+        '''A list holding the set of vertices of the CPDs below each node.'''
+
+        # compose the trees of each vertex in elimination order, the
+        # smallest two first, so that the cutsets stay small
+        order, _ = eliminationorder.eliminationorder(
+            [factor.scope for factor in factors], self.card, bn.V, self.heuristic)
+        trees = list(range(len(factors)))
+        count = [len(factors)]
+        def compose(nodes):
+            heap = [(len(self.vars[node]), node) for node in nodes]
+            heapq.heapify(heap)
+            while len(heap) > 1:
+                _, left = heapq.heappop(heap)
+                _, right = heapq.heappop(heap)
+                node = count[0]
+                count[0] += 1
+                self.children[node] = (left, right)
+                self.vars.append(self.vars[left] | self.vars[right])
+                heapq.heappush(heap, (len(self.vars[node]), node))
+            return heap[0][1]
+        for vertex in order:
+            bucket = [node for node in trees if vertex in self.vars[node]]
+            if len(bucket) > 1:
+                trees = [node for node in trees if vertex not in self.vars[node]]
+                trees.append(compose(bucket))
+        self.root = compose(trees) if trees else None
+        '''The root node of the dtree, or None if the network is empty.'''
+
+        self.cutset = [[] for _ in self.factors]
+        '''A list holding the cutset of each node: the vertices shared by its two children, except those of the cutsets of its ancestors.'''
+        self.context = [[] for _ in self.factors]
+        '''A list holding the context of each node: its vertices that belong to the cutsets of its ancestors, which determine its result.'''
+        stack = [(self.root, set())] if self.root is not None else []
+        while stack:
+            node, acutset = stack.pop()
+            self.context[node] = sorted(self.vars[node] & acutset, key=bn.V.index)
+            if self.children[node] is not None:
+                left, right = self.children[node]
+                self.cutset[node] = sorted(
+                    (self.vars[left] & self.vars[right]) - acutset, key=bn.V.index)
+                below = acutset | set(self.cutset[node])
+                stack.extend([(left, below), (right, below)])
+
+        self.cached = [False] * len(self.factors)
+        '''A list holding, for each node, whether its results are cached.'''
+        self.calls = 0
+        '''The number of recursive calls made by the last query.'''
+        self.allocate(cachesize)
+
+    def contextsize(self, node):
+        '''Return the number of results that a full cache of *node* holds, one for each instantiation of its context.'''
+        return eliminationorder.size(self.context[node], self.card)
+
+    def allocate(self, cachesize=None):
+        '''
+        Choose the nodes whose results are cached, so that all the caches together hold at most *cachesize* results.
+
+        If *cachesize* is None, every inner node is cached, and the time of a query is that of variable elimination. If it is zero, no node is cached, and the space of a query is linear in the size of the network. In between, nodes are given a full cache each in order of increasing cache size, so that a small budget goes to many nodes; ties go to the nodes deeper in the dtree, which are called more often.
+
+        '''
+        self.cachesize = cachesize
+        '''The largest number of cached results, or None for no limit.'''
+        inner = [node for node, children in enumerate(self.children)
+                 if children is not None]
+        depth = dict([(self.root, 0)]) if self.root is not None else {}
+        for node in reversed(range(len(self.children))):
+            if self.children[node] is not None and node in depth:
+                for child in self.children[node]:
+                    depth[child] = depth[node] + 1
+        self.cached = [False] * len(self.factors)
+        budget = cachesize
+        for node in sorted(inner, key=lambda node: (self.contextsize(node), -depth[node])):
+            size = self.contextsize(node)
+            if budget is not None:
+                if size > budget:
+                    break
+                budget -= size
+            self.cached[node] = True
+
+    def probability(self, evidence=None):
+        '''
+        Return the probability of *evidence*, a dict containing (vertex: value) pairs, by recursive conditioning over the dtree.
+
+        The caches and the instantiation are local to the call, so that one instance can serve queries from many threads at once. Sets *calls*.
+
+        '''
+        if evidence is None:
+            evidence = {}
+        if self.root is None:
+            return 1.
+        instantiation = {}
+        for vertex, value in evidence.items():
+            vals = self.bn.Vdata[vertex]["vals"]
+            assert value in vals, "Unknown value %r of %r." % (value, vertex)
+            instantiation[vertex] = vals.index(value)
+        caches = {}
+        calls = [0]
+
+        def rc(node):
+            calls[0] += 1
+            factor = self.factors[node]
+            if factor is not None:
+                index = tuple(instantiation.get(vertex, slice(None))
+                              for vertex in factor.scope)
+                return float(np.sum(factor.values[index]))
+            if self.cached[node]:
+                key = tuple(instantiation[vertex] for vertex in self.context[node])
+                cache = caches.setdefault(node, {})
+                if key in cache:
+                    return cache[key]
+            left, right = self.children[node]
+            cutset = [vertex for vertex in self.cutset[node]
+                      if vertex not in evidence]
+            result = 0.
+            for values in itertools.product(*[range(self.card[vertex])
+                                              for vertex in cutset]):
+                instantiation.update(zip(cutset, values))
+                p = rc(left)
+                if p:
+                    result += p * rc(right)
+            for vertex in cutset:
+                del instantiation[vertex]
+            if self.cached[node]:
+                cache[key] = result
+            return result
+
+        result = rc(self.root)
+        self.calls = calls[0]
+        return result
+
+    def condprobve(self, query, evidence=None):
+        '''
+        Return the probability distribution over the vertices of *query* given *evidence*, as :doc:`TableCPDFactorization <tablecpdfactorization>` does.
+
+        The probability of each instantiation of the query vertices together with the evidence is computed by *probability*, and the results are normalized. *calls* then counts the calls of all of these.
+
+        '''
+        if evidence is None:
+            evidence = {}
+        query = [vertex for vertex in query if vertex not in evidence]
+        assert query, "Query must contain an unobserved vertex."
+        factor = ArrayCPDFactor.fromarray(
+            query, np.zeros([self.card[vertex] for vertex in query]), self.bn)
+        calls = 0
+        case = dict(evidence)
+        for index in itertools.product(*[range(self.card[vertex]) for vertex in query]):
+            for vertex, i in zip(query, index):
+                case[vertex] = self.bn.Vdata[vertex]["vals"][i]
+            factor.values[index] = self.probability(case)
+            calls += self.calls
+        self.calls = calls
+        return factor.normalize()
@@ -0,0 +1,204 @@
+# Copyright (c) 2012, CyberPoint International, LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the CyberPoint International, LLC nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL CYBERPOINT INTERNATIONAL, LLC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''This module provides a factorized representation of a node that
+only stores the entries of its CPD table that are not zero.
+Deterministic and other zero-heavy CPDs are common in logical models,
+and a dense :doc:`TableCPDFactor <tablecpdfactor>` stores and
+multiplies every zero cell of them. The factor here keeps the nonzero
+entries in a dict indexed by the assignment of the scope, so that
+products and sums only visit entries that can contribute.
+:doc:`TableCPDFactorization <tablecpdfactorization>` chooses it
+automatically for CPDs below a density threshold.
+
+'''
+import itertools
+
+from .tablecpdfactor import TableCPDFactor, prod
+
+class SparseCPDFactor(TableCPDFactor):
+    """Factorized representation of a CPD table holding only its
+    nonzero entries.
+
+    The entries are held in *entries*, a dict of {key: value} pairs
+    where *key* is a tuple giving the index of the value of each
+    vertex in *scope*, in order. Missing keys stand for zero. *vals*
+    and *stride* present the same data as in :doc:`TableCPDFactor
+    <tablecpdfactor>`, as a dense table computed on access.
+
+    """
+    def __init__(self, vertex, bn):
+        '''Construct a factorized CPD table from a vertex in a discrete
+        Bayesian network, with the same arguments as :doc:`TableCPDFactor
+        <tablecpdfactor>`.'''
+        factor = self.fromfactor(TableCPDFactor(vertex, bn))
+        self.__dict__.update(factor.__dict__)
+
+    @classmethod
+    def fromfactor(cls, factor):
+        '''Return an instance of this class holding the same values as *factor*, which may be any factor class.'''
+        sparse = cls.__new__(cls)
+        sparse.inputvertex = factor.inputvertex
+        sparse.inputbn = factor.inputbn
+        sparse.scope = factor.scope[:]
+        sparse.card = factor.card[:]
+        if isinstance(factor, SparseCPDFactor):
+            sparse.entries = factor.entries.copy()
+        else:
+            sparse.vals = factor.vals
+        return sparse
+
+    def keys(self):
+        '''Return an iterator over the keys of all entries of the table, dense, in the order of *vals*.'''
+        return (key[::-1] for key in itertools.product(
+            *[range(t_card) for t_card in reversed(self.card)]))
+
+    @property
+    def vals(self):
+        '''A flat list of all the values of the table, zeros included, laid out as in :doc:`TableCPDFactor <tablecpdfactor>`. Assigning to it replaces *entries*.'''
+        return [self.entries.get(key, 0.) for key in self.keys()]
+
+    @vals.setter
+    def vals(self, vals):
+        self.entries = dict((key, val) for key, val in zip(self.keys(), vals)
+                            if val)
+
+    @property
+    def stride(self):
+        '''A dict of {vertex: value} pairs for each vertex in *scope*, giving the stride of that vertex in *vals*.'''
+        stride = {}
+        t_stride = 1
+        for t_scope, t_card in zip(self.scope, self.card):
+            stride[t_scope] = t_stride
+            t_stride *= t_card
+        return stride
+
+    @property
+    def density(self):
+        '''The fraction of the entries of the table that are stored.'''
+        return len(self.entries) / float(prod(self.card))
+
+    def combinefactor(self, other, operation):
+        '''Combine this factor with another factor.
+
+        The scope of the result is the scope of this factor followed
+        by the variables of *other* that it does not already contain.
+        Only pairs of stored entries that agree on the shared
+        variables are combined, by a join on those variables, so
+        *operation* must give zero whenever one of its arguments is
+        zero, like ``operator.mul`` used by *multiplyfactor*.
+
+        Arguments:
+            1. *other* -- An instance of any factor class. Dense factors are converted first, dropping their zeros.
+            2. *operation* -- A function of two values.
+
+        Attributes modified:
+            *entries*, *scope*, *card* -- Modified to reflect the data of the new product factor.
+
+        '''
+        if not isinstance(other, SparseCPDFactor):
+            other = SparseCPDFactor.fromfactor(other)
+
+        shared = [t_scope for t_scope in other.scope if t_scope in self.scope]
+        extra = [t_scope for t_scope in other.scope if t_scope not in self.scope]
+        selfaxes = [self.scope.index(t_scope) for t_scope in shared]
+        otheraxes = [other.scope.index(t_scope) for t_scope in shared]
+        extraaxes = [other.scope.index(t_scope) for t_scope in extra]
+
+        # index the entries of other by their values of the shared variables
+        index = {}
+        for key, val in other.entries.items():
+            index.setdefault(tuple(key[i] for i in otheraxes), []).append(
+                (tuple(key[i] for i in extraaxes), val))
+
+        entries = {}
+        for key, val in self.entries.items():
+            for extrakey, otherval in index.get(
+                    tuple(key[i] for i in selfaxes), ()):
+                entries[key + extrakey] = operation(val, otherval)
+
+        self.card = self.card + [other.card[i] for i in extraaxes]
+        self.scope = self.scope + extra
+        self.entries = entries
+
+    def reducefactor(self, vertex, value=None, maximize=False, minimize=False):
+        '''Sum out, maximize out, minimize out or reduce *vertex* as
+        *reducefactor* in :doc:`TableCPDFactor <tablecpdfactor>` does,
+        visiting only the stored entries. The values must not be
+        negative.'''
+        axis = self.scope.index(vertex)
+        entries = {}
+        if value is not None:
+            index = self.inputbn.Vdata[vertex]['vals'].index(value)
+            for key, val in self.entries.items():
+                if key[axis] == index:
+                    entries[key[:axis] + key[axis+1:]] = val
+        elif minimize:
+            # the minimum is zero unless no entry of the set is missing
+            counts = {}
+            for key, val in self.entries.items():
+                rest = key[:axis] + key[axis+1:]
+                entries[rest] = min(entries.get(rest, val), val)
+                counts[rest] = counts.get(rest, 0) + 1
+            entries = dict((rest, val) for rest, val in entries.items()
+                           if counts[rest] == self.card[axis] and val)
+        else:
+            for key, val in self.entries.items():
+                rest = key[:axis] + key[axis+1:]
+                if maximize:
+                    entries[rest] = max(entries.get(rest, val), val)
+                else:
+                    entries[rest] = entries.get(rest, 0) + val
+
+        self.scope = self.scope[:axis] + self.scope[axis+1:]
+        self.card = self.card[:axis] + self.card[axis+1:]
+        self.entries = entries
+        return self
+
+    sumout = reducefactor
+
+    def sumproduct(self, others, vertex, path=None):
+        '''Multiply this factor by each factor in *others*, in the order
+        of *path* if given, then sum out *vertex*. The sparse product
+        only holds the entries that are nonzero in every operand, so
+        it is built as it is rather than fused with the summation.'''
+        if path is not None and len(others) > 1:
+            return self.followpath(others, vertex, path)
+        for other in others:
+            self.multiplyfactor(other)
+        if vertex is None:
+            return self
+        return self.sumout(vertex)
+
+    def normalize(self):
+        '''Scale the values of the factor to sum to one, unless they are all zero.'''
+        norm = sum(self.entries.values())
+        if norm:
+            self.entries = dict((key, val / norm)
+                                for key, val in self.entries.items())
+        return self
+
+    def copy(self):
+        '''Return a copy of the factor.'''
+        return self.fromfactor(self)
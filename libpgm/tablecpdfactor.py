@@ -28,6 +28,8 @@ representations in :doc:`tablecpdfactorization`.
 
 '''
 
+import operator
+
 def prod(l):
     """ Calculate the product of the iterable l """
     r = 1
@@ -41,7 +43,16 @@ class TableCPDFactor:
     This class represents a factorized representation of a conditional
     probability distribution table.
 
+    The operations never modify the lists and dicts held in *vals*,
+    *scope*, *card* and *stride*: they replace them with new ones.
+    Factors may therefore share them, which keeps *copy* cheap and
+    lets :doc:`TableCPDFactorization <tablecpdfactorization>` work on
+    its original factors copy-on-write.
+
     """
+    entrysize = 32
+    '''The approximate number of bytes taken by one entry of *vals*: a pointer in the list and a float object.'''
+
     def __init__(self, vertex, bn):
         '''Construct a factorized CPD table from a vertex in a discrete
         Bayesian network.
@@ -84,7 +95,7 @@ class TableCPDFactor:
                     explore(_dict, ckey, depth+1, totaldepth)
                     
         if not parents:
-            self.vals = bn.Vdata[vertex]["cprob"]
+            self.vals = list(bn.Vdata[vertex]["cprob"])
             assert len(self.vals) == len(bn.Vdata[vertex]["vals"])
             assert abs(sum(self.vals) - 1) < 1e-8
         else: 
@@ -114,15 +125,30 @@ class TableCPDFactor:
         
 
     def multiplyfactor(self, other):  # cf. PGM 359 
-        '''Multiply this factor by another Factor
+        '''Multiply this factor by another Factor, see *combinefactor*.'''
+        self.combinefactor(other, operator.mul)
+
+    def addfactor(self, other):
+        '''Add another factor to this factor, see *combinefactor*.
+
+        For factors holding log-probabilities, this is the log of the
+        product of the probabilities.
+
+        '''
+        self.combinefactor(other, operator.add)
 
-        Multiplying factors means taking the union of the scopes, and
-        for each combination of variables in the scope, multiplying
-        together the probabilities from each factor that that
-        combination will be found.
+    def combinefactor(self, other, operation):
+        '''Combine this factor with another Factor
+
+        Combining factors means taking the union of the scopes, and
+        for each combination of variables in the scope, applying
+        *operation* to the values from each factor for that
+        combination. Multiplying factors combines the probabilities
+        with ``operator.mul``.
         
         Arguments:
-            1. *other* -- An instance of :doc:`TableCPDFactor <tablecpdfactor>` class representing the factor to multiply by.
+            1. *other* -- An instance of :doc:`TableCPDFactor <tablecpdfactor>` class representing the factor to combine with.
+            2. *operation* -- A function of two values, such as ``operator.mul``.
                  
         Attributes modified: 
             *vals*, *scope*, *stride*, *t_card* -- Modified to reflect the data of the new product factor.
@@ -132,8 +158,8 @@ class TableCPDFactor:
         '''
 
         # merge t_scopes
-        scope = self.scope
-        card = self.card
+        scope = self.scope[:]
+        card = self.card[:]
         for t_scope, t_card in zip(other.scope, other.card):
             try:
                 scope.index(t_scope)
@@ -142,27 +168,31 @@ class TableCPDFactor:
                 card.append(t_card)
     
         # algorithm (see book)
+        # (the values and strides are read once, as other factor
+        # classes may compute them on access)
+        selfvals, selfstride = self.vals, self.stride
+        othervals, otherstride = other.vals, other.stride
         assignment = {}
         vals = []
         j = 0
         k = 0
         for _ in range(prod(card)):
             vals.append(
-                self.vals[j] * other.vals[k])
+                operation(selfvals[j], othervals[k]))
             
             for t_card, t_scope in zip(card, scope):
                 assignment[t_scope] = assignment.get(t_scope, 0) + 1
                 if (assignment[t_scope] == t_card):
                     assignment[t_scope] = 0
-                    if t_scope in self.stride:
-                        j = j - (t_card - 1) * self.stride[t_scope]
-                    if t_scope in other.stride:
-                        k = k - (t_card - 1) * other.stride[t_scope]
+                    if t_scope in selfstride:
+                        j = j - (t_card - 1) * selfstride[t_scope]
+                    if t_scope in otherstride:
+                        k = k - (t_card - 1) * otherstride[t_scope]
                 else:
-                    if t_scope in self.stride:
-                        j = j + self.stride[t_scope]
-                    if t_scope in other.stride:
-                        k = k + other.stride[t_scope]
+                    if t_scope in selfstride:
+                        j = j + selfstride[t_scope]
+                    if t_scope in otherstride:
+                        k = k + otherstride[t_scope]
                     break
             
         # add strides
@@ -177,7 +207,7 @@ class TableCPDFactor:
         self.card = card
         self.stride = stride
 
-    def reducefactor(self, vertex, value=None):
+    def reducefactor(self, vertex, value=None, maximize=False, minimize=False):
         '''Sum out the variable specified by *vertex* from the factor.
 
         Summing out means summing all sets of entries together where
@@ -186,6 +216,9 @@ class TableCPDFactor:
         
         Arguments:
             1. *vertex* -- The name of the variable to be summed out.
+            2. *value* -- (Optional) The observed value of *vertex*. If given, only the entries where *vertex* takes that value are kept.
+            3. *maximize* -- (Optional) If true, take the maximum of each set of entries instead of their sum, see *maxout*.
+            4. *minimize* -- (Optional) If true, take the minimum of each set of entries instead of their sum, see *minout*.
         
         Attributes modified: 
             *vals*, *scope*, *stride*, *card* -- Modified to reflect the data of the summed-out product factor.
@@ -203,7 +236,13 @@ class TableCPDFactor:
         k = 0
         lcardproduct = prod(self.card[:vscope])
         for i, entry in enumerate(result):
-            if value is None:
+            if maximize:
+                result[i] = max(self.vals[k + vstride * h]
+                                for h in range(vcard))
+            elif minimize:
+                result[i] = min(self.vals[k + vstride * h]
+                                for h in range(vcard))
+            elif value is None:
                 for h in range(vcard):
                     result[i] += self.vals[k + vstride * h]
             else:
@@ -216,18 +255,187 @@ class TableCPDFactor:
         self.vals = result
         
         # modify scope, card, and stride in new factor
-        self.scope.remove(vertex)
-        del(self.card[vscope])
+        self.scope = self.scope[:vscope] + self.scope[vscope+1:]
+        self.card = self.card[:vscope] + self.card[vscope+1:]
+        stride = self.stride.copy()
         for i in range(vscope, len(self.stride)-1):
-            self.stride[self.scope[i]] //= vcard
-        del(self.stride[vertex])
+            stride[self.scope[i]] //= vcard
+        del(stride[vertex])
+        self.stride = stride
         return self
         
     sumout = reducefactor
 
+    def sumproduct(self, others, vertex, path=None):
+        '''Multiply this factor by each factor in *others* and sum out
+        *vertex*, in a single pass.
+
+        The result is the same as that of calling *multiplyfactor*
+        for each factor in *others* and then *sumout*, but the
+        product over the full scope is never built: each entry of the
+        result is summed directly from the entries of the operands.
+        The peak memory is thus the size of the result rather than
+        of the product, which is larger by the cardinality of
+        *vertex*.
+
+        Arguments:
+            1. *others* -- A list of factors to multiply with.
+            2. *vertex* -- The name of the variable to be summed out. It must be in the scope of at least one of the factors. If None, the factors are only multiplied.
+            3. *path* -- (Optional) The order in which to multiply the factors pairwise, as returned by *contractionpath* in :doc:`eliminationorder`, where this factor is the first of the list. *vertex* is summed out by the first contraction after which no remaining factor mentions it.
+
+        Attributes modified:
+            *vals*, *scope*, *stride*, *card* -- Modified to reflect the data of the summed-out product factor.
+
+        '''
+        if path is not None and len(others) > 1:
+            return self.followpath(others, vertex, path)
+        if vertex is None and not others:
+            return self
+        factors = [self] + list(others)
+        scope = []
+        card = []
+        vcard = None
+        for factor in factors:
+            for t_scope, t_card in zip(factor.scope, factor.card):
+                if t_scope == vertex:
+                    vcard = t_card
+                elif t_scope not in scope:
+                    scope.append(t_scope)
+                    card.append(t_card)
+        if vertex is None:
+            vcard = 1
+        assert vcard is not None, "Vertex %r not in scope." % (vertex,)
+
+        # the values and strides are read once, as for combinefactor
+        tables = []
+        for factor in factors:
+            stride = factor.stride
+            tables.append((factor.vals, stride,
+                           [h * stride.get(vertex, 0) for h in range(vcard)]))
+        index = [0] * len(tables)
+        assignment = [0] * len(scope)
+        vals = []
+        for _ in range(prod(card)):
+            column = None
+            for (t_vals, _, offsets), j in zip(tables, index):
+                entries = [t_vals[j + offset] for offset in offsets]
+                column = (entries if column is None
+                          else list(map(operator.mul, column, entries)))
+            vals.append(sum(column))
+
+            for i, (t_card, t_scope) in enumerate(zip(card, scope)):
+                assignment[i] += 1
+                if assignment[i] == t_card:
+                    assignment[i] = 0
+                    step = -(t_card - 1)
+                else:
+                    step = 1
+                for f, (_, stride, _) in enumerate(tables):
+                    if t_scope in stride:
+                        index[f] += step * stride[t_scope]
+                if step == 1:
+                    break
+
+        t_stride = 1
+        stride = {}
+        for t_card, t_scope in zip(card, scope):
+            stride[t_scope] = t_stride
+            t_stride *= t_card
+
+        self.vals = vals
+        self.scope = scope
+        self.card = card
+        self.stride = stride
+        return self
+
+    def followpath(self, others, vertex, path):
+        '''Carry out *sumproduct* pairwise, in the order given by *path*.'''
+        operands = [self] + list(others)
+        owned = [True] + [False] * len(others)
+        for i, j in path:
+            first, second = operands[i], operands[j]
+            if not owned[i]:
+                first = first.copy()
+            del operands[j], owned[j]
+            del operands[i], owned[i]
+            if vertex is not None and not any(vertex in operand.scope
+                                              for operand in operands):
+                first.sumproduct([second], vertex)
+                vertex = None
+            else:
+                first.multiplyfactor(second)
+            operands.append(first)
+            owned.append(True)
+        assert len(operands) == 1, "Path does not contract all factors."
+        result = operands[0]
+        if type(result) is not type(self):
+            # e.g. a sparse factor contracted last into a dense one
+            result = type(self).fromfactor(result)
+        self.__dict__.update(result.__dict__)
+        return self
+
+    def normalize(self):
+        '''Scale the values of the factor to sum to one, unless they are all zero.'''
+        norm = sum(self.vals)
+        if norm:
+            self.vals = [val / norm for val in self.vals]
+        return self
+
+    def maxout(self, vertex):
+        '''Maximize the variable specified by *vertex* out of the factor.
+
+        This is the max-product counterpart of *sumout*: each set of
+        entries where *vertex* is the only variable changing is
+        replaced by its maximum. It works on probabilities as well as
+        on log-probabilities. For more information see Koller et al.
+        13.2.
+
+        '''
+        return self.reducefactor(vertex, maximize=True)
+
+    def minout(self, vertex):
+        '''Minimize the variable specified by *vertex* out of the factor,
+        replacing each set of entries where *vertex* is the only
+        variable changing by its minimum, as *maxout* does with the
+        maximum.'''
+        return self.reducefactor(vertex, minimize=True)
+
+    def reduced(self, evidence):
+        '''Return this factor reduced by *evidence*, leaving it unchanged.
+
+        Arguments:
+            1. *evidence* -- A dict of {vertex: value} pairs. Vertices outside *scope* are ignored.
+
+        The result shares no mutable state with this factor that any
+        of its operations would modify, so it is never necessary to
+        copy the factor first.
+
+        '''
+        factor = type(self).__new__(type(self))
+        factor.__dict__.update(self.__dict__)
+        for vertex in self.scope:
+            if vertex in evidence:
+                factor.reducefactor(vertex, evidence[vertex])
+        return factor
+
+    @classmethod
+    def fromfactor(cls, factor):
+        '''Return an instance of this class holding the same values as
+        *factor*, which may be any factor class.'''
+        copy = cls.__new__(cls)
+        copy.inputvertex = factor.inputvertex
+        copy.inputbn = factor.inputbn
+        copy.vals = list(factor.vals)
+        copy.stride = dict(factor.stride)
+        copy.scope = factor.scope[:]
+        copy.card = factor.card[:]
+        return copy
+
     def copy(self):
         '''Return a copy of the factor.'''
-        copy = type(self)(self.inputvertex, self.inputbn)
+        copy = type(self).__new__(type(self))
+        copy.inputvertex = self.inputvertex
+        copy.inputbn = self.inputbn
         copy.vals = self.vals[:]
         copy.stride = self.stride.copy()
         copy.scope = self.scope[:]
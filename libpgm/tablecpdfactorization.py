@@ -28,31 +28,422 @@ This module provides tools for creating and using factorized representations of
 '''
 
 from .oldtablecpdfactorization import TableCPDFactorization as old
+from . import eliminationorder
+from .queryplan import QueryPlan
+from .tablecpdfactor import TableCPDFactor
+from .arraycpdfactor import ArrayCPDFactor
+from .logcpdfactor import LogCPDFactor
+from .sparsecpdfactor import SparseCPDFactor
+from .utils.libpgmexceptions import memorybudgetError
+
+from collections import OrderedDict
+import heapq
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    raise ImportError("numpy is not installed on your system.")
 
 class TableCPDFactorization (old):
     '''Factorized discrete CPD Bayesian Network.
 
     This class represents a factorized Bayesian network with discrete
     CPD tables. 
+
+    As long as *plancachesize* is not zero, *condprobve*,
+    *condprobvebatch* and *specificquery* keep the state of each
+    query local and only read the original factors, so one instance
+    can serve queries from many threads at once. The plan cache is
+    shared between the threads and guarded by a lock. *order*,
+    *maxfactorsize* and *factorlist* then describe the most recent
+    query of any thread.
     '''
+    heuristic = 'minfill'
+    '''The elimination order heuristic, see *eliminationorder*.'''
+
+    order = None
+    '''The elimination order chosen by the last call of *sumproductve*.'''
+
+    maxfactorsize = None
+    '''The predicted number of entries of the largest factor created by the last call of *sumproductve*.'''
+
+    contraction = 'greedy'
+    '''The heuristic choosing the order in which the factors of one elimination step are multiplied pairwise, see *contractionpath*. If None, the factors of each step are contracted in a single pass.'''
+
+    paths = None
+    '''A list of (vertex, path) pairs holding the contraction path of each step of the last call of *sumproductve*, see *contractionpath*. The path of the final product of the remaining factors is listed under vertex None.'''
+
+    prune = True
+    '''If true, query plans leave out the factors of barren vertices and evidence d-separated from the query, see :doc:`queryplan`.'''
+
+    plancachesize = 128
+    '''The number of query plans kept in the plan cache, see *queryplan*. If zero, *condprobve* runs without plans.'''
+
+    sparsethreshold = 0.5
+    '''CPDs with a smaller fraction of nonzero entries are represented by :doc:`SparseCPDFactor <sparsecpdfactor>`, see *makefactor*. If None, all factors are dense.'''
+
+    resultcachesize = 0
+    '''The number of query results kept in the result cache, see *cachedrun*. If zero, results are not cached.'''
+
+    resultttl = None
+    '''The number of seconds a cached result stays valid, or None to keep results until they are evicted or invalidated.'''
+
+    memorybudget = None
+    '''The largest number of bytes a single factor may take during exact inference, see *checkbudget*. If None, there is no limit.'''
+
+    fallback = None
+    '''A function called as ``fallback(factorization, query, evidence)`` to answer a *condprobve* query that would exceed *memorybudget*, returning a factor as *condprobve* does, e.g. ``TableCPDFactorization.condprobgibbs``. If None, such queries raise :class:`memorybudgetError`.'''
+
+    fallbacksamples = 1000
+    '''The number of samples drawn by *condprobgibbs*.'''
+
+    def __init__(self, bn, factortype=None, heuristic=None):
+        '''Construct the factorization of *bn*.
+
+        If *factortype* is given, it is used instead of
+        :doc:`TableCPDFactor <tablecpdfactor>` to represent the
+        factors, e.g. :doc:`ArrayCPDFactor <arraycpdfactor>` for
+        numpy-backed factors on large CPD tables.
+
+        If *heuristic* is given, it replaces the default elimination
+        order heuristic, see *eliminationorder*.
+
+        '''
+        if factortype is not None:
+            self.factortype = factortype
+        if heuristic is not None:
+            self.heuristic = heuristic
+        old.__init__(self, bn)
+        self.plans = OrderedDict()
+        '''The plan cache, an ordered dict of {(query, evidence): QueryPlan} pairs, least recently used first.'''
+        self.planhits = 0
+        '''The number of queries answered by a cached plan.'''
+        self.planmisses = 0
+        '''The number of queries for which a plan had to be built.'''
+        self.results = OrderedDict()
+        '''The result cache, an ordered dict of {key: (time, vertices, factor)} pairs, least recently used first, see *cachedrun*.'''
+        self.resulthits = 0
+        '''The number of queries answered from the result cache.'''
+        self.resultmisses = 0
+        '''The number of queries that had to be computed while the result cache was enabled.'''
+        self.planlock = threading.Lock()
+        '''The lock guarding the plan and result caches and their counters.'''
+        self.generation = 0
+        '''The number of calls of *invalidate* so far, see *cachedrun*.'''
+
+    def makefactor(self, vertex):
+        '''Return the factor of *vertex* in *bn*.
+
+        This is an instance of *factortype*, unless the CPD has fewer
+        nonzero entries than *sparsethreshold* and a
+        :doc:`SparseCPDFactor <sparsecpdfactor>` can stand in for
+        *factortype*, i.e. *factortype* is :doc:`TableCPDFactor
+        <tablecpdfactor>`. Factor classes with their own storage, such
+        as :doc:`ArrayCPDFactor <arraycpdfactor>`, are kept as they
+        are.
+
+        '''
+        factor = old.makefactor(self, vertex)
+        if (self.sparsethreshold is not None and
+                issubclass(SparseCPDFactor, type(factor))):
+            vals = factor.vals
+            nonzero = sum(1 for val in vals if val)
+            if nonzero < self.sparsethreshold * len(vals):
+                return SparseCPDFactor.fromfactor(factor)
+        return factor
+
+    def queryplan(self,
+                  query: "A collection of query vertices.",
+                  evidence: "A collection of evidence vertices."
+    ) -> "a QueryPlan":
+        """Return the plan for a query shape, building it if needed.
+
+        Plans are cached by the sets of query and evidence vertices,
+        so that queries that only differ in the evidence values share
+        one plan. The cache keeps the *plancachesize* most recently
+        used plans. See :doc:`queryplan`.
+
+        Plans are built outside the lock, so that threads missing the
+        cache do not wait for each other. If two threads build the same
+        plan at once, both get the plan cached first.
+
+        """
+        key = (frozenset(query), frozenset(evidence))
+        with self.planlock:
+            plan = self.plans.pop(key, None)
+            if plan is None:
+                self.planmisses += 1
+            else:
+                self.planhits += 1
+                self.cacheplan(key, plan)
+                return plan
+
+        plan = QueryPlan(self, key[0], key[1])
+        with self.planlock:
+            return self.cacheplan(key, self.plans.pop(key, plan))
+
+    def cacheplan(self, key, plan):
+        '''Store *plan* under *key* as the most recently used plan, evicting the least recently used plans beyond *plancachesize*. The caller must hold *planlock*.'''
+        self.plans[key] = plan
+        while len(self.plans) > self.plancachesize:
+            self.plans.popitem(last=False)
+        return plan
+
+    def clearplans(self):
+        '''Empty the plan cache, e.g. after changing *heuristic*.'''
+        with self.planlock:
+            self.plans.clear()
+
+    def cachedrun(self,
+                  plan: "A QueryPlan, as returned by queryplan.",
+                  evidence: "A dict of {vertex: value} pairs."
+    ) -> "the resulting TableCPDFactor":
+        """Run *plan* for *evidence*, reusing a cached result if possible.
+
+        Results are cached by the query vertices and the values of
+        the evidence vertices that the plan depends on. Evidence that
+        the plan ignores, because it is d-separated from the query
+        (see *prune*), and the order of the evidence do not matter, so
+        all requests with the same answer share one entry. The cache
+        keeps the *resultcachesize* most recently used results, each
+        for at most *resultttl* seconds. Call *invalidate* after
+        changing a CPD in *bn*.
+
+        Every call returns a new copy of the result, which the caller
+        may modify.
+
+        The plan runs outside the lock. If *invalidate* is called
+        meanwhile, the result may come from the old CPDs, so it is
+        returned but not cached.
+
+        """
+        key = (plan.query, frozenset((vertex, evidence[vertex])
+                                     for vertex in plan.evidence))
+        now = time.monotonic()
+        with self.planlock:
+            entry = self.results.pop(key, None)
+            if entry is not None and (self.resultttl is None or
+                                      now - entry[0] <= self.resultttl):
+                self.resulthits += 1
+                self.results[key] = entry
+                return entry[2].copy()
+            self.resultmisses += 1
+            generation = self.generation
+
+        factor = plan.run(evidence)
+        with self.planlock:
+            if self.generation == generation:
+                self.results[key] = (now, plan.vertices, factor.copy())
+                while len(self.results) > self.resultcachesize:
+                    self.results.popitem(last=False)
+        return factor
+
+    def invalidate(self,
+                   vertices: "The vertices whose CPDs have changed, all if None." = None):
+        """Update the factorization after CPDs in *bn* have changed.
+
+        The original factors of *vertices* are rebuilt from
+        ``bn.Vdata``, *factorlist* is refreshed, and the cached plans
+        and results that involve any of these CPDs are dropped. The
+        structure of the network must not have changed.
+
+        """
+        if vertices is None:
+            vertices = self.bn.V
+        vertices = set(vertices)
+        self.originalfactorlist = [
+            self.makefactor(factor.inputvertex)
+            if factor.inputvertex in vertices
+            else factor
+            for factor in self.originalfactorlist]
+        self.refresh()
+        with self.planlock:
+            self.generation += 1
+            for key, plan in list(self.plans.items()):
+                if plan.vertices & vertices:
+                    del self.plans[key]
+            for key, (_, planvertices, _) in list(self.results.items()):
+                if planvertices & vertices:
+                    del self.results[key]
+
+    def eliminationorder(self,
+                         vertices: "A sequence of vertices to be eliminated.",
+                         heuristic: "Overrides self.heuristic if given." = None
+    ) -> "a tuple (order, maxfactorsize)":
+        '''Plan the elimination of *vertices* from *factorlist*
+
+        The order is chosen greedily on the interaction graph of the
+        factors in *factorlist*, using *heuristic*: the name of one of
+        ``'mindegree'``, ``'minfill'`` and ``'weightedminfill'``, a
+        cost function, or an explicit sequence of vertices. See
+        :doc:`eliminationorder` for details.
+
+        '''
+        if heuristic is None:
+            heuristic = self.heuristic
+        card = dict((vertex, len(self.bn.Vdata[vertex]["vals"]))
+                    for factor in self.factorlist
+                    for vertex in factor.scope)
+        return eliminationorder.eliminationorder(
+            [factor.scope for factor in self.factorlist],
+            card, vertices, heuristic)
+
+    def estimatecost(self,
+                     query: "A collection of query vertices.",
+                     evidence: "A collection of evidence vertices." = ()
+    ) -> "a dict describing the predicted cost":
+        '''Predict the cost of a query without running it.
+
+        The estimate is read off the plan of the query (see
+        :doc:`queryplan`), which is built, or taken from the plan
+        cache, without touching any factor values. It only depends on
+        the query and evidence vertices, so *evidence* may also be a
+        dict of evidence as passed to *condprobve*.
+
+        Returns:
+            A dict with the keys
+
+            * ``order`` -- the elimination order,
+            * ``width`` -- the treewidth induced by the order, the number of vertices of the largest factor less one,
+            * ``maxfactorsize`` -- the number of entries of the largest factor,
+            * ``flops`` -- the number of multiplications and additions,
+            * ``memory`` -- the approximate number of bytes of the largest factor, ``maxfactorsize`` times the *entrysize* of *factortype*.
+
+        '''
+        if self.plancachesize:
+            plan = self.queryplan(query, evidence)
+        else:
+            plan = QueryPlan(self, query, evidence)
+        return dict(order=plan.order, width=plan.width,
+                    maxfactorsize=plan.maxfactorsize, flops=plan.flops,
+                    memory=plan.maxfactorsize * self.factortype.entrysize)
+
+    def checkbudget(self,
+                    maxfactorsize: "The predicted number of entries of the largest factor."):
+        '''Raise :class:`memorybudgetError` if a factor of *maxfactorsize* entries of *factortype* would take more than *memorybudget* bytes.'''
+        if self.memorybudget is None:
+            return
+        memory = maxfactorsize * self.factortype.entrysize
+        if memory > self.memorybudget:
+            raise memorybudgetError(
+                "Exact inference needs a factor of %d entries (about %d "
+                "bytes), over the memory budget of %d bytes."
+                % (maxfactorsize, memory, self.memorybudget))
+
+    def condprobgibbs(self, query, evidence=None):
+        '''Estimate the distribution over the vertices of *query* given *evidence* from *fallbacksamples* samples of *gibbssample*.
+
+        The arguments and the result are those of *condprobve*, so
+        that this method can serve as *fallback*. The memory needed
+        grows with the Markov blankets of the vertices rather than
+        with the treewidth of the network. Like *gibbssample*, it
+        only reads the original factors, so it keeps *condprobve*
+        safe to call from many threads as a fallback.
+
+        '''
+        if evidence is None:
+            evidence = {}
+        query = [vertex for vertex in self.bn.V if vertex in query]
+        card = [len(self.bn.Vdata[vertex]["vals"]) for vertex in query]
+        index = [dict((value, i) for i, value
+                      in enumerate(self.bn.Vdata[vertex]["vals"]))
+                 for vertex in query]
+        counts = np.zeros(card, order='F')
+        for sample in self.gibbssample(evidence, self.fallbacksamples):
+            counts[tuple(index[i][sample[vertex]]
+                         for i, vertex in enumerate(query))] += 1
+
+        factor = ArrayCPDFactor.fromarray(
+            query, counts / counts.sum(), self.bn)
+        if issubclass(self.factortype, ArrayCPDFactor):
+            factor = self.factortype.fromfactor(factor)
+        else:
+            table = TableCPDFactor.__new__(TableCPDFactor)
+            table.inputvertex = None
+            table.inputbn = self.bn
+            table.scope = factor.scope
+            table.card = factor.card
+            table.stride = factor.stride
+            table.vals = factor.vals.tolist()
+            factor = table
+        return factor
+
+    def contractionpath(self,
+                        scopes: "A list of the scopes of the factors to be multiplied together.",
+                        vertex: "The vertex to sum out of the product, if any." = None
+    ) -> "a path as returned by eliminationorder.contractionpath, or None":
+        '''Choose the order in which factors over *scopes* are multiplied pairwise.
+
+        Returns the path found by *contractionpath* in
+        :doc:`eliminationorder` with the heuristic *contraction*, or
+        None if contracting all factors in a single pass takes no
+        more multiplications by *contractioncost*, or if
+        *contraction* is None.
+
+        '''
+        if self.contraction is None or len(scopes) < 3:
+            return None
+        card = dict((t_scope, len(self.bn.Vdata[t_scope]["vals"]))
+                    for scope in scopes for t_scope in scope)
+        eliminate = [] if vertex is None else [vertex]
+        path, _ = eliminationorder.contractionpath(
+            scopes, card, eliminate, self.contraction)
+        if (eliminationorder.contractioncost(scopes, card, path, eliminate)
+                >= eliminationorder.contractioncost(scopes, card, None)):
+            return None
+        return path
+
+    def sumproducteliminatevar(self, vertex):
+        '''Marginalize over all values of *vertex*, as in the base class.
+
+        The factors mentioning *vertex* are contracted pairwise in the
+        order chosen by *contractionpath*, and *vertex* is summed out
+        as soon as no remaining factor mentions it. The path is
+        appended to *paths*.
+
+        '''
+        factors = [factor for factor in self.factorlist
+                   if vertex in factor.scope]
+        rest = [factor for factor in self.factorlist
+                if vertex not in factor.scope]
+        path = self.contractionpath(
+            [factor.scope for factor in factors], vertex)
+        if self.paths is not None:
+            self.paths.append((vertex, path))
+        factor = factors[0].copy()
+        factor.sumproduct(factors[1:], vertex, path)
+        self.factorlist = rest + [factor]
+
     def sumproductve(self,
                      vertices: "A sequence of UUIDs of vertices to be eliminated."
     ) -> "the resulting single TableCPDFactor":
         '''Eliminate each vertex in *vertices* from *factorlist*
 
         Using *sumproducteliminatevar*, remove all vertices in the
-        sequence from self.factorlist
+        sequence from self.factorlist, in the order chosen by
+        *eliminationorder*. The order and its predicted largest
+        factor size are kept in *order* and *maxfactorsize*, the
+        contraction paths of the steps in *paths*. Raises
+        :class:`memorybudgetError` before eliminating anything if the
+        largest factor would exceed *memorybudget*.
 
         '''
-    
+        self.order, self.maxfactorsize = self.eliminationorder(vertices)
+        self.checkbudget(self.maxfactorsize)
+        self.paths = []
+
         # eliminate one by one
-        for vertex in vertices:
+        for vertex in self.order:
             self.sumproducteliminatevar(vertex)
         
         # multiply together if many factors remain 
+        path = self.contractionpath(
+            [factor.scope for factor in self.factorlist])
+        self.paths.append((None, path))
         result = self.factorlist[0].copy()
-        for i in range(1, len(self.factorlist)):
-            result.multiplyfactor(self.factorlist[i])
+        result.sumproduct(self.factorlist[1:], None, path)
         
         return result
 
@@ -66,23 +457,26 @@ class TableCPDFactorization (old):
         Adjust all distributions in self.factorlist for the evidence
         given, and return the resulting new factorlist.
 
+        The factors in self.factorlist are not modified: each factor
+        that mentions an evidence vertex is replaced by the result of
+        its *reduced* method, which for an :doc:`ArrayCPDFactor
+        <arraycpdfactor>` is a read-only view of the original values.
+        Many queries can thus condition the same factors at once.
+
         """
 
         if reset_before:
-            self.reset()
+            self.refresh()
 
-        factorlist = self.factorlist[:]
-        
         # modify factors to account for the evidence
-        for vertex, value in evidence.items():
-            factorlist = [
-                factor.reducefactor(vertex, value)
-                if (factor.scope.count(vertex) > 0)
-                else factor
-                for factor in factorlist]
-            # Eliminate skope-free vertices
-            factorlist = [factor for factor in factorlist
-                          if factor.scope]
+        factorlist = [
+            factor.reduced(evidence)
+            if any(vertex in evidence for vertex in factor.scope)
+            else factor
+            for factor in self.factorlist]
+        # Eliminate skope-free vertices
+        factorlist = [factor for factor in factorlist
+                      if factor.scope]
 
         if in_place:
             self.factorlist = factorlist
@@ -105,6 +499,17 @@ class TableCPDFactorization (old):
             1. *factorlist* -- Modified to be one factor representing the probability distribution of the query variables given the evidence.
                            
         The function returns *factorlist* after it has been modified as above.
+
+        If *plancachesize* is not zero, the query runs a plan from
+        *queryplan* on the original factors instead of working on the
+        current *factorlist*, so that no *refresh* is needed between
+        queries. If *resultcachesize* is not zero as well, the result
+        may come from the result cache, see *cachedrun*.
+
+        If the largest factor of the query would take more than
+        *memorybudget* bytes, the query is answered by *fallback*
+        instead, or raises :class:`memorybudgetError` if there is no
+        fallback. Use *estimatecost* to check a query beforehand.
         
         Usage example: this code would return the distribution over a queried node, given evidence::
 
@@ -144,6 +549,27 @@ class TableCPDFactorization (old):
             print json.dumps(result.stride, indent=2)
 
         '''
+        try:
+            return self.exactcondprobve(query, evidence)
+        except memorybudgetError:
+            if self.fallback is None:
+                raise
+            return self.fallback(self, query, evidence)
+
+    def exactcondprobve(self, query, evidence):
+        '''The exact inference of *condprobve*, without *fallback*.'''
+        if self.plancachesize:
+            plan = self.queryplan(query, evidence)
+            self.checkbudget(plan.maxfactorsize)
+            if self.resultcachesize:
+                factor = self.cachedrun(plan, evidence)
+            else:
+                factor = plan.run(evidence)
+            self.order = plan.order
+            self.maxfactorsize = plan.maxfactorsize
+            self.paths = plan.paths
+            self.factorlist = [factor]
+            return factor
 
         self.condition(evidence, in_place=True)
                    
@@ -155,13 +581,68 @@ class TableCPDFactorization (old):
         factor = self.sumproductve(eliminate)
         
         # normalize result
-        norm = sum(factor.vals)
-        for x, val in enumerate(factor.vals):
-            factor.vals[x] /= norm
-            
+        factor.normalize()
+
         # return table
         return factor
     
+    def condprobvebatch(self,
+                        query: "A list of query vertices.",
+                        evidence: "A dict of {vertex: column of values} pairs.",
+                        batchsize: "The number of cases evaluated at once." = 10000
+    ) -> "an ndarray with one row per case":
+        '''Calculate the conditional probabilities for *query* in many cases.
+
+        This is *condprobve* for a table of evidence: all cases
+        observe the same vertices, but with different values. The
+        cases are evaluated together, with an extra axis carried
+        through the factor operations of the query plan (see
+        *runbatch* in :doc:`queryplan`).
+
+        Arguments:
+            1. *query* -- A list of the query vertices.
+            2. *evidence* -- A dict of {vertex: column} pairs, where each column is a sequence holding the value of the vertex in each case. All columns must have the same length.
+            3. *batchsize* -- The number of cases evaluated at once, which bounds the memory used. The factors of a batch hold one entry per case, so *memorybudget* is checked for *batchsize* times the largest factor of the plan; there is no *fallback*.
+
+        Returns:
+            A 2-D ndarray with one row per case, holding the distribution over the query vertices. The columns are laid out as *vals* of the factor returned by *condprobve*, with the first vertex of *query* varying fastest; for a single query vertex they follow the order of its values in ``Vdata[vertex]["vals"]``.
+
+        Usage example: this code would return P(Intelligence | Grade, SAT) for three cases::
+
+            fn = TableCPDFactorization(bn)
+            result = fn.condprobvebatch(
+                ["Intelligence"],
+                dict(Grade=["A", "C", "C"],
+                     SAT=["highscore", "highscore", "lowscore"]))
+
+        '''
+        query = list(query)
+        plan = self.queryplan(query, evidence)
+        cases = len(next(iter(evidence.values()))) if evidence else 1
+        self.checkbudget(plan.maxfactorsize * min(cases, batchsize))
+
+        # map values to indices, one dictionary lookup per distinct value
+        indices = {}
+        for vertex in plan.evidence:
+            column = np.asarray(evidence[vertex])
+            assert len(column) == cases, "Evidence columns must have the same length."
+            distinct, inverse = np.unique(column, return_inverse=True)
+            index = plan.valueindex[vertex]
+            indices[vertex] = np.array(
+                [index[value] for value in distinct.tolist()],
+                dtype=np.intp)[inverse.ravel()]
+
+        size = 1
+        for vertex in query:
+            size *= len(self.bn.Vdata[vertex]["vals"])
+        result = np.empty((cases, size))
+        for start in range(0, cases, batchsize):
+            stop = min(start + batchsize, cases)
+            result[start:stop] = plan.runbatch(
+                dict((vertex, index[start:stop])
+                     for vertex, index in indices.items()), query)
+        return result
+
     def specificquery(self, query, evidence=None):
         '''
         Eliminate all variables except for the ones specified by *query*. Adjust all distributions to reflect *evidence*. Return the entry that matches the exact probability of a specific event, as specified by *query*.
@@ -217,6 +698,8 @@ class TableCPDFactorization (old):
             print result
 
         '''
+        if evidence is None:
+            evidence = {}
         condprob = self.condprobve(query, evidence)
 
         # now self.factorlist contains the joint distribution across the
@@ -264,3 +747,196 @@ class TableCPDFactorization (old):
         # return result
         return fanswer
 
+
+    def map(self,
+            query: "A collection of query vertices.",
+            evidence: "A dict of {vertex: value} pairs." = None,
+            logspace: "If True, maximize log-probabilities (max-sum)." = False,
+            exclude: "A dict of {vertex: collection of values} to rule out." = None
+    ) -> "a tuple (assignment, probability)":
+        '''Find the most probable joint assignment of the vertices in *query*.
+
+        The vertices that are neither queried nor observed are summed
+        out first, by sum-product variable elimination. The query
+        vertices are then maximized out by max-product elimination,
+        keeping the product factor of each step. Finally the traceback
+        walks these steps backwards, choosing for each vertex the
+        value that maximizes its product factor given the values
+        already chosen for the vertices eliminated after it. For more
+        information cf. Koller et al. 13.2 and 13.2.3.
+
+        If *logspace* is true, the maximization works on
+        log-probabilities, adding factors instead of multiplying them
+        (max-sum), which avoids underflow when many vertices are
+        queried. With *factortype* :doc:`LogCPDFactor <logcpdfactor>`
+        the summing out is done in log space as well.
+
+        If *exclude* is given, the assignment is the most probable one
+        among those where no vertex takes one of the values listed
+        for it, see *kbest*.
+
+        Returns:
+            A tuple (assignment, probability), where *assignment* is a dict of {vertex: value} pairs for the vertices in *query* and *probability* is the joint probability P(assignment, evidence), or its natural logarithm if *logspace* is true.
+
+        Ties are broken in favour of the value listed first in
+        ``Vdata[vertex]["vals"]``. The original factors and
+        *factorlist* are not modified.
+
+        '''
+        if evidence is None:
+            evidence = {}
+        query = set(query)
+        assert not query & set(evidence), "Query and evidence must not overlap."
+        card = dict((vertex, len(self.bn.Vdata[vertex]["vals"]))
+                    for vertex in self.bn.V)
+
+        def eliminate(factors, vertices, maximize, combine):
+            order, maxfactorsize = eliminationorder.eliminationorder(
+                [factor.scope for factor in factors], card,
+                vertices, self.heuristic)
+            self.checkbudget(maxfactorsize)
+            traces = []
+            for vertex in order:
+                inside = [factor for factor in factors if vertex in factor.scope]
+                factors = [factor for factor in factors if vertex not in factor.scope]
+                product = inside[0].copy()
+                for factor in inside[1:]:
+                    combine(product, factor)
+                result = product.copy()
+                if maximize:
+                    result.maxout(vertex)
+                    traces.append((vertex, product))
+                else:
+                    result.sumout(vertex)
+                factors.append(result)
+            return factors, traces
+
+        factors = []
+        for factor in self.originalfactorlist:
+            excluded = exclude and exclude.get(factor.inputvertex)
+            if excluded:
+                # zero the entries of the excluded values of the vertex,
+                # which comes first in the scope of its own CPD
+                values = self.bn.Vdata[factor.inputvertex]["vals"]
+                factor = factor.copy()
+                factor.vals = [
+                    0. if values[index % factor.card[0]] in excluded else val
+                    for index, val in enumerate(factor.vals)]
+            factors.append(factor.reduced(evidence))
+        factors, _ = eliminate(
+            factors,
+            [vertex for vertex in self.bn.V
+             if vertex not in query and vertex not in evidence],
+            False, type(factors[0]).multiplyfactor)
+
+        if logspace:
+            factors = [LogCPDFactor.fromfactor(factor) for factor in factors]
+        combine = type(factors[0]).multiplyfactor
+        factors, traces = eliminate(
+            factors, [vertex for vertex in self.bn.V if vertex in query],
+            True, combine)
+
+        # only constants remain
+        result = factors[0].copy()
+        for factor in factors[1:]:
+            combine(result, factor)
+        probability = float(result.logvals[0] if logspace else result.vals[0])
+
+        # traceback
+        assignment = {}
+        for vertex, product in reversed(traces):
+            factor = product.reduced(assignment)
+            if isinstance(factor, LogCPDFactor):
+                vals = list(factor.logvals)
+            else:
+                vals = list(factor.vals)
+            assignment[vertex] = self.bn.Vdata[vertex]["vals"][
+                vals.index(max(vals))]
+        return assignment, probability
+
+    def mpe(self,
+            evidence: "A dict of {vertex: value} pairs." = None,
+            logspace: "If True, maximize log-probabilities (max-sum)." = False
+    ) -> "a tuple (assignment, probability)":
+        '''Find the most probable explanation of *evidence*.
+
+        This is *map* with all unobserved vertices as the query: the
+        result is the most probable assignment of every vertex not in
+        *evidence*, together with its joint probability with the
+        evidence (or the logarithm thereof, if *logspace* is true).
+
+        '''
+        if evidence is None:
+            evidence = {}
+        return self.map([vertex for vertex in self.bn.V
+                         if vertex not in evidence], evidence, logspace)
+
+    def kbest(self,
+              k: "The number of assignments to return.",
+              query: "A collection of query vertices, all unobserved vertices if None." = None,
+              evidence: "A dict of {vertex: value} pairs." = None,
+              logspace: "If True, maximize log-probabilities (max-sum)." = False
+    ) -> "a list of (assignment, probability) tuples":
+        '''Find the *k* most probable joint assignments of the vertices in *query*.
+
+        The assignments are found by partitioning the space of
+        assignments around each solution, as proposed by Lawler and
+        applied to Bayesian networks by Nilsson (1998). Starting from
+        the best assignment from *map*, the remaining assignments are
+        split into disjoint subspaces: in the i-th subspace the first
+        i - 1 vertices keep their values in the solution, and the i-th
+        vertex takes any other value. The best assignment of each
+        subspace is again found by *map*, with the fixed vertices as
+        evidence and the ruled out values in *exclude*, and the best
+        subspace in a priority queue supplies the next solution. Each
+        solution thus costs a number of variable eliminations linear
+        in the size of *query*, and the joint table over *query* is
+        never built.
+
+        Returns:
+            A list of at most *k* tuples (assignment, probability) as returned by *map*, most probable first. Assignments of probability zero are left out.
+
+        '''
+        if evidence is None:
+            evidence = {}
+        if query is None:
+            query = [vertex for vertex in self.bn.V if vertex not in evidence]
+        query = [vertex for vertex in self.bn.V if vertex in set(query)]
+        impossible = float("-inf") if logspace else 0.
+
+        def solve(fixed, exclude):
+            free = [vertex for vertex in query if vertex not in fixed]
+            if not free:
+                return None
+            conditions = dict(evidence)
+            conditions.update(fixed)
+            assignment, probability = self.map(free, conditions, logspace, exclude)
+            if probability <= impossible:
+                return None
+            assignment.update(fixed)
+            return assignment, probability, fixed, exclude
+
+        solutions = []
+        queue = []
+        counter = 0
+        best = solve({}, {})
+        if best is not None:
+            heapq.heappush(queue, (-best[1], counter, best))
+        while queue and len(solutions) < k:
+            _, _, (assignment, probability, fixed, exclude) = heapq.heappop(queue)
+            solutions.append((assignment, probability))
+
+            # partition the rest of the subspace of this solution
+            fixed = dict(fixed)
+            for vertex in query:
+                if vertex in fixed:
+                    continue
+                branch = dict((v, values) for v, values in exclude.items()
+                              if v not in fixed)
+                branch[vertex] = set(exclude.get(vertex, ())) | {assignment[vertex]}
+                result = solve(dict(fixed), branch)
+                if result is not None:
+                    counter += 1
+                    heapq.heappush(queue, (-result[1], counter, result))
+                fixed[vertex] = assignment[vertex]
+        return solutions
@@ -14,3 +14,6 @@ class libpgmError(Exception):
 
 class bntextError(libpgmError):
     pass
+
+class memorybudgetError(libpgmError):
+    pass
@@ -5,16 +5,34 @@ Created on Jun 20, 2012
 @author: ccabot
 
 '''
+import math
+import os
+import random
+import tempfile
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 
 from libpgm.graphskeleton import GraphSkeleton
 from libpgm.discretebayesiannetwork import DiscreteBayesianNetwork
 from libpgm.hybayesiannetwork import HyBayesianNetwork
 from libpgm.nodedata import NodeData, HybridNodeData
 from libpgm.tablecpdfactor import TableCPDFactor
+from libpgm.arraycpdfactor import ArrayCPDFactor
+from libpgm.logcpdfactor import LogCPDFactor
+from libpgm.sparsecpdfactor import SparseCPDFactor
+from libpgm.utils.libpgmexceptions import memorybudgetError
 from libpgm.deprecated import oldTableCPDFactor
 from libpgm.sampleaggregator import SampleAggregator
 from libpgm.tablecpdfactorization import TableCPDFactorization
+from libpgm.eliminationorder import eliminationorder, contractionpath
+from libpgm.junctiontree import JunctionTree
+from libpgm.minibucket import MiniBucket
+from libpgm.loopybp import LoopyBP
+from libpgm.polytree import PolytreeBP
+from libpgm.arithmeticcircuit import ArithmeticCircuit
+from libpgm.recursiveconditioning import RecursiveConditioning
+from libpgm.cutsetconditioning import CutsetConditioning
 from libpgm.lgbayesiannetwork import LGBayesianNetwork
 from libpgm.dyndiscbayesiannetwork import DynDiscBayesianNetwork
 from libpgm.pgmlearner import PGMLearner
@@ -49,6 +67,28 @@ class TestGraphSkeleton(unittest.TestCase):
         self.assertTrue(self.instance.V.index(5)<self.instance.V.index(1))
         self.assertTrue(self.instance.V.index(5)<self.instance.V.index(2))
 
+    def test_getrelevant(self):
+        self.assertEqual(self.instance.getrelevant([1]), ({1, 5}, set()))
+        self.assertEqual(self.instance.getrelevant([5], [2]), ({1, 2, 5}, {2}))
+        self.assertEqual(self.instance.getrelevant([2], [1, 3]), ({2}, {1}))
+
+    def test_ispolytree(self):
+        self.assertTrue(self.instance.ispolytree())
+        self.instance.E = [[5, 1], [1, 2], [3, 2], [3, 4]]
+        self.assertTrue(self.instance.ispolytree())
+        self.instance.E.append([5, 4])
+        self.assertFalse(self.instance.ispolytree())
+
+    def test_loopcutset(self):
+        self.assertEqual(self.instance.loopcutset(), [])
+        # a loop through 5 and 3, and a loop through 1 and 2 below it
+        self.instance.E = [[5, 1], [1, 2], [3, 2], [3, 4], [5, 4], [1, 3]]
+        cutset = self.instance.loopcutset()
+        self.instance.E = [pair for pair in self.instance.E
+                           if pair[0] not in cutset]
+        self.assertTrue(self.instance.ispolytree())
+        self.assertTrue(len(cutset) <= 2)
+
 class TestDiscreteBayesianNetwork(unittest.TestCase):
 
     def setUp(self):
@@ -70,6 +110,17 @@ class TestDiscreteBayesianNetwork(unittest.TestCase):
     	for entry in randomsample:
     		self.assertEqual(entry["Difficulty"], 'easy')
 
+    def test_specificquery(self):
+        queries = [(dict(Grade=[grade]), dict(Letter=letter))
+                   for grade in ['A', 'B', 'C']
+                   for letter in ['weak', 'strong']] * 20
+        expected = [.0727, .6486, .2318, .3445, .6955, .0070] * 20
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(
+                lambda q: self.instance.specificquery(*q), queries))
+        for result, exp in zip(results, expected):
+            self.assertAlmostEqual(result, exp, 4)
+
 class TestLGBayesianNetwork(unittest.TestCase):
 
     def setUp(self):
@@ -140,6 +191,35 @@ class TestTableCPDFactor(unittest.TestCase):
         self.assertEqual(factor.scope, c)
         self.assertEqual(factor.stride, d)
 
+    def test_maxout(self):
+        factor = self.factor.maxout("Difficulty")
+        self.assertEqual(factor.vals, [0.3, 0.4, 0.7, 0.9, 0.3, 0.2])
+        self.assertEqual(factor.scope, ['Grade', 'Intelligence'])
+
+    def test_minout(self):
+        factor = self.factor.minout("Difficulty")
+        self.assertEqual(factor.vals, [0.05, 0.25, 0.3, 0.5, 0.08, 0.02])
+        self.assertEqual(factor.scope, ['Grade', 'Intelligence'])
+
+    def test_sumproduct(self):
+        product = self.factor.copy()
+        product.multiplyfactor(self.factor2)
+        product.sumout("Grade")
+        factor = self.factor.sumproduct([self.factor2], "Grade")
+        self.assertEqual(factor.scope, product.scope)
+        self.assertEqual(factor.card, product.card)
+        self.assertEqual(factor.stride, product.stride)
+        for x, y in zip(factor.vals, product.vals):
+            self.assertAlmostEqual(x, y)
+
+    def test_reduced(self):
+        vals = self.factor.vals[:]
+        factor = self.factor.reduced(dict(Difficulty='easy', Letter='weak'))
+        self.assertEqual(factor.vals, [0.3, 0.4, 0.3, 0.9, 0.08, 0.02])
+        self.assertEqual(factor.scope, ['Grade', 'Intelligence'])
+        self.assertEqual(self.factor.vals, vals)
+        self.assertEqual(self.factor.scope, ['Grade', 'Intelligence', 'Difficulty'])
+
     def test_copy(self):
         copy = self.factor.copy()
         self.assertTrue((copy is self.factor) == False)
@@ -192,6 +272,273 @@ class TestRegressionTableCPDFactor(unittest.TestCase):
         self.assertEqual(factor.scope, self.oldfactor.scope)
         self.assertEqual(factor.stride, self.oldfactor.stride)
 
+class TestArrayCPDFactor(unittest.TestCase):
+    def setUp(self):
+        skel = GraphSkeleton()
+        skel.load("unittestdict.txt")
+        skel.toporder()
+        nodedata = NodeData.load("unittestdict.txt")
+        self.instance = DiscreteBayesianNetwork(nodedata)
+        self.tablefactor = TableCPDFactor("Grade", self.instance)
+        self.tablefactor2 = TableCPDFactor("Letter", self.instance)
+        self.factor = ArrayCPDFactor("Grade", self.instance)
+        self.factor2 = ArrayCPDFactor("Letter", self.instance)
+
+    def assertSameFactor(self, factor, tablefactor):
+        self.assertEqual(factor.scope, tablefactor.scope)
+        self.assertEqual(factor.card, tablefactor.card)
+        self.assertEqual(factor.stride, tablefactor.stride)
+        self.assertEqual(list(factor.values.shape), tablefactor.card)
+        for x, y in zip(factor.vals, tablefactor.vals):
+            self.assertAlmostEqual(x, y)
+
+    def test_constructor(self):
+        self.assertSameFactor(self.factor, self.tablefactor)
+
+    def test_multiplyfactor(self):
+        self.factor.multiplyfactor(self.factor2)
+        self.tablefactor.multiplyfactor(self.tablefactor2)
+        self.assertSameFactor(self.factor, self.tablefactor)
+
+    def test_multiplytablefactor(self):
+        self.factor2.multiplyfactor(self.tablefactor)
+        self.tablefactor2.multiplyfactor(TableCPDFactor("Grade", self.instance))
+        self.assertSameFactor(self.factor2, self.tablefactor2)
+
+    def test_sumout(self):
+        factor = self.factor.sumout("Difficulty")
+        self.tablefactor.sumout("Difficulty")
+        self.assertSameFactor(factor, self.tablefactor)
+
+    def test_reducefactor(self):
+        factor = self.factor.reducefactor("Difficulty", 'easy')
+        self.tablefactor.reducefactor("Difficulty", 'easy')
+        self.assertSameFactor(factor, self.tablefactor)
+
+    def test_maxout(self):
+        factor = self.factor.maxout("Difficulty")
+        self.tablefactor.maxout("Difficulty")
+        self.assertSameFactor(factor, self.tablefactor)
+
+    def test_sumproduct(self):
+        factor = self.factor.sumproduct([self.tablefactor2], "Grade")
+        self.tablefactor.multiplyfactor(self.tablefactor2)
+        self.tablefactor.sumout("Grade")
+        self.assertSameFactor(factor, self.tablefactor)
+
+    def test_reduced(self):
+        factor = self.factor.reduced(dict(Difficulty='easy'))
+        self.assertSameFactor(self.factor, self.tablefactor)
+        self.tablefactor.reducefactor("Difficulty", 'easy')
+        self.assertSameFactor(factor, self.tablefactor)
+        self.assertFalse(factor.values.flags.writeable)
+        factor.multiplyfactor(self.factor2)
+        self.assertEqual(factor.scope, ['Grade', 'Intelligence', 'Letter'])
+
+    def test_copy(self):
+        copy = self.factor.copy()
+        self.assertTrue((copy is self.factor) == False)
+        self.assertSameFactor(copy, self.tablefactor)
+        copy.vals[0] = 0
+        self.assertNotEqual(self.factor.vals[0], 0)
+
+    def test_factorization(self):
+        evidence = dict(Grade='C', SAT='highscore')
+        query = dict(Intelligence='high')
+        fn = TableCPDFactorization(self.instance, factortype=ArrayCPDFactor)
+        self.assertTrue(isinstance(fn.originalfactorlist[0], ArrayCPDFactor))
+        factor = fn.condprobve(query, evidence)
+        tablefactor = TableCPDFactorization(self.instance).condprobve(query, evidence)
+        self.assertSameFactor(factor, tablefactor)
+
+class TestLogCPDFactor(unittest.TestCase):
+    def setUp(self):
+        nodedata = NodeData.load("unittestdict.txt")
+        self.instance = DiscreteBayesianNetwork(nodedata)
+        self.tablefactor = TableCPDFactor("Grade", self.instance)
+        self.tablefactor2 = TableCPDFactor("Letter", self.instance)
+        self.factor = LogCPDFactor("Grade", self.instance)
+        self.factor2 = LogCPDFactor("Letter", self.instance)
+
+    def assertSameFactor(self, factor, tablefactor):
+        self.assertEqual(factor.scope, tablefactor.scope)
+        self.assertEqual(factor.card, tablefactor.card)
+        for x, y in zip(factor.vals, tablefactor.vals):
+            self.assertAlmostEqual(x, y)
+        for x, y in zip(factor.logvals, tablefactor.vals):
+            self.assertAlmostEqual(math.exp(x), y)
+
+    def test_constructor(self):
+        self.assertSameFactor(self.factor, self.tablefactor)
+
+    def test_multiplyfactor(self):
+        self.factor.multiplyfactor(self.factor2)
+        self.tablefactor.multiplyfactor(self.tablefactor2)
+        self.assertSameFactor(self.factor, self.tablefactor)
+        self.factor2.multiplyfactor(TableCPDFactor("Grade", self.instance))
+        self.tablefactor2.multiplyfactor(TableCPDFactor("Grade", self.instance))
+        self.assertSameFactor(self.factor2, self.tablefactor2)
+
+    def test_sumout(self):
+        self.factor.sumout("Difficulty")
+        self.tablefactor.sumout("Difficulty")
+        self.assertSameFactor(self.factor, self.tablefactor)
+
+    def test_reducefactor(self):
+        self.factor.reducefactor("Difficulty", 'easy')
+        self.tablefactor.reducefactor("Difficulty", 'easy')
+        self.assertSameFactor(self.factor, self.tablefactor)
+
+    def test_sumproduct(self):
+        factor = self.factor.copy()
+        factor.sumproduct([self.factor2], "Grade")
+        self.tablefactor.multiplyfactor(self.tablefactor2)
+        self.tablefactor.sumout("Grade")
+        self.assertSameFactor(factor, self.tablefactor)
+        # a result that is exactly zero stays zero
+        self.factor2.values[0, :] = -float('inf')
+        self.factor.sumproduct([self.factor2], "Grade")
+        self.tablefactor2.vals = [0, .9, 0, .6, 0, .01]
+        tablefactor = TableCPDFactor("Grade", self.instance)
+        tablefactor.multiplyfactor(self.tablefactor2)
+        tablefactor.sumout("Grade")
+        self.assertSameFactor(self.factor, tablefactor)
+        self.assertEqual(self.factor.vals[0], 0)
+
+    def test_deterministic(self):
+        # a weak letter is impossible, and entries with high
+        # intelligence underflow once scaled; neither builds the
+        # full product
+        self.factor2.values[0, :] = -float('inf')
+        self.factor.values[:, 1, :] -= 1000
+        expected = LogCPDFactor.fromfactor(self.factor)
+        expected.multiplyfactor(self.factor2)
+        expected.sumout("Grade")
+        def unfused(other):
+            self.fail("The full product was built.")
+        self.factor.multiplyfactor = unfused
+        self.factor.sumproduct([self.factor2], "Grade")
+        self.assertEqual(self.factor.scope, expected.scope)
+        self.assertTrue(all(x == y == -float('inf') or abs(x - y) < 1e-9
+                            for x, y in zip(self.factor.logvals,
+                                            expected.logvals)))
+        self.assertEqual(sum(x == -float('inf')
+                             for x in self.factor.logvals), 4)
+        self.assertTrue(min(x for x in self.factor.logvals
+                            if x > -float('inf')) < -1000)
+
+    def test_normalize(self):
+        self.factor.scope = ["Grade"]
+        self.factor.card = [3]
+        self.factor.vals = [0, 1e-320, 3e-320]
+        self.factor.values = self.factor.values - 1000
+        self.factor.normalize()
+        for x, y in zip(self.factor.vals, [0, .25, .75]):
+            self.assertAlmostEqual(x, y)
+
+    def test_underflow(self):
+        # a root with many children all observed at an unlikely value
+        nodedata = NodeData()
+        nodedata.Vdata = dict(Root=dict(parents=[], vals=['a', 'b'], cprob=[.5, .5]))
+        for i in range(300):
+            nodedata.Vdata["Leaf%d" % i] = dict(
+                parents=["Root"], vals=['a', 'b'],
+                cprob={('a',): [.99, .01], ('b',): [.999, .001]})
+        bn = DiscreteBayesianNetwork(nodedata)
+        evidence = dict(("Leaf%d" % i, 'b') for i in range(300))
+        fn = TableCPDFactorization(bn, factortype=LogCPDFactor)
+        factor = fn.condprobve(dict(Root=''), evidence)
+        self.assertAlmostEqual(factor.vals[0], 1)
+        self.assertAlmostEqual(factor.logvals[1], 300 * math.log(.1))
+        fn.plancachesize = 0
+        factor = fn.condprobve(dict(Root=''), evidence)
+        self.assertAlmostEqual(factor.logvals[1], 300 * math.log(.1))
+
+class TestSparseCPDFactor(unittest.TestCase):
+    def setUp(self):
+        nodedata = NodeData.load("unittestdict.txt")
+        nodedata.Vdata["Letter"]["cprob"] = {
+            ('A',): [0, 1], ('B',): [.4, .6], ('C',): [1, 0]}
+        self.instance = DiscreteBayesianNetwork(nodedata)
+        self.tablefactor = TableCPDFactor("Grade", self.instance)
+        self.tablefactor2 = TableCPDFactor("Letter", self.instance)
+        self.factor = SparseCPDFactor("Grade", self.instance)
+        self.factor2 = SparseCPDFactor("Letter", self.instance)
+
+    def assertSameFactor(self, factor, tablefactor):
+        self.assertEqual(factor.scope, tablefactor.scope)
+        self.assertEqual(factor.card, tablefactor.card)
+        self.assertEqual(factor.stride, tablefactor.stride)
+        for x, y in zip(factor.vals, tablefactor.vals):
+            self.assertAlmostEqual(x, y)
+
+    def test_constructor(self):
+        self.assertSameFactor(self.factor2, self.tablefactor2)
+        self.assertEqual(len(self.factor2.entries), 4)
+
+    def test_multiplyfactor(self):
+        self.factor.multiplyfactor(self.factor2)
+        self.tablefactor.multiplyfactor(self.tablefactor2)
+        self.assertSameFactor(self.factor, self.tablefactor)
+        self.factor2.multiplyfactor(TableCPDFactor("Grade", self.instance))
+        self.tablefactor2.multiplyfactor(TableCPDFactor("Grade", self.instance))
+        self.assertSameFactor(self.factor2, self.tablefactor2)
+
+    def test_sumout(self):
+        self.factor.sumout("Difficulty")
+        self.tablefactor.sumout("Difficulty")
+        self.assertSameFactor(self.factor, self.tablefactor)
+
+    def test_reducefactor(self):
+        self.factor2.reducefactor("Grade", 'B')
+        self.tablefactor2.reducefactor("Grade", 'B')
+        self.assertSameFactor(self.factor2, self.tablefactor2)
+
+    def test_maxout(self):
+        self.factor.maxout("Difficulty")
+        self.tablefactor.maxout("Difficulty")
+        self.assertSameFactor(self.factor, self.tablefactor)
+
+    def test_mixedpath(self):
+        # the last contraction of the path may yield the other class
+        def table(factor):
+            return dict((frozenset((t_scope, (i // factor.stride[t_scope]) % t_card)
+                                   for t_scope, t_card in zip(factor.scope, factor.card)), val)
+                        for i, val in enumerate(factor.vals))
+        others = [self.factor2, TableCPDFactor("Intelligence", self.instance),
+                  TableCPDFactor("Difficulty", self.instance)]
+        path = [(1, 2), (0, 1), (0, 1)]
+        for first in [self.tablefactor, self.factor]:
+            expected = table(first.copy().sumproduct(others, "Grade"))
+            result = first.copy().sumproduct(others, "Grade", path)
+            self.assertEqual(type(result), type(first))
+            result = table(result)
+            self.assertEqual(set(result), set(expected))
+            for key, val in expected.items():
+                self.assertAlmostEqual(result[key], val)
+
+    def test_minout(self):
+        self.factor2.minout("Grade")
+        self.tablefactor2.minout("Grade")
+        self.assertSameFactor(self.factor2, self.tablefactor2)
+        self.factor.minout("Difficulty")
+        self.tablefactor.minout("Difficulty")
+        self.assertSameFactor(self.factor, self.tablefactor)
+
+    def test_factorization(self):
+        fn = TableCPDFactorization(self.instance)
+        types = lambda: dict((factor.inputvertex, type(factor))
+                             for factor in fn.originalfactorlist)
+        self.assertEqual(types()["Letter"], TableCPDFactor)
+        exp = fn.condprobve(dict(Grade=''), dict(Letter='weak')).vals
+        fn.sparsethreshold = .7
+        fn.invalidate()
+        self.assertEqual(types()["Letter"], SparseCPDFactor)
+        self.assertEqual(types()["Grade"], TableCPDFactor)
+        vals = fn.condprobve(dict(Grade=''), dict(Letter='weak')).vals
+        for x, y in zip(vals, exp):
+            self.assertAlmostEqual(x, y)
+
 class TestTableCPDFactorization(unittest.TestCase):
 
     def setUp(self):
@@ -215,6 +562,21 @@ class TestTableCPDFactorization(unittest.TestCase):
         result2 = self.fn.specificquery(query, evidence)
         self.assertEqual(result1, result2)
 
+    def test_copyonwrite(self):
+        original = [(factor.vals[:], factor.scope[:], factor.card[:])
+                    for factor in self.fn.originalfactorlist]
+        cprob = self.bn.Vdata["Difficulty"]["cprob"][:]
+        self.fn.plancachesize = 0
+        self.fn.refresh()
+        self.fn.condprobve(dict(Difficulty=''), dict(Letter='weak'))
+        self.fn.refresh()
+        self.fn.condprobve(dict(Difficulty='', Grade=''), {})
+        self.assertEqual([(factor.vals, factor.scope, factor.card)
+                          for factor in self.fn.originalfactorlist], original)
+        self.assertEqual(self.bn.Vdata["Difficulty"]["cprob"], cprob)
+        self.fn.refresh()
+        self.assertTrue(self.fn.factorlist[0] is self.fn.originalfactorlist[0])
+
     def test_sumproducteliminatevar(self):
         self.fn.refresh()
         self.fn.sumproducteliminatevar("Difficulty")
@@ -253,6 +615,23 @@ class TestTableCPDFactorization(unittest.TestCase):
         answer = self.fn.specificquery(query, evidence)
         self.assertTrue(abs(answer - .784) < .01)
 
+    def test_threads(self):
+        # plans of two query shapes, shared by eight threads
+        queries = [(dict(Intelligence=['high']), dict(Grade=grade, SAT=sat))
+                   for grade in ['A', 'B', 'C']
+                   for sat in ['lowscore', 'highscore']]
+        queries += [(dict(Grade=[grade]), dict(Letter=letter))
+                    for grade in ['A', 'B', 'C']
+                    for letter in ['weak', 'strong']]
+        expected = [.2503, .9621, .0427, .7721, .0177, .5783,
+                    .0727, .6486, .2318, .3445, .6955, .0070]
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(
+                lambda q: self.fn.specificquery(*q), queries * 20))
+        for result, exp in zip(results, expected * 20):
+            self.assertAlmostEqual(result, exp, 4)
+        self.assertEqual(len(self.fn.plans), 2)
+
     def test_gibbssample(self):
         evidence = dict(Letter='weak')
         gs = self.fn.gibbssample(evidence, 5)
@@ -261,6 +640,660 @@ class TestTableCPDFactorization(unittest.TestCase):
         for entry in gs:
             self.assertTrue(entry["Letter"] == 'weak')
 
+class TestQueryPlan(unittest.TestCase):
+
+    def setUp(self):
+        nodedata = NodeData.load("unittestdict.txt")
+        self.bn = DiscreteBayesianNetwork(nodedata)
+        self.fn = TableCPDFactorization(self.bn)
+
+    def test_cache(self):
+        query = dict(Intelligence=['high'])
+        for value in ['A', 'B', 'C', 'A']:
+            self.fn.specificquery(query, dict(Grade=value))
+        self.fn.specificquery(query, dict(Letter='weak'))
+        self.assertEqual(self.fn.planmisses, 2)
+        self.assertEqual(self.fn.planhits, 3)
+        self.fn.plancachesize = 1
+        self.fn.specificquery(query, dict(Grade='B'))
+        self.fn.specificquery(query, dict(Letter='strong'))
+        self.assertEqual(len(self.fn.plans), 1)
+        self.assertEqual(self.fn.planmisses, 3)
+
+    def test_run(self):
+        self.fn.plancachesize = 0
+        for factortype in [TableCPDFactor, ArrayCPDFactor]:
+            fn = TableCPDFactorization(self.bn, factortype=factortype)
+            for evidence in [dict(Grade='C', SAT='highscore'), dict(Letter='weak')]:
+                self.fn.refresh()
+                exp = self.fn.condprobve(dict(Intelligence=''), evidence).vals
+                for _ in range(2):
+                    vals = fn.condprobve(dict(Intelligence=''), evidence).vals
+                    for x in range(2):
+                        self.assertAlmostEqual(vals[x], exp[x])
+        self.assertEqual(len(fn.originalfactorlist[3].scope), 3)
+
+    def test_prune(self):
+        plan = self.fn.queryplan(["Intelligence"], ["Difficulty"])
+        self.assertEqual(plan.vertices, {"Intelligence"})
+        self.assertEqual(plan.evidence, set())
+        plan = self.fn.queryplan(["Grade"], ["Letter", "SAT"])
+        self.assertEqual(plan.vertices, {"Grade", "Letter", "SAT",
+                                         "Difficulty", "Intelligence"})
+        plan = self.fn.queryplan(["Letter"], ["Grade", "SAT"])
+        self.assertEqual(plan.vertices, {"Letter"})
+        self.assertEqual(plan.evidence, {"Grade"})
+        factor = self.fn.condprobve(dict(Letter=''), dict(Grade='A', SAT='highscore'))
+        self.assertAlmostEqual(factor.vals[0], .1)
+
+    def test_batch(self):
+        # a high score means high intelligence, which never gets a C,
+        # so the last case is impossible
+        cprob = self.bn.Vdata["SAT"]["cprob"]
+        cprob[('low',)] = [1., 0.]
+        cprob = self.bn.Vdata["Grade"]["cprob"]
+        cprob[('easy', 'high')] = [.9, .1, 0.]
+        cprob[('hard', 'high')] = [.5, .5, 0.]
+        self.fn = TableCPDFactorization(self.bn)
+        evidence = dict(Grade=['A', 'B', 'C', 'B', 'C'],
+                        SAT=['highscore', 'highscore', 'lowscore', 'lowscore',
+                             'highscore'])
+        for factortype in [TableCPDFactor, ArrayCPDFactor]:
+            fn = TableCPDFactorization(self.bn, factortype=factortype)
+            result = fn.condprobvebatch(["Intelligence", "Difficulty"],
+                                        evidence, batchsize=3)
+            self.assertEqual(result.shape, (5, 4))
+            self.assertEqual(list(result[4]), [0., 0., 0., 0.])
+            for case in range(5):
+                factor = self.fn.condprobve(
+                    dict(Intelligence='', Difficulty=''),
+                    dict((vertex, column[case])
+                         for vertex, column in evidence.items()))
+                for i in range(2):
+                    for d in range(2):
+                        exp = factor.vals[factor.stride["Intelligence"] * i +
+                                          factor.stride["Difficulty"] * d]
+                        self.assertAlmostEqual(result[case][i + 2 * d], exp)
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        nodedata = NodeData.load("unittestdict.txt")
+        self.bn = DiscreteBayesianNetwork(nodedata)
+        self.fn = TableCPDFactorization(self.bn)
+        self.fn.resultcachesize = 2
+
+    def test_canonical(self):
+        query = dict(Intelligence=['high'])
+        exp = self.fn.specificquery(query, dict(Grade='A', Letter='weak'))
+        self.assertEqual(self.fn.specificquery(query, dict(Letter='weak', Grade='A')), exp)
+        self.assertEqual(self.fn.specificquery(query, dict(Grade='A')), exp)
+        self.assertEqual(self.fn.resulthits, 2)
+        self.assertEqual(self.fn.resultmisses, 1)
+        self.assertEqual(self.fn.specificquery(dict(Letter=['weak']),
+                                               dict(Grade='A', SAT='lowscore')),
+                         self.fn.specificquery(dict(Letter=['weak']),
+                                               dict(Grade='A', SAT='highscore')))
+        self.assertEqual(self.fn.resulthits, 3)
+        self.assertEqual(len(self.fn.results), 2)
+
+    def test_ttl(self):
+        self.fn.resultttl = 0.001
+        query = dict(Intelligence=['high'])
+        self.fn.specificquery(query, dict(Grade='A'))
+        time.sleep(0.01)
+        self.fn.specificquery(query, dict(Grade='A'))
+        self.assertEqual(self.fn.resultmisses, 2)
+
+    def test_invalidate(self):
+        query = dict(Difficulty=['easy'])
+        self.fn.specificquery(query, {})
+        self.fn.specificquery(dict(Intelligence=['high']), {})
+        self.bn.Vdata["Difficulty"]["cprob"] = [.3, .7]
+        self.fn.invalidate(["Difficulty"])
+        self.assertEqual(len(self.fn.results), 1)
+        self.assertAlmostEqual(self.fn.specificquery(query, {}), .3)
+
+    def test_invalidaterun(self):
+        # a CPD changes while the plan runs on the old factors
+        query = dict(Difficulty=['easy'])
+        plan = self.fn.queryplan(["Difficulty"], [])
+        run = plan.run
+        def changing(evidence):
+            factor = run(evidence)
+            self.bn.Vdata["Difficulty"]["cprob"] = [.3, .7]
+            self.fn.invalidate(["Difficulty"])
+            return factor
+        plan.run = changing
+        self.assertAlmostEqual(self.fn.specificquery(query, {}), .6)
+        self.assertEqual(len(self.fn.results), 0)
+        self.assertAlmostEqual(self.fn.specificquery(query, {}), .3)
+
+class TestMAP(unittest.TestCase):
+
+    def setUp(self):
+        nodedata = NodeData.load("unittestdict.txt")
+        self.bn = DiscreteBayesianNetwork(nodedata)
+
+    def test_mpe(self):
+        exp = dict(Grade='C', Difficulty='hard', Intelligence='low', SAT='lowscore')
+        for factortype in [TableCPDFactor, ArrayCPDFactor]:
+            fn = TableCPDFactorization(self.bn, factortype=factortype)
+            assignment, probability = fn.mpe(dict(Letter='weak'))
+            self.assertEqual(assignment, exp)
+            self.assertAlmostEqual(probability, .184338)
+            assignment, logprobability = fn.mpe(dict(Letter='weak'), logspace=True)
+            self.assertEqual(assignment, exp)
+            self.assertAlmostEqual(logprobability, math.log(.184338))
+
+    def test_map(self):
+        fn = TableCPDFactorization(self.bn)
+        assignment, probability = fn.map(["Intelligence"], dict(Letter='weak'))
+        self.assertEqual(assignment, dict(Intelligence='low'))
+        marginal = fn.specificquery(dict(Letter=['weak']), {})
+        self.assertAlmostEqual(probability / marginal,
+                               fn.specificquery(dict(Intelligence=['low']),
+                                                dict(Letter='weak')))
+        assignment, _ = fn.map(["Intelligence", "Difficulty"], dict(Grade='C'))
+        self.assertEqual(assignment, dict(Intelligence='low', Difficulty='hard'))
+
+    def test_kbest(self):
+        fn = TableCPDFactorization(self.bn)
+        solutions = fn.kbest(3, evidence=dict(Letter='weak'))
+        self.assertEqual(solutions[0], fn.mpe(dict(Letter='weak')))
+        self.assertEqual(len(solutions), 3)
+        probabilities = [probability for _, probability in solutions]
+        self.assertEqual(probabilities, sorted(probabilities, reverse=True))
+        solutions = fn.kbest(10, ["Intelligence", "Difficulty"])
+        self.assertEqual(len(solutions), 4)
+        self.assertAlmostEqual(sum(p for _, p in solutions), 1)
+
+class TestMemoryBudget(unittest.TestCase):
+    def setUp(self):
+        nodedata = NodeData.load("unittestdict.txt")
+        self.bn = DiscreteBayesianNetwork(nodedata)
+        self.fn = TableCPDFactorization(self.bn)
+        self.query = dict(Intelligence='')
+        self.evidence = dict(Letter='weak')
+
+    def test_estimatecost(self):
+        cost = self.fn.estimatecost(self.query, self.evidence)
+        self.assertEqual(cost["order"], ["Difficulty", "Grade"])
+        self.assertEqual(cost["width"], 2)
+        self.assertEqual(cost["maxfactorsize"], 12)
+        self.assertEqual(cost["memory"], 12 * TableCPDFactor.entrysize)
+        self.assertTrue(cost["flops"] > 12)
+        self.assertEqual(self.fn.estimatecost(["Intelligence"], ["Letter"]), cost)
+
+    def test_budget(self):
+        cost = self.fn.estimatecost(self.query, self.evidence)
+        self.fn.memorybudget = cost["memory"]
+        self.fn.condprobve(self.query, self.evidence)
+        self.fn.memorybudget = cost["memory"] - 1
+        self.assertRaises(memorybudgetError, self.fn.condprobve,
+                          self.query, self.evidence)
+        self.fn.plancachesize = 0
+        self.fn.refresh()
+        self.assertRaises(memorybudgetError, self.fn.condprobve,
+                          self.query, self.evidence)
+
+    def test_fallback(self):
+        exact = self.fn.condprobve(self.query, self.evidence).vals
+        self.fn.memorybudget = 0
+        self.fn.fallback = TableCPDFactorization.condprobgibbs
+        random.seed(0)
+        factor = self.fn.condprobve(self.query, self.evidence)
+        self.assertEqual(factor.scope, ["Intelligence"])
+        for x, y in zip(factor.vals, exact):
+            self.assertAlmostEqual(x, y, delta=.1)
+
+    def test_fallbackthreads(self):
+        self.fn.memorybudget = 0
+        self.fn.fallback = TableCPDFactorization.condprobgibbs
+        self.fn.fallbacksamples = 200
+        factorlist = self.fn.factorlist
+        queries = [(dict(Intelligence=''), dict(Letter=letter))
+                   for letter in ['weak', 'strong']] * 4
+        with ThreadPoolExecutor(4) as executor:
+            factors = list(executor.map(
+                lambda q: self.fn.condprobve(*q), queries))
+        for factor in factors:
+            self.assertEqual(factor.scope, ["Intelligence"])
+            self.assertAlmostEqual(sum(factor.vals), 1)
+        self.assertTrue(self.fn.factorlist is factorlist)
+
+class TestEliminationOrder(unittest.TestCase):
+
+    def setUp(self):
+        # a star: eliminating the centre first joins all the leaves
+        self.scopes = [["c", "a"], ["c", "b"], ["c", "d"], ["a"]]
+        self.card = dict(a=2, b=3, c=2, d=2)
+
+    def test_heuristics(self):
+        for heuristic in ["mindegree", "minfill", "weightedminfill"]:
+            order, size = eliminationorder(
+                self.scopes, self.card, ["c", "a", "b", "d"], heuristic)
+            self.assertNotEqual(order[0], "c")
+            self.assertEqual(size, 6)
+
+    def test_explicitorder(self):
+        order, size = eliminationorder(
+            self.scopes, self.card, ["a", "b", "c", "d"], ["c", "d"])
+        self.assertEqual(order, ["c", "d", "a", "b"])
+        self.assertEqual(size, 24)
+
+    def test_contractionpath(self):
+        # multiplying the first two factors first would join a, b and d
+        scopes = [["c", "a", "b"], ["c", "d"], ["c", "a", "b"]]
+        card = dict(a=3, b=3, c=3, d=3)
+        for heuristic in ["greedy", "optimal"]:
+            path, size = contractionpath(scopes, card, ["c"], heuristic)
+            self.assertEqual(path, [(0, 2), (0, 1)])
+            self.assertEqual(size, 27)
+        self.assertEqual(contractionpath([["a"]], card), ([], 3))
+
+    def test_contractionfactorization(self):
+        nodedata = NodeData.load("unittestdict.txt")
+        bn = DiscreteBayesianNetwork(nodedata)
+        evidence = dict(Letter='weak')
+        query = dict(Intelligence='')
+        results = []
+        for contraction in [None, "greedy", "optimal"]:
+            for plancachesize in [0, 128]:
+                fn = TableCPDFactorization(bn)
+                fn.contraction = contraction
+                fn.plancachesize = plancachesize
+                results.append(fn.condprobve(query, evidence).vals)
+                self.assertEqual(len(fn.paths), len(fn.order) + 1)
+                if contraction is None:
+                    self.assertTrue(all(path is None for _, path in fn.paths))
+        for vals in results[1:]:
+            for x, y in zip(vals, results[0]):
+                self.assertAlmostEqual(x, y)
+
+    def test_factorization(self):
+        skel = GraphSkeleton()
+        skel.load("unittestdict.txt")
+        skel.toporder()
+        nodedata = NodeData.load("unittestdict.txt")
+        bn = DiscreteBayesianNetwork(nodedata)
+        evidence = dict(Grade='C', SAT='highscore')
+        query = dict(Intelligence='high')
+        results = []
+        for heuristic in ["minfill", bn.V]:
+            fn = TableCPDFactorization(bn, heuristic=heuristic)
+            results.append(fn.condprobve(query, evidence).vals)
+            self.assertEqual(fn.order, ["Difficulty"])
+            self.assertTrue(fn.maxfactorsize >= 2)
+        for x in range(2):
+            self.assertAlmostEqual(results[0][x], results[1][x])
+
+class TestJunctionTree(unittest.TestCase):
+
+    def setUp(self):
+        nodedata = NodeData.load("unittestdict.txt")
+        self.bn = DiscreteBayesianNetwork(nodedata)
+        self.jt = JunctionTree(self.bn)
+
+    def test_constructor(self):
+        for vertex in self.bn.V:
+            family = [vertex] + self.bn.Vdata[vertex]["parents"]
+            self.assertTrue(any(set(family) <= set(clique)
+                                for clique in self.jt.cliques))
+        edges = sum(len(neighbours) for neighbours in self.jt.neighbours)
+        self.assertEqual(edges, 2 * (len(self.jt.cliques) - 1))
+
+    def test_marginals(self):
+        evidence = dict(Grade='C', SAT='highscore')
+        marginals = self.jt.marginals(evidence)
+        self.assertAlmostEqual(marginals["Intelligence"]["high"], .578, 2)
+        self.assertEqual(marginals["Grade"]["C"], 1.0)
+        for vertex in ["Difficulty", "Letter"]:
+            fn = TableCPDFactorization(self.bn)
+            factor = fn.condprobve(dict.fromkeys([vertex]), evidence)
+            for value, p in zip(self.bn.Vdata[vertex]["vals"], factor.vals):
+                self.assertAlmostEqual(marginals[vertex][value], p)
+
+    def test_specificquery(self):
+        evidence = dict(Difficulty='easy')
+        query = dict(Grade=['A', 'B'])
+        answer = self.jt.specificquery(query, evidence)
+        self.assertTrue(abs(answer - .784) < .01)
+        # spans more than one clique, answered by variable elimination
+        query = dict(Letter=['weak'], SAT=['highscore'])
+        answer = self.jt.specificquery(query, evidence)
+        fn = TableCPDFactorization(self.bn)
+        self.assertAlmostEqual(answer, fn.specificquery(query, evidence))
+
+    def test_threads(self):
+        queries = [(dict(Grade=[grade]), dict(Letter=letter, SAT=sat))
+                   for grade in ['A', 'B', 'C']
+                   for letter in ['weak', 'strong']
+                   for sat in ['lowscore', 'highscore']] * 10
+        fn = TableCPDFactorization(self.bn)
+        expected = [fn.specificquery(*q) for q in queries[:12]] * 10
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(
+                lambda q: self.jt.specificquery(*q), queries))
+        for result, exp in zip(results, expected):
+            self.assertAlmostEqual(result, exp)
+
+    def test_impossibleevidence(self):
+        # a strong letter is impossible here; the result stays all zero
+        self.bn.Vdata["Letter"]["cprob"] = dict(
+            (key, [1., 0.]) for key in self.bn.Vdata["Letter"]["cprob"])
+        jt = JunctionTree(self.bn)
+        factor = jt.condprobve(dict(Grade=''), dict(Letter='strong'))
+        self.assertEqual(list(factor.vals), [0., 0., 0.])
+        marginals = jt.marginals(dict(Letter='strong'))
+        for vertex in self.bn.V:
+            self.assertEqual(set(marginals[vertex].values()), {0.})
+
+class TestMiniBucket(unittest.TestCase):
+
+    def setUp(self):
+        nodedata = NodeData.load("unittestdict.txt")
+        self.bn = DiscreteBayesianNetwork(nodedata)
+        self.query = dict(Grade=['A'])
+        self.evidence = dict(Letter='weak')
+        fn = TableCPDFactorization(self.bn)
+        self.exact = fn.specificquery(self.query, self.evidence)
+
+    def test_specificquery(self):
+        for factortype in [TableCPDFactor, ArrayCPDFactor, SparseCPDFactor]:
+            mb = MiniBucket(self.bn, ibound=1, factortype=factortype)
+            lower, upper = mb.specificquery(self.query, self.evidence)
+            self.assertFalse(mb.exact)
+            self.assertTrue(0 < lower < self.exact < upper < 1)
+            lower, upper = mb.specificquery(self.query, self.evidence, 3)
+            self.assertTrue(mb.exact)
+            self.assertAlmostEqual(lower, self.exact)
+            self.assertAlmostEqual(upper, self.exact)
+
+    def test_anytimequery(self):
+        mb = MiniBucket(self.bn)
+        mb.prune = False
+        bounds = list(mb.anytimequery(self.query, self.evidence))
+        self.assertEqual([ibound for ibound, _, _ in bounds], [1, 2, 3])
+        for (_, lower, upper), (_, lower2, upper2) in zip(bounds, bounds[1:]):
+            self.assertTrue(lower <= lower2 <= upper2 <= upper)
+        self.assertAlmostEqual(bounds[-1][1], self.exact)
+
+class TestLoopyBP(unittest.TestCase):
+
+    def setUp(self):
+        nodedata = NodeData.load("unittestdict.txt")
+        self.bn = DiscreteBayesianNetwork(nodedata)
+        self.evidence = dict(Grade='C', SAT='highscore')
+
+    def test_polytree(self):
+        # without undirected cycles the beliefs are exact
+        exact = JunctionTree(self.bn).marginals(self.evidence)
+        for schedule in ["flooding", "residual"]:
+            for damping in [0., .5]:
+                bp = LoopyBP(self.bn, schedule, damping)
+                marginals = bp.marginals(self.evidence)
+                self.assertTrue(bp.converged)
+                for vertex in self.bn.V:
+                    for value, p in exact[vertex].items():
+                        self.assertAlmostEqual(marginals[vertex][value], p, 4)
+
+    def test_condprobve(self):
+        bp = LoopyBP(self.bn)
+        fn = TableCPDFactorization(self.bn)
+        query = dict(Intelligence=['high'], Difficulty=['easy'])
+        self.assertAlmostEqual(bp.specificquery(query, self.evidence),
+                               fn.specificquery(query, self.evidence))
+        updates = bp.updates
+        bp.condprobve(dict(Letter=''), self.evidence)
+        self.assertEqual(bp.updates, updates)
+
+    def test_loopy(self):
+        nodedata = NodeData()
+        nodedata.Vdata = dict(
+            A=dict(parents=[], vals=['a', 'b'], cprob=[.3, .7]),
+            B=dict(parents=["A"], vals=['a', 'b'],
+                   cprob={('a',): [.8, .2], ('b',): [.3, .7]}),
+            C=dict(parents=["A"], vals=['a', 'b'],
+                   cprob={('a',): [.6, .4], ('b',): [.1, .9]}),
+            D=dict(parents=["B", "C"], vals=['a', 'b'],
+                   cprob={('a', 'a'): [.9, .1], ('a', 'b'): [.5, .5],
+                          ('b', 'a'): [.4, .6], ('b', 'b'): [.2, .8]}))
+        bn = DiscreteBayesianNetwork(nodedata)
+        exact = JunctionTree(bn).marginals(dict(D='a'))
+        bp = LoopyBP(bn, "residual")
+        marginals = bp.marginals(dict(D='a'))
+        self.assertTrue(bp.converged)
+        self.assertAlmostEqual(marginals["A"]['a'], exact["A"]['a'], 1)
+        bp = LoopyBP(bn, maxiterations=1)
+        bp.marginals(dict(D='a'))
+        self.assertFalse(bp.converged)
+        self.assertEqual(bp.updates, len(bp.factors))
+
+class TestPolytreeBP(unittest.TestCase):
+
+    def setUp(self):
+        nodedata = NodeData.load("unittestdict.txt")
+        self.bn = DiscreteBayesianNetwork(nodedata)
+        self.bp = PolytreeBP(self.bn)
+
+    def test_marginals(self):
+        jt = JunctionTree(self.bn)
+        for evidence in [{}, dict(Grade='C', SAT='highscore'), dict(Letter='weak')]:
+            exact = jt.marginals(evidence)
+            marginals = self.bp.marginals(evidence)
+            for vertex in self.bn.V:
+                for value, p in exact[vertex].items():
+                    self.assertAlmostEqual(marginals[vertex][value], p)
+
+    def test_specificquery(self):
+        fn = TableCPDFactorization(self.bn)
+        evidence = dict(Difficulty='easy')
+        # in one family, and across families by variable elimination
+        for query in [dict(Grade=['A'], Intelligence=['high']),
+                      dict(Letter=['weak'], SAT=['highscore'])]:
+            self.assertAlmostEqual(self.bp.specificquery(query, evidence),
+                                   fn.specificquery(query, evidence))
+
+    def test_probability(self):
+        fn = TableCPDFactorization(self.bn)
+        self.assertAlmostEqual(self.bp.probability(), 1)
+        evidence = dict(Grade='C', SAT='highscore')
+        self.assertAlmostEqual(
+            self.bp.probability(evidence),
+            fn.specificquery(dict(Grade=['C'], SAT=['highscore']), {}))
+
+    def test_discretebayesiannetwork(self):
+        self.assertTrue(isinstance(self.bn.factorization(), PolytreeBP))
+        evidence = dict(Letter='weak')
+        marginals = self.bn.marginals(evidence)
+        self.assertEqual(marginals, self.bp.marginals(evidence))
+        # a diamond is not a polytree
+        nodedata = NodeData.load("unittestdict.txt")
+        nodedata.Vdata["SAT"]["parents"].append("Difficulty")
+        nodedata.Vdata["SAT"]["cprob"] = dict(
+            (key + (difficulty,), cprob)
+            for key, cprob in nodedata.Vdata["SAT"]["cprob"].items()
+            for difficulty in ["easy", "hard"])
+        bn = DiscreteBayesianNetwork(nodedata)
+        self.assertFalse(bn.ispolytree())
+        self.assertFalse(isinstance(bn.factorization(), PolytreeBP))
+        self.assertRaises(AssertionError, PolytreeBP, bn)
+        for value, p in bn.marginals(evidence)["Grade"].items():
+            self.assertAlmostEqual(p, marginals["Grade"][value])
+
+class TestArithmeticCircuit(unittest.TestCase):
+
+    def setUp(self):
+        nodedata = NodeData.load("unittestdict.txt")
+        self.bn = DiscreteBayesianNetwork(nodedata)
+        self.ac = ArithmeticCircuit(self.bn)
+
+    def test_evaluate(self):
+        values = self.ac.evaluate([{}, dict(Letter='weak'), dict(Letter='strong')])
+        self.assertAlmostEqual(values[self.ac.root, 0], 1)
+        self.assertAlmostEqual(values[self.ac.root, 1] + values[self.ac.root, 2], 1)
+        fn = TableCPDFactorization(self.bn)
+        self.assertAlmostEqual(self.ac.probability(dict(Letter='weak')),
+                               fn.specificquery(dict(Letter=['weak']), {}))
+
+    def test_specificquery(self):
+        fn = TableCPDFactorization(self.bn)
+        evidence = dict(Difficulty='easy')
+        for query in [dict(Grade=['A', 'B'], Intelligence=['high']),
+                      dict(Letter=['weak'], SAT=['highscore'])]:
+            self.assertAlmostEqual(self.ac.specificquery(query, evidence),
+                                   fn.specificquery(query, evidence))
+
+    def test_marginals(self):
+        jt = JunctionTree(self.bn)
+        for evidence in [{}, dict(Grade='C', SAT='highscore')]:
+            exact = jt.marginals(evidence)
+            marginals = self.ac.marginals(evidence)
+            for vertex in self.bn.V:
+                for value, p in exact[vertex].items():
+                    self.assertAlmostEqual(marginals[vertex][value], p)
+
+    def test_sensitivity(self):
+        query = dict(Grade=['A'])
+        evidence = dict(Letter='weak')
+        sensitivity = self.ac.sensitivity(query, evidence)
+        self.assertEqual(sensitivity, self.bn.sensitivity(query, evidence))
+        self.assertEqual(len(sensitivity["Intelligence"]), 2)
+        self.assertEqual(set(sensitivity["Grade"]),
+                         set(self.bn.Vdata["Grade"]["cprob"]))
+        # against finite differences of each parameter
+        derivatives = self.ac.keyed(range(len(self.ac.parameters)))
+        probability = self.ac.specificquery(query, evidence)
+        for vertex in ["Intelligence", "Grade"]:
+            cprob = sensitivity[vertex]
+            indices = derivatives[vertex]
+            if isinstance(cprob, dict):
+                cprob = sum(cprob.values(), [])
+                indices = sum(indices.values(), [])
+            for i, derivative in zip(indices, cprob):
+                self.ac.parameters[i] += 1e-7
+                difference = self.ac.specificquery(query, evidence) - probability
+                self.ac.parameters[i] -= 1e-7
+                self.assertAlmostEqual(difference / 1e-7, derivative, 5)
+
+    def test_saveload(self):
+        handle, path = tempfile.mkstemp(suffix=".npz")
+        os.close(handle)
+        try:
+            self.ac.save(path)
+            ac = ArithmeticCircuit.load(path)
+        finally:
+            os.remove(path)
+        self.assertEqual(ac.size, self.ac.size)
+        evidence = dict(Letter='weak')
+        self.assertEqual(ac.marginals(evidence), self.ac.marginals(evidence))
+
+class TestRecursiveConditioning(unittest.TestCase):
+
+    def setUp(self):
+        nodedata = NodeData.load("unittestdict.txt")
+        self.bn = DiscreteBayesianNetwork(nodedata)
+        self.rc = RecursiveConditioning(self.bn)
+
+    def test_dtree(self):
+        leaves = [node for node, factor in enumerate(self.rc.factors)
+                  if factor is not None]
+        self.assertEqual(len(leaves), len(self.bn.V))
+        self.assertEqual(self.rc.vars[self.rc.root], set(self.bn.V))
+        self.assertEqual(self.rc.context[self.rc.root], [])
+        self.assertAlmostEqual(self.rc.probability(), 1)
+
+    def test_specificquery(self):
+        fn = TableCPDFactorization(self.bn)
+        evidence = dict(Difficulty='easy')
+        query = dict(Letter=['weak'], SAT=['highscore'])
+        exact = fn.specificquery(query, evidence)
+        calls = []
+        for cachesize in [0, 2, None]:
+            self.rc.allocate(cachesize)
+            cached = [self.rc.contextsize(node)
+                      for node, cached in enumerate(self.rc.cached) if cached]
+            if cachesize is not None:
+                self.assertTrue(sum(cached) <= cachesize)
+            self.assertAlmostEqual(self.rc.specificquery(query, evidence), exact)
+            calls.append(self.rc.calls)
+        self.assertEqual(calls, sorted(calls, reverse=True))
+        self.assertTrue(calls[-1] < calls[0])
+
+    def test_condprobve(self):
+        evidence = dict(Grade='C', SAT='highscore')
+        exact = JunctionTree(self.bn).marginals(evidence)
+        factor = self.rc.condprobve(dict(Intelligence=''), evidence)
+        for value, p in zip(self.bn.Vdata["Intelligence"]["vals"], factor.vals):
+            self.assertAlmostEqual(p, exact["Intelligence"][value])
+
+class TestCutsetConditioning(unittest.TestCase):
+
+    def setUp(self):
+        # make SAT depend on Difficulty too, closing a loop
+        nodedata = NodeData.load("unittestdict.txt")
+        nodedata.Vdata["SAT"]["parents"].append("Difficulty")
+        nodedata.Vdata["SAT"]["cprob"] = dict(
+            (key + (difficulty,), cprob)
+            for key, cprob in nodedata.Vdata["SAT"]["cprob"].items()
+            for difficulty in ["easy", "hard"])
+        self.bn = DiscreteBayesianNetwork(nodedata)
+        self.jt = JunctionTree(self.bn)
+
+    def test_marginals(self):
+        for workers in [0, 2]:
+            cc = CutsetConditioning(self.bn, workers=workers)
+            self.assertEqual(len(cc.cutset), 1)
+            try:
+                for evidence in [{}, dict(Grade='C', SAT='highscore'),
+                                 {cc.cutset[0]: self.bn.Vdata[cc.cutset[0]]["vals"][0]}]:
+                    exact = self.jt.marginals(evidence)
+                    marginals = cc.marginals(evidence)
+                    for vertex in self.bn.V:
+                        for value, p in exact[vertex].items():
+                            self.assertAlmostEqual(marginals[vertex][value], p)
+            finally:
+                cc.shutdown()
+
+    def test_specificquery(self):
+        cc = CutsetConditioning(self.bn, workers=0)
+        evidence = dict(Letter='weak')
+        for query in [dict(Grade=['A']), dict(Grade=['A'], SAT=['highscore'])]:
+            self.assertAlmostEqual(cc.specificquery(query, evidence),
+                                   self.jt.specificquery(query, evidence))
+
+class TestInferenceSession(unittest.TestCase):
+
+    def setUp(self):
+        nodedata = NodeData.load("unittestdict.txt")
+        self.bn = DiscreteBayesianNetwork(nodedata)
+        self.jt = JunctionTree(self.bn)
+
+    def test_evidence(self):
+        session = self.jt.newsession()
+        session.setevidence("Letter", "weak")
+        session.setevidence("SAT", "highscore")
+        session.setevidence("Letter", "strong")
+        session.retractevidence("SAT")
+        self.assertEqual(session.evidence, dict(Letter="strong"))
+        fresh = self.jt.newsession(dict(Letter="strong"))
+        for vertex in self.bn.V:
+            for value, p in fresh.marginal(vertex).items():
+                self.assertAlmostEqual(session.marginal(vertex)[value], p)
+
+    def test_incremental(self):
+        session = self.jt.newsession()
+        session.marginals()
+        computed = session.computed
+        self.assertEqual(computed, 2 * (len(self.jt.cliques) - 1))
+        # only the messages leading away from the clique of SAT change
+        session.setevidence("SAT", "highscore")
+        session.marginal("SAT")
+        self.assertEqual(session.computed, computed)
+        session.marginals()
+        self.assertTrue(session.computed - computed < computed)
+
 class TestSampleAggregator(unittest.TestCase):
 
     def setUp(self):